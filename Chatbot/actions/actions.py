@@ -1,5 +1,8 @@
 from typing import Any, Text, Dict, List
 import os
+import random
+import threading
+import time
 import requests
 
 from rasa_sdk import Action, Tracker
@@ -7,13 +10,79 @@ from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet
 
 
-# Conexión directa a Ollama
+# Conexión directa a Ollama; acepta varias URLs separadas por comas
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://ollama:11434")
+OLLAMA_HOSTS = [url.strip().rstrip("/") for url in OLLAMA_HOST.split(",") if url.strip()]
 LLM_MODEL = os.getenv("LLM_MODEL", "llama3:8b")
+# Mismo contexto que usa el backend con el modelo (OLLAMA_NUM_CTX); otro valor
+# hace que Ollama recargue el modelo al alternar con la generación SCT
+LLM_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
 BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8001")
+# Las consultas pasan por el gateway del backend, que prioriza el chat sobre
+# la generación de tests SCT. Con LLM_GATEWAY_URL vacío se llama directo a Ollama.
+LLM_GATEWAY_URL = os.getenv("LLM_GATEWAY_URL", f"{BACKEND_URL}/api/llm/chat")
 TB_IMAGE_API_URL = os.getenv("TB_IMAGE_API_URL", "http://tb-image-service:8001/analyze")
 
 
+# Errores seguidos tras los que un nodo de Ollama se deja de usar un tiempo
+OLLAMA_EJECT_FAILURES = int(os.getenv("OLLAMA_EJECT_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+
+_nodos_lock = threading.Lock()
+_nodos = {url: {"en_curso": 0, "fallos": 0, "excluido_hasta": 0.0} for url in OLLAMA_HOSTS}
+
+
+def _elegir_nodo(descartados: List[str]) -> str:
+    """Nodo no excluido con menos consultas en curso"""
+    with _nodos_lock:
+        ahora = time.monotonic()
+        candidatos = [url for url in OLLAMA_HOSTS if url not in descartados]
+        disponibles = [url for url in candidatos if _nodos[url]["excluido_hasta"] <= ahora] or candidatos
+        menor = min(_nodos[url]["en_curso"] for url in disponibles)
+        url = random.choice([url for url in disponibles if _nodos[url]["en_curso"] == menor])
+        _nodos[url]["en_curso"] += 1
+        return url
+
+
+def _liberar_nodo(url: str, ok: bool) -> None:
+    with _nodos_lock:
+        nodo = _nodos[url]
+        nodo["en_curso"] -= 1
+        if ok:
+            nodo["fallos"] = 0
+            return
+        nodo["fallos"] += 1
+        if nodo["fallos"] >= OLLAMA_EJECT_FAILURES:
+            nodo["fallos"] = 0
+            nodo["excluido_hasta"] = time.monotonic() + OLLAMA_EJECT_SECONDS
+            print(f"[WARN] Nodo de Ollama {url} excluido por {OLLAMA_EJECT_SECONDS:.0f}s")
+
+
+def _post_ollama(path: str, payload: Dict[str, Any], timeout: float) -> requests.Response:
+    """
+    POST directo a Ollama balanceando entre OLLAMA_HOST. Si un nodo no
+    responde o devuelve 502/503/504, se reintenta una vez en otro nodo.
+    """
+    descartados: List[str] = []
+    intentos = min(2, len(OLLAMA_HOSTS))
+    for intento in range(intentos):
+        url = _elegir_nodo(descartados)
+        descartados.append(url)
+        try:
+            resp = requests.post(f"{url}{path}", json=payload, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            _liberar_nodo(url, ok=False)
+            if intento + 1 >= intentos:
+                raise
+            continue
+        ok = resp.status_code < 500
+        _liberar_nodo(url, ok)
+        if resp.status_code in (502, 503, 504) and intento + 1 < intentos:
+            continue
+        return resp
+    raise requests.ConnectionError("No hay nodos de Ollama disponibles")
+
+
 class ActionGuardarUltimaPregunta(Action):
     def name(self) -> Text:
         return "action_guardar_ultima_pregunta"
@@ -123,18 +192,35 @@ class ActionConsultarLLMMedico(Action):
         ]
 
         try:
-            # Llamada directa a Ollama
-            resp = requests.post(
-                f"{OLLAMA_HOST}/api/chat",
-                json={
-                    "model": LLM_MODEL,
-                    "messages": messages,
-                    "stream": False
-                },
-                timeout=120
-            )
+            payload = {
+                "model": LLM_MODEL,
+                "messages": messages,
+                "stream": False,
+                "options": {"num_ctx": LLM_NUM_CTX}
+            }
+            if LLM_GATEWAY_URL:
+                # A través del gateway del backend (que balancea entre sus nodos)
+                resp = requests.post(LLM_GATEWAY_URL, json=payload, timeout=120)
+            else:
+                resp = _post_ollama("/api/chat", payload, timeout=120)
+            if resp.status_code in (429, 503):
+                # Modelo saturado: avisar cuándo reintentar
+                espera = resp.headers.get("Retry-After", "unos")
+                dispatcher.utter_message(text=(
+                    "El modelo educativo está atendiendo muchas consultas en este momento. "
+                    f"Intenta nuevamente en {espera} segundos."
+                ))
+                return []
             resp.raise_for_status()
             data = resp.json()
+            # Tiempos que informa Ollama (ns); el backend los expone en /metrics
+            if "eval_count" in data:
+                print(
+                    f"[INFO] LLM ({intent}): prompt {data.get('prompt_eval_count', 0)} tokens en "
+                    f"{data.get('prompt_eval_duration', 0) / 1e6:.0f}ms, "
+                    f"{data.get('eval_count', 0)} tokens generados en {data.get('eval_duration', 0) / 1e6:.0f}ms, "
+                    f"carga {data.get('load_duration', 0) / 1e6:.0f}ms"
+                )
             respuesta_modelo = data.get("message", {}).get("content", "")
             
             if not respuesta_modelo:
@@ -0,0 +1,381 @@
+"""
+Importación masiva de láminas desde un directorio del servidor.
+
+    python -m app.bulk_import /mnt/laminas/2026-1 [--pathology-type Necrosis]
+
+1. Recorre el directorio y omite los archivos ya importados (misma ruta de
+   origen y tamaño), por lo que se puede volver a ejecutar sin duplicar nada.
+2. Copia los archivos a uploads/medical_images calculando su sha256 en un
+   pool de hilos (--workers) y muestra el throughput de cada archivo y el ETA.
+3. Registra las imágenes en lotes (--batch-size) con una transacción por
+   lote; si el contenido ya existe (en la BD o repetido en el directorio) el
+   registro comparte el archivo y los tiles, como en /upload.
+4. Genera los tiles de los SVS con el pool de procesos de tiling, con a lo
+   sumo --tiling-jobs láminas a la vez. Al volver a ejecutar se retoman los
+   trabajos de tiling que quedaron sin terminar.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from .db import SessionLocal, engine
+from .schema_migrations import upgrade_schema
+from .models import MedicalImage, TilingJob, User
+from . import chunked_uploads
+from .slide_cache import dzi_paths, dzi_tiles_url, build_dzi_xml
+from .slide_metadata import extract_metadata, apply_metadata, copy_metadata
+from .tiling_jobs import create_tiling_job, run_job, shutdown_tiling_pool
+from .routers.medical_images import router, UPLOAD_DIR, ALLOWED_EXTENSIONS
+
+COPY_BLOCK_SIZE = chunked_uploads.UPLOAD_CHUNK_SIZE
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+class Progress:
+    """Throughput y ETA acumulados, seguro entre hilos"""
+
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.done_files = 0
+        self.done_bytes = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def file_done(self, name: str, size: int, seconds: float) -> None:
+        with self._lock:
+            self.done_files += 1
+            self.done_bytes += size
+            elapsed = time.monotonic() - self.started
+            rate = self.done_bytes / elapsed if elapsed > 0 else 0
+            eta = (self.total_bytes - self.done_bytes) / rate if rate > 0 else 0
+            print(
+                f"[import] {self.done_files}/{self.total_files} {name}: "
+                f"{_format_bytes(size)} en {seconds:.1f}s "
+                f"({_format_bytes(size / max(seconds, 1e-6))}/s) "
+                f"- total {_format_bytes(rate)}/s, ETA {_format_seconds(eta)}"
+            )
+
+
+def scan_directory(directory: str) -> List[Tuple[str, int]]:
+    """Archivos de imagen del directorio (recursivo) como (ruta_absoluta, tamaño)"""
+    found = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in ALLOWED_EXTENSIONS:
+                path = os.path.abspath(os.path.join(root, name))
+                found.append((path, os.path.getsize(path)))
+    return sorted(found)
+
+
+def copy_and_hash(source_path: str) -> Tuple[str, str, float]:
+    """
+    Copia el archivo a uploads/incoming calculando su sha256 en la misma
+    lectura. Retorna (archivo_parcial, sha256, segundos).
+    """
+    started = time.monotonic()
+    part_file = chunked_uploads.part_path(str(uuid.uuid4()))
+    hasher = hashlib.sha256()
+    try:
+        with open(source_path, "rb") as source, open(part_file, "wb") as target:
+            while True:
+                block = source.read(COPY_BLOCK_SIZE)
+                if not block:
+                    break
+                hasher.update(block)
+                target.write(block)
+    except BaseException:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    return part_file, hasher.hexdigest(), time.monotonic() - started
+
+
+class BulkImporter:
+    def __init__(
+        self,
+        directory: str,
+        user: User,
+        pathology_type: Optional[str],
+        workers: int,
+        batch_size: int,
+        tiling_jobs: int,
+        tiling: bool,
+    ):
+        self.directory = directory
+        self.user_id = user.id
+        self.pathology_type = pathology_type
+        self.workers = workers
+        self.batch_size = batch_size
+        self.tiling = tiling
+
+        self.tiling_pool = ThreadPoolExecutor(max_workers=tiling_jobs, thread_name_prefix="bulk-tiling")
+        self.tiling_futures = []
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def run(self) -> None:
+        files = scan_directory(self.directory)
+        pending = self._skip_imported(files)
+        total_bytes = sum(size for _, size in pending)
+        print(f"[import] {len(files)} archivos encontrados, {len(files) - len(pending)} ya importados, "
+              f"{len(pending)} por importar ({_format_bytes(total_bytes)})")
+
+        progress = Progress(len(pending), total_bytes)
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bulk-copy") as pool:
+            futures = {pool.submit(copy_and_hash, path): (path, size) for path, size in pending}
+            for future in as_completed(futures):
+                path, size = futures[future]
+                try:
+                    part_file, content_hash, seconds = future.result()
+                except Exception as e:
+                    self.failed += 1
+                    print(f"[import] Error copiando {path}: {e}")
+                    continue
+                progress.file_done(os.path.basename(path), size, seconds)
+                batch.append((path, part_file, content_hash))
+                if len(batch) >= self.batch_size:
+                    self._register_batch(batch)
+                    batch = []
+        if batch:
+            self._register_batch(batch)
+
+        print(f"[import] Registro terminado: {self.imported} nuevas, {self.duplicates} deduplicadas, "
+              f"{self.failed} con error")
+        self._wait_tiling()
+
+    def _skip_imported(self, files: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Omite los archivos ya importados y retoma su tiling si quedó a medias"""
+        db = SessionLocal()
+        try:
+            imported = {
+                (source_path, file_size): image_id
+                for image_id, source_path, file_size in db.query(
+                    MedicalImage.id, MedicalImage.source_path, MedicalImage.file_size
+                ).filter(MedicalImage.source_path.isnot(None))
+            }
+            resumable = set()
+            if self.tiling and imported:
+                resumable = {
+                    image_id for (image_id,) in db.query(TilingJob.image_id).filter(
+                        TilingJob.image_id.in_(imported.values()),
+                        TilingJob.status.in_(["pending", "running", "failed"])
+                    )
+                }
+        finally:
+            db.close()
+
+        pending = []
+        for path, size in files:
+            image_id = imported.get((path, size))
+            if image_id is None:
+                pending.append((path, size))
+            elif image_id in resumable:
+                self._submit_tiling(image_id, os.path.basename(path))
+        return pending
+
+    def _register_batch(self, batch: List[Tuple[str, str, str]]) -> None:
+        """
+        Registra un lote de archivos copiados en una sola transacción. Si el
+        contenido ya existe (en la BD o antes en el mismo lote) el registro
+        comparte el archivo y los tiles existentes, como en /upload.
+        Si el lote falla se borran los archivos que escribió y se cuenta como
+        error; sus archivos se reintentan al volver a ejecutar la importación.
+        """
+        db = SessionLocal()
+        # Archivos escritos por este lote, se borran si la transacción falla
+        created = []
+        try:
+            sources = {}
+            for image in db.query(MedicalImage).filter(
+                MedicalImage.content_hash.in_([content_hash for _, _, content_hash in batch])
+            ).order_by(MedicalImage.id):
+                if os.path.exists(image.file_path):
+                    sources.setdefault(image.content_hash, image)
+
+            images, duplicates = [], []
+            for source_path, part_file, content_hash in batch:
+                source = sources.get(content_hash)
+                if source is not None:
+                    os.remove(part_file)
+                    duplicates.append((self._build_image(source_path, source.file_path, content_hash, source), source))
+                    print(f"[import] {os.path.basename(source_path)}: contenido ya existente, se comparte el archivo")
+                    continue
+                file_path = os.path.join(UPLOAD_DIR, f"{content_hash}{os.path.splitext(source_path)[1].lower()}")
+                os.replace(part_file, file_path)
+                created.append(file_path)
+                image = self._build_image(source_path, file_path, content_hash)
+                sources[content_hash] = image
+                images.append(image)
+
+            db.add_all(images + [image for image, _ in duplicates])
+            db.flush()
+
+            # Con los ids asignados se escriben los descriptores DZI de los SVS
+            for image in images:
+                if image.file_type == "svs" and image.width is not None:
+                    dzi_path, _ = dzi_paths(image.stored_name)
+                    created.append(dzi_path)
+                    with open(dzi_path, "w") as f:
+                        f.write(build_dzi_xml(image.width, image.height, dzi_tiles_url(router.prefix, image.id)))
+                    image.dzi_path = dzi_path
+            for image, source in duplicates:
+                image.dzi_path = source.dzi_path
+
+            db.commit()
+            self.imported += len(images)
+            self.duplicates += len(duplicates)
+            print(f"[import] Lote registrado: {len(images)} nuevas, {len(duplicates)} deduplicadas")
+
+            tiling = [(image.id, image.original_filename) for image in images if image.dzi_path]
+        except Exception as e:
+            db.rollback()
+            for path in created + [part_file for _, part_file, _ in batch]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.failed += len(batch)
+            print(f"[import] Error registrando un lote de {len(batch)} archivos: {e}")
+            return
+        finally:
+            db.close()
+
+        for image_id, name in tiling:
+            self._submit_tiling(image_id, name)
+
+    def _build_image(
+        self,
+        source_path: str,
+        file_path: str,
+        content_hash: str,
+        source: Optional[MedicalImage] = None,
+    ) -> MedicalImage:
+        name = os.path.basename(source_path)
+        file_extension = os.path.splitext(name)[1].lower()
+        image = MedicalImage(
+            filename=f"{uuid.uuid4()}{file_extension}",
+            original_filename=name,
+            title=os.path.splitext(name)[0],
+            pathology_type=self.pathology_type,
+            file_type=file_extension[1:],
+            file_size=os.path.getsize(file_path),
+            file_path=file_path,
+            content_hash=content_hash,
+            source_path=source_path,
+            uploaded_by=self.user_id
+        )
+        if source is not None:
+            copy_metadata(source, image)
+            return image
+        try:
+            apply_metadata(image, extract_metadata(file_path, image.file_type))
+        except Exception as e:
+            print(f"[import] {name}: no se pudieron leer los metadatos: {e}")
+        return image
+
+    def _submit_tiling(self, image_id: int, name: str) -> None:
+        if self.tiling:
+            job_id = create_tiling_job(image_id)
+            self.tiling_futures.append(self.tiling_pool.submit(self._run_tiling, job_id, name))
+
+    def _run_tiling(self, job_id: int, name: str):
+        started = time.monotonic()
+        run_job(job_id)
+        seconds = time.monotonic() - started
+
+        db = SessionLocal()
+        try:
+            job = db.query(TilingJob).filter(TilingJob.id == job_id).first()
+            return name, job.status, job.done_tiles or 0, job.skipped_tiles or 0, job.error, seconds
+        finally:
+            db.close()
+
+    def _wait_tiling(self) -> None:
+        total = len(self.tiling_futures)
+        if not total:
+            return
+        print(f"[import] Generando tiles de {total} láminas")
+
+        started = time.monotonic()
+        for done, future in enumerate(as_completed(self.tiling_futures), start=1):
+            name, status, tiles, skipped, error, seconds = future.result()
+            elapsed = time.monotonic() - started
+            eta = elapsed / done * (total - done)
+            detail = f"{tiles} tiles ({skipped} de fondo) en {seconds:.1f}s, {tiles / max(seconds, 1e-6):.0f} tiles/s"
+            if status != "done":
+                detail = f"{status}: {error}"
+            print(f"[import] tiling {done}/{total} {name}: {detail} - ETA {_format_seconds(eta)}")
+        self.tiling_pool.shutdown()
+
+
+def _resolve_user(db, email: Optional[str]) -> User:
+    query = db.query(User)
+    if email:
+        user = query.filter(User.email == email).first()
+    else:
+        user = query.filter(User.role == "administrador").order_by(User.id).first()
+    if user is None:
+        print("[import] Usuario no encontrado; indique uno existente con --user")
+        sys.exit(1)
+    return user
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.bulk_import", description="Importación masiva de láminas")
+    parser.add_argument("directory", help="directorio del servidor con las láminas")
+    parser.add_argument("--user", help="email del usuario que figura como autor (default: primer administrador)")
+    parser.add_argument("--pathology-type", help="tipo de patología para todas las láminas")
+    parser.add_argument("--workers", type=int, default=4, help="copias y hashes simultáneos (default: 4)")
+    parser.add_argument("--batch-size", type=int, default=50, help="imágenes por transacción (default: 50)")
+    parser.add_argument("--tiling-jobs", type=int, default=1, help="láminas procesando tiles a la vez (default: 1)")
+    parser.add_argument("--no-tiling", action="store_true", help="solo registrar, sin generar tiles")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"no es un directorio: {args.directory}")
+
+    upgrade_schema(engine)
+    db = SessionLocal()
+    try:
+        user = _resolve_user(db, args.user)
+    finally:
+        db.close()
+
+    importer = BulkImporter(
+        args.directory,
+        user,
+        pathology_type=args.pathology_type,
+        workers=max(args.workers, 1),
+        batch_size=max(args.batch_size, 1),
+        tiling_jobs=max(args.tiling_jobs, 1),
+        tiling=not args.no_tiling,
+    )
+    try:
+        importer.run()
+    finally:
+        shutdown_tiling_pool()
+
+
+if __name__ == "__main__":
+    main()
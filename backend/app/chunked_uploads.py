@@ -0,0 +1,114 @@
+"""
+Soporte para subidas reanudables por partes (chunks).
+
+Los chunks se reciben en orden y se agregan a un archivo parcial en
+uploads/incoming, calculando el sha256 de forma incremental. El estado del
+hash vive en memoria; si el servidor se reinicia se reconstruye leyendo el
+archivo parcial hasta el último byte confirmado en la BD.
+"""
+import hashlib
+import os
+import threading
+from typing import Tuple
+
+INCOMING_DIR = "uploads/incoming"
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # tamaño de chunk recomendado al cliente
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+os.makedirs(INCOMING_DIR, exist_ok=True)
+
+# upload_id -> (hasher, bytes incluidos en el hash)
+_hashers = {}
+# upload_id -> lock de la subida: serializa la escritura, el hash y su
+# reconstrucción (que puede releer varios GB) sin bloquear otras subidas
+_upload_locks = {}
+# Solo protege los diccionarios; nunca se mantiene durante I/O
+_hashers_lock = threading.Lock()
+
+
+def part_path(upload_id: str) -> str:
+    return os.path.join(INCOMING_DIR, f"{upload_id}.part")
+
+
+def _rebuild_hasher(upload_id: str, received_bytes: int):
+    """Recalcula el hash del archivo parcial y descarta bytes no confirmados"""
+    hasher = hashlib.sha256()
+    path = part_path(upload_id)
+
+    if not os.path.exists(path):
+        open(path, "wb").close()
+
+    with open(path, "r+b") as f:
+        remaining = received_bytes
+        while remaining > 0:
+            block = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+        f.truncate(received_bytes)
+
+    return hasher
+
+
+def _upload_lock(upload_id: str) -> threading.Lock:
+    with _hashers_lock:
+        lock = _upload_locks.get(upload_id)
+        if lock is None:
+            lock = _upload_locks[upload_id] = threading.Lock()
+        return lock
+
+
+def _forget(upload_id: str) -> None:
+    """Quita el estado en memoria de la subida (hash y lock)"""
+    with _hashers_lock:
+        _upload_locks.pop(upload_id, None)
+        _hashers.pop(upload_id, None)
+
+
+def append_chunk(upload_id: str, received_bytes: int, data: bytes) -> int:
+    """
+    Agrega un chunk al final del archivo parcial y actualiza el hash.
+    Retorna la nueva cantidad de bytes recibidos.
+    """
+    with _upload_lock(upload_id):
+        with _hashers_lock:
+            hasher, hashed_bytes = _hashers.get(upload_id, (None, None))
+        # Si el hash en memoria no coincide con lo confirmado en la BD
+        # (reinicio o chunk que no llegó a confirmarse) se reconstruye
+        if hasher is None or hashed_bytes != received_bytes:
+            hasher = _rebuild_hasher(upload_id, received_bytes)
+
+        with open(part_path(upload_id), "r+b") as f:
+            f.seek(received_bytes)
+            f.write(data)
+            f.truncate()
+        hasher.update(data)
+        with _hashers_lock:
+            _hashers[upload_id] = (hasher, received_bytes + len(data))
+
+    return received_bytes + len(data)
+
+
+def finish(upload_id: str, received_bytes: int) -> Tuple[str, str]:
+    """
+    Cierra la subida y retorna (ruta_del_archivo_parcial, sha256_hex)
+    """
+    with _upload_lock(upload_id):
+        with _hashers_lock:
+            hasher, hashed_bytes = _hashers.get(upload_id, (None, None))
+        if hasher is None or hashed_bytes != received_bytes:
+            hasher = _rebuild_hasher(upload_id, received_bytes)
+        # El lock se quita recién al terminar, así nadie toma uno nuevo
+        # mientras se reconstruye el hash
+        _forget(upload_id)
+
+    return part_path(upload_id), hasher.hexdigest()
+
+
+def discard(upload_id: str) -> None:
+    with _upload_lock(upload_id):
+        _forget(upload_id)
+        path = part_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,44 @@
+"""
+Pools de hilos acotados para el trabajo bloqueante de los endpoints async.
+
+El event loop solo coordina: las consultas cortas a la BD van al threadpool
+de Starlette (run_in_threadpool) y el trabajo pesado a pools propios, así una
+ráfaga de previews o de subidas no agota los hilos que usan /health,
+/api/cases o /api/chat.
+
+Variables de entorno:
+  SLIDE_IO_THREADS  lectura de láminas y codificación: tiles, previews,
+                    regiones, metadatos (default: núcleos)
+  FILE_IO_THREADS   escritura de subidas, hashes y borrado de archivos
+                    (default: 4)
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SLIDE_IO_THREADS = int(os.getenv("SLIDE_IO_THREADS", str(os.cpu_count() or 1)))
+FILE_IO_THREADS = int(os.getenv("FILE_IO_THREADS", "4"))
+
+slide_executor = ThreadPoolExecutor(max_workers=SLIDE_IO_THREADS, thread_name_prefix="slide-io")
+file_executor = ThreadPoolExecutor(max_workers=FILE_IO_THREADS, thread_name_prefix="file-io")
+
+
+async def _run(executor: ThreadPoolExecutor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_slide_io(func, *args, **kwargs):
+    """Ejecuta trabajo de OpenSlide/Pillow en el pool de láminas"""
+    return await _run(slide_executor, func, *args, **kwargs)
+
+
+async def run_file_io(func, *args, **kwargs):
+    """Ejecuta escrituras, hashes o borrados de archivos en el pool de archivos"""
+    return await _run(file_executor, func, *args, **kwargs)
+
+
+def shutdown_executors() -> None:
+    slide_executor.shutdown(wait=False, cancel_futures=True)
+    file_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,263 @@
+"""
+Respuesta de archivos con soporte completo de HTTP Range (RFC 7233) y GET
+condicional (RFC 7232), pensada para las descargas de láminas de varios GB.
+
+- ETag fuerte derivado de los metadatos guardados (sha256 del contenido)
+- 304 con If-None-Match / If-Modified-Since
+- Rangos simples (206) y múltiples (multipart/byteranges), If-Range y 416
+- Lectura con os.pread en bloques de 1 MiB desde un hilo, sin el buffer de
+  un objeto archivo de Python ni bloquear el event loop. uvicorn no expone
+  el socket a la aplicación, así que no hay transferencia zero-copy
+  (sendfile) desde aquí; para eso habría que servir los archivos desde un
+  proxy delante del backend
+"""
+import os
+import secrets
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 1024 * 1024
+MAX_RANGES = 32
+
+
+def file_etag(content_hash: Optional[str], stat_result: os.stat_result) -> str:
+    """ETag fuerte: el hash del contenido si existe, o tamaño + mtime"""
+    if content_hash:
+        return f'"{content_hash}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range_header(header: str, file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Interpreta un header Range. Retorna una lista de rangos [inicio, fin)
+    ordenados y fusionados, None si el header debe ignorarse (sintaxis
+    inválida o demasiados rangos) o una lista vacía si no es satisfacible.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start_text, sep, end_text = part.partition("-")
+        if not sep:
+            return None
+        start_text, end_text = start_text.strip(), end_text.strip()
+        if not (start_text.isdigit() or start_text == "") or not (end_text.isdigit() or end_text == ""):
+            return None
+
+        if start_text == "":
+            # Sufijo: los últimos N bytes
+            if end_text == "":
+                return None
+            length = int(end_text)
+            if length == 0:
+                continue
+            ranges.append((max(file_size - length, 0), file_size))
+        else:
+            start = int(start_text)
+            end = int(end_text) + 1 if end_text else file_size
+            if end_text and end < start + 1:
+                return None
+            if start >= file_size:
+                continue
+            ranges.append((start, min(end, file_size)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    Respuesta ASGI para servir un archivo con Range, ETag y Last-Modified.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        media_type: str,
+        filename: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        cache_control: str = "private, max-age=0, must-revalidate",
+        content_disposition_type: str = "attachment",
+    ):
+        # No se llama a Response.__init__: el cuerpo se envía en __call__
+        self.path = path
+        self.media_type = media_type
+        self.filename = filename
+        self.content_hash = content_hash
+        self.cache_control = cache_control
+        self.content_disposition_type = content_disposition_type
+        self.status_code = 200
+        self.background = None
+
+    def _base_headers(self, stat_result: os.stat_result) -> dict:
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": file_etag(self.content_hash, stat_result),
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "cache-control": self.cache_control,
+        }
+        if self.filename:
+            quoted = quote(self.filename)
+            if quoted != self.filename:
+                disposition = f"{self.content_disposition_type}; filename*=utf-8''{quoted}"
+            else:
+                disposition = f'{self.content_disposition_type}; filename="{self.filename}"'
+            headers["content-disposition"] = disposition
+        return headers
+
+    def _not_modified(self, request_headers: Headers, headers: dict, stat_result: os.stat_result) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            candidates = [c.strip() for c in if_none_match.split(",")]
+            return "*" in candidates or headers["etag"] in candidates or f"W/{headers['etag']}" in candidates
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(stat_result.st_mtime) <= since
+        return False
+
+    def _if_range_matches(self, if_range: Optional[str], headers: dict) -> bool:
+        if if_range is None:
+            return True
+        # If-Range solo admite comparación fuerte
+        if if_range.startswith("W/"):
+            return False
+        return if_range == headers["etag"] or if_range == headers["last-modified"]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request_headers = Headers(scope=scope)
+        send_body = scope.get("method", "GET") != "HEAD"
+
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            await self._send_simple(send, 404, {}, b"Archivo no encontrado")
+            return
+        if not stat.S_ISREG(stat_result.st_mode):
+            await self._send_simple(send, 404, {}, b"Archivo no encontrado")
+            return
+
+        file_size = stat_result.st_size
+        headers = self._base_headers(stat_result)
+
+        if self._not_modified(request_headers, headers, stat_result):
+            await self._send_simple(send, 304, headers, b"")
+            return
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if range_header and self._if_range_matches(request_headers.get("if-range"), headers):
+            ranges = parse_range_header(range_header, file_size)
+            if ranges == []:
+                await self._send_simple(
+                    send, 416, {**headers, "content-range": f"bytes */{file_size}"}, b""
+                )
+                return
+
+        with open(self.path, "rb") as file:
+            if not ranges:
+                headers["content-type"] = self.media_type
+                headers["content-length"] = str(file_size)
+                await self._start(send, 200, headers)
+                await self._send_segments(send, file, [(0, file_size)], send_body)
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                headers["content-type"] = self.media_type
+                headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+                headers["content-length"] = str(end - start)
+                await self._start(send, 206, headers)
+                await self._send_segments(send, file, [(start, end)], send_body)
+            else:
+                await self._send_multipart(send, file, ranges, file_size, headers, send_body)
+
+    async def _send_multipart(self, send, file, ranges, file_size, headers, send_body):
+        boundary = secrets.token_hex(16)
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{file_size}\r\n\r\n"
+            ).encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        # Cada parte después de la primera va precedida de CRLF
+        content_length = (
+            sum(len(h) for h in part_headers)
+            + sum(end - start for start, end in ranges)
+            + 2 * (len(ranges) - 1)
+            + len(closing)
+        )
+
+        headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        headers["content-length"] = str(content_length)
+        await self._start(send, 206, headers)
+        if not send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        for index, ((start, end), part_header) in enumerate(zip(ranges, part_headers)):
+            prefix = b"\r\n" if index else b""
+            await send({"type": "http.response.body", "body": prefix + part_header, "more_body": True})
+            await self._send_segments(send, file, [(start, end)], True, last=False)
+        await send({"type": "http.response.body", "body": closing, "more_body": False})
+
+    async def _send_segments(self, send, file, segments, send_body, last=True):
+        if not send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        for index, (start, end) in enumerate(segments):
+            final = last and index == len(segments) - 1
+            position = start
+            fd = file.fileno()
+            while position < end:
+                size = min(CHUNK_SIZE, end - position)
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, size, position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": not (final and position >= end),
+                })
+            if final and start == end:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    @staticmethod
+    async def _start(send, status_code, headers):
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+        })
+
+    async def _send_simple(self, send, status_code, headers, body):
+        headers = {**headers, "content-length": str(len(body))}
+        await self._start(send, status_code, headers)
+        await send({"type": "http.response.body", "body": body, "more_body": False})
@@ -0,0 +1,37 @@
+"""
+Utilidades de caché HTTP (ETag, If-None-Match, Cache-Control)
+compartidas por los routers que sirven contenido inmutable.
+"""
+from fastapi import Request
+from fastapi.responses import Response
+
+# Los tiles y previews se identifican por el nombre único (uuid) del archivo,
+# por lo que su contenido nunca cambia para una misma URL
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Recursos con URL estable cuyo contenido depende de la configuración (p. ej.
+# el descriptor DZI, que apunta a la versión actual de los tiles)
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Indica si el header If-None-Match de la petición coincide con el ETag dado
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def not_modified(etag: str, cache_control: str = IMMUTABLE_CACHE_CONTROL) -> Response:
+    """
+    Respuesta 304 sin cuerpo para un recurso que el cliente ya tiene en caché
+    """
+    return Response(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": cache_control}
+    )
@@ -0,0 +1,225 @@
+"""
+Clientes HTTP compartidos para Ollama y Rasa.
+
+Se crean una vez en el lifespan de la app (ver main.py) y se inyectan en los
+routers con Depends(get_ollama_client) / Depends(get_rasa_client), así cada
+mensaje de chat o generación SCT reutiliza conexiones abiertas en lugar de
+pagar un handshake nuevo, y los sockets salientes quedan acotados.
+
+Cada cliente lleva estadísticas de su pool (GET /health/http-pools):
+peticiones en curso, conexiones abiertas e inactivas, conexiones nuevas y
+tiempo de espera por una conexión libre.
+
+Variables de entorno:
+  OLLAMA_MAX_CONNECTIONS     conexiones simultáneas a Ollama (default: 16)
+  OLLAMA_MAX_KEEPALIVE       conexiones inactivas conservadas (default: 8)
+  OLLAMA_CONNECT_TIMEOUT     segundos para conectar (default: 10)
+  OLLAMA_READ_TIMEOUT        segundos de espera de una respuesta completa
+                             (default: 300)
+  OLLAMA_STREAM_TIMEOUT      segundos máximos entre fragmentos en streaming
+                             (default: 120)
+  RASA_MAX_CONNECTIONS       conexiones simultáneas a Rasa (default: 64)
+  RASA_MAX_KEEPALIVE         conexiones inactivas conservadas (default: 32)
+  RASA_TIMEOUT               segundos de espera de la respuesta (default: 180)
+  HTTP_POOL_TIMEOUT          segundos de espera por una conexión libre
+                             (default: 30)
+  HTTP_KEEPALIVE_EXPIRY      segundos que una conexión inactiva sigue abierta
+                             (default: 30)
+  HTTP2                      usar HTTP/2 si el paquete h2 está instalado; solo
+                             aplica a URLs https (default: true)
+"""
+import os
+import time
+from typing import Optional
+
+import httpx
+from fastapi import Request
+
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "8"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_STREAM_TIMEOUT = float(os.getenv("OLLAMA_STREAM_TIMEOUT", "120"))
+RASA_MAX_CONNECTIONS = int(os.getenv("RASA_MAX_CONNECTIONS", "64"))
+RASA_MAX_KEEPALIVE = int(os.getenv("RASA_MAX_KEEPALIVE", "32"))
+RASA_TIMEOUT_SECONDS = float(os.getenv("RASA_TIMEOUT", "180"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = os.getenv("HTTP2", "true").lower() in ("1", "true", "yes")
+except ImportError:
+    HTTP2 = False
+
+# Timeouts por tipo de llamada (se pasan en cada petición con timeout=...)
+OLLAMA_TIMEOUT = httpx.Timeout(
+    OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT
+)
+OLLAMA_STREAMING_TIMEOUT = httpx.Timeout(
+    OLLAMA_STREAM_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT
+)
+RASA_TIMEOUT = httpx.Timeout(
+    RASA_TIMEOUT_SECONDS, connect=OLLAMA_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT
+)
+
+
+class PoolStats:
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.new_connections = 0
+        self.errors = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Cuerpo de la respuesta que avisa cuando se cierra (fin de la petición)"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte de httpx que mide la espera por una conexión del pool: el
+    tiempo hasta que httpcore empieza a conectar o a enviar la petición.
+    """
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self.stats = stats
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self.stats
+        started = time.perf_counter()
+        acquired = False
+        previous_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict) -> None:
+            nonlocal acquired
+            if not acquired and (
+                event_name == "connection.connect_tcp.started"
+                or event_name.endswith(".send_request_headers.started")
+            ):
+                acquired = True
+                stats.record_wait(time.perf_counter() - started)
+            if event_name == "connection.connect_tcp.complete":
+                stats.new_connections += 1
+            if previous_trace is not None:
+                await previous_trace(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        stats.requests += 1
+        stats.in_flight += 1
+
+        def finished() -> None:
+            stats.in_flight -= 1
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception:
+            stats.errors += 1
+            finished()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, finished),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+    def pool_snapshot(self) -> dict:
+        # httpcore no expone el pool públicamente; si cambia, solo se omite
+        pool = getattr(self._transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        return {
+            "connections": len(connections),
+            "idle_connections": sum(1 for conn in connections if conn.is_idle()),
+        }
+
+
+def _build_transport(max_connections: int, max_keepalive: int) -> InstrumentedTransport:
+    return InstrumentedTransport(
+        PoolStats(),
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+class HTTPClients:
+    """Clientes de la app; uno por servicio externo"""
+
+    def __init__(self):
+        self.ollama: Optional[httpx.AsyncClient] = None
+        self.rasa: Optional[httpx.AsyncClient] = None
+        self._transports = {}
+
+    def start(self) -> None:
+        self._transports = {
+            "ollama": _build_transport(OLLAMA_MAX_CONNECTIONS, OLLAMA_MAX_KEEPALIVE),
+            "rasa": _build_transport(RASA_MAX_CONNECTIONS, RASA_MAX_KEEPALIVE),
+        }
+        self.ollama = httpx.AsyncClient(transport=self._transports["ollama"], timeout=OLLAMA_TIMEOUT)
+        self.rasa = httpx.AsyncClient(transport=self._transports["rasa"], timeout=RASA_TIMEOUT)
+
+    async def aclose(self) -> None:
+        for client in (self.ollama, self.rasa):
+            if client is not None:
+                await client.aclose()
+        self.ollama = self.rasa = None
+        self._transports = {}
+
+    def stats(self) -> dict:
+        result = {}
+        limits = {"ollama": OLLAMA_MAX_CONNECTIONS, "rasa": RASA_MAX_CONNECTIONS}
+        for name, transport in self._transports.items():
+            stats = transport.stats
+            result[name] = {
+                "max_connections": limits[name],
+                "http2": HTTP2,
+                "requests": stats.requests,
+                "in_flight": stats.in_flight,
+                "errors": stats.errors,
+                "new_connections": stats.new_connections,
+                "wait_ms_avg": round(1000 * stats.wait_seconds_total / stats.requests, 2) if stats.requests else 0.0,
+                "wait_ms_max": round(1000 * stats.wait_seconds_max, 2),
+                **transport.pool_snapshot(),
+            }
+        return result
+
+
+http_clients = HTTPClients()
+
+
+def get_ollama_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http_clients.ollama
+
+
+def get_rasa_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http_clients.rasa
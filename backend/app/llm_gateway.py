@@ -0,0 +1,204 @@
+"""
+Control de admisión de las llamadas al LLM.
+
+Una sola instancia de Ollama atiende el chat interactivo (la acción de Rasa
+pasa por /api/llm/chat) y las generaciones SCT, que tardan minutos. Todas
+las llamadas piden un cupo al gateway con una prioridad:
+
+  interactive   chat de los estudiantes; siempre se atiende primero
+  batch         generación SCT y reabastecimiento del banco
+
+Hay LLM_MAX_IN_FLIGHT cupos en total y batch puede ocupar como máximo
+LLM_BATCH_MAX_IN_FLIGHT, que nunca supera LLM_MAX_IN_FLIGHT - 1: así siempre
+queda lugar para el chat. Con un solo cupo en total batch no tiene ninguno y
+la generación SCT responde 503 de inmediato. Cuando no hay cupo la llamada
+espera en la cola de su prioridad; si la cola está llena se responde 429 y
+si la espera supera el máximo, 503, ambos con Retry-After.
+
+Variables de entorno:
+  LLM_MAX_IN_FLIGHT         llamadas simultáneas a Ollama; conviene igualarlo
+                            a OLLAMA_NUM_PARALLEL (default: 2)
+  LLM_BATCH_MAX_IN_FLIGHT   cupos que puede usar batch (default y máximo:
+                            total - 1); también limita el fan-out SCT
+  LLM_QUEUE_INTERACTIVE     largo máximo de la cola interactive (default: 64)
+  LLM_QUEUE_BATCH           largo máximo de la cola batch (default: 32)
+  LLM_MAX_WAIT_INTERACTIVE  segundos máximos en cola de interactive (default: 30)
+  LLM_MAX_WAIT_BATCH        segundos máximos en cola de batch (default: 300)
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+from fastapi import HTTPException
+
+from . import metrics
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+LLM_MAX_IN_FLIGHT = max(int(os.getenv("LLM_MAX_IN_FLIGHT", "2")), 1)
+LLM_BATCH_MAX_IN_FLIGHT = min(
+    max(int(os.getenv("LLM_BATCH_MAX_IN_FLIGHT", str(LLM_MAX_IN_FLIGHT - 1))), 0),
+    LLM_MAX_IN_FLIGHT - 1,
+)
+if LLM_BATCH_MAX_IN_FLIGHT == 0:
+    print("[LLM] Sin cupos para batch (LLM_MAX_IN_FLIGHT=1): la generación SCT queda desactivada")
+LLM_QUEUE_LIMITS = {
+    INTERACTIVE: int(os.getenv("LLM_QUEUE_INTERACTIVE", "64")),
+    BATCH: int(os.getenv("LLM_QUEUE_BATCH", "32")),
+}
+LLM_MAX_WAIT = {
+    INTERACTIVE: float(os.getenv("LLM_MAX_WAIT_INTERACTIVE", "30")),
+    BATCH: float(os.getenv("LLM_MAX_WAIT_BATCH", "300")),
+}
+
+# Esperas recientes conservadas para los percentiles
+_WAIT_SAMPLES = 512
+
+
+class LLMGateway:
+    def __init__(self):
+        self.in_flight: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self._queues: Dict[str, Deque[asyncio.Future]] = {priority: deque() for priority in PRIORITIES}
+        self._waits: Dict[str, Deque[float]] = {priority: deque(maxlen=_WAIT_SAMPLES) for priority in PRIORITIES}
+        self._counters: Dict[str, Dict[str, int]] = {
+            priority: {"admitted": 0, "rejected": 0, "timed_out": 0} for priority in PRIORITIES
+        }
+        # Duración media de una llamada (promedio móvil), para estimar Retry-After
+        self._service_seconds = 30.0
+
+    def _has_slot(self, priority: str) -> bool:
+        if sum(self.in_flight.values()) >= LLM_MAX_IN_FLIGHT:
+            return False
+        return priority == INTERACTIVE or self.in_flight[BATCH] < LLM_BATCH_MAX_IN_FLIGHT
+
+    def _retry_after(self, priority: str) -> int:
+        ahead = len(self._queues[INTERACTIVE])
+        if priority == BATCH:
+            ahead += len(self._queues[BATCH])
+        slots = LLM_MAX_IN_FLIGHT if priority == INTERACTIVE else max(LLM_BATCH_MAX_IN_FLIGHT, 1)
+        return max(1, math.ceil(self._service_seconds * (ahead / slots + 1)))
+
+    def _busy(self, status_code: int, priority: str, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self._retry_after(priority))},
+        )
+
+    async def acquire(self, priority: str) -> None:
+        """Espera un cupo; lanza 429 (cola llena) o 503 (espera excedida)"""
+        started = time.monotonic()
+        queue = self._queues[priority]
+        counters = self._counters[priority]
+
+        if priority == BATCH and LLM_BATCH_MAX_IN_FLIGHT == 0:
+            counters["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Generación SCT desactivada: LLM_MAX_IN_FLIGHT debe ser al menos 2",
+            )
+
+        if not queue and self._has_slot(priority) and (priority == INTERACTIVE or not self._queues[INTERACTIVE]):
+            self.in_flight[priority] += 1
+        else:
+            if len(queue) >= LLM_QUEUE_LIMITS[priority]:
+                counters["rejected"] += 1
+                raise self._busy(429, priority, "El modelo está ocupado, intenta nuevamente en unos segundos")
+
+            waiter = asyncio.get_running_loop().create_future()
+            queue.append(waiter)
+            try:
+                # El cupo lo asigna release() al completar el future
+                await asyncio.wait_for(asyncio.shield(waiter), LLM_MAX_WAIT[priority])
+            except asyncio.TimeoutError:
+                if waiter.done() and not waiter.cancelled():
+                    # Se asignó justo al vencer la espera: devolverlo
+                    self.release(priority)
+                else:
+                    waiter.cancel()
+                    queue.remove(waiter)
+                counters["timed_out"] += 1
+                raise self._busy(503, priority, "Tiempo de espera agotado en la cola del modelo")
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release(priority)
+                else:
+                    waiter.cancel()
+                    if waiter in queue:
+                        queue.remove(waiter)
+                raise
+
+        counters["admitted"] += 1
+        waited = time.monotonic() - started
+        self._waits[priority].append(waited)
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(waited, priority=priority)
+
+    def release(self, priority: str, service_seconds: float = None) -> None:
+        self.in_flight[priority] -= 1
+        if service_seconds is not None:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+        # Pasar los cupos libres a la cola, interactive primero
+        for waiting in PRIORITIES:
+            queue = self._queues[waiting]
+            while queue and self._has_slot(waiting):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self.in_flight[waiting] += 1
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: str):
+        await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(priority, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        result = {
+            "max_in_flight": LLM_MAX_IN_FLIGHT,
+            "batch_max_in_flight": LLM_BATCH_MAX_IN_FLIGHT,
+            "service_seconds_avg": round(self._service_seconds, 2),
+        }
+        for priority in PRIORITIES:
+            waits = sorted(self._waits[priority])
+
+            def percentile(fraction: float) -> float:
+                if not waits:
+                    return 0.0
+                return round(1000 * waits[min(int(fraction * len(waits)), len(waits) - 1)], 1)
+
+            result[priority] = {
+                "in_flight": self.in_flight[priority],
+                "queue_depth": len(self._queues[priority]),
+                "queue_limit": LLM_QUEUE_LIMITS[priority],
+                "max_wait_seconds": LLM_MAX_WAIT[priority],
+                **self._counters[priority],
+                "wait_ms_p50": percentile(0.5),
+                "wait_ms_p95": percentile(0.95),
+                "wait_ms_max": round(1000 * waits[-1], 1) if waits else 0.0,
+            }
+        return result
+
+
+    def collect_metrics(self):
+        """Estado actual del gateway para /metrics"""
+        yield ("llm_in_flight", "gauge", "Llamadas al LLM en curso", ("priority",),
+               [((priority,), self.in_flight[priority]) for priority in PRIORITIES])
+        yield ("llm_queue_depth", "gauge", "Llamadas esperando en la cola del gateway", ("priority",),
+               [((priority,), len(self._queues[priority])) for priority in PRIORITIES])
+        for counter in ("admitted", "rejected", "timed_out"):
+            yield (f"llm_gateway_{counter}_total", "counter", f"Llamadas {counter} por el gateway", ("priority",),
+                   [((priority,), self._counters[priority][counter]) for priority in PRIORITIES])
+
+
+llm_gateway = LLMGateway()
+metrics.registry.add_collector(llm_gateway.collect_metrics)
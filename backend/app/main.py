@@ -1,28 +1,23 @@
+from contextlib import asynccontextmanager
+from functools import partial
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.exc import OperationalError
 import time
 import os
 
-from .routers import chat, cases, sct, medical_images
-from .db import Base, engine
-
-app = FastAPI(title="Backend TB Educativa")
-
-# --- CORS ---
-# Si quieres permitir todo en desarrollo, puedes cambiar a allow_origins=["*"]
-origins = [
-    "http://localhost:3000",
-    "http://127.0.0.1:3000",
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,        # dominios permitidos
-    allow_credentials=True,
-    allow_methods=["*"],          # GET, POST, etc.
-    allow_headers=["*"],          # Authorization, Content-Type, etc.
-)
+from .routers import chat, cases, sct, medical_images, llm
+from .db import engine
+from .schema_migrations import upgrade_schema
+from .tiling_jobs import resume_pending_jobs, shutdown_tiling_pool
+from .executors import shutdown_executors
+from .sct_bank import start_refill_task, stop_refill_task
+from .http_clients import http_clients
+from .ollama_pool import ollama_pool
+from .ollama_models import SCT_MODEL, start_warm_up, stop_warm_up
+from .metrics import registry, CONTENT_TYPE
+from .pagination import NEXT_CURSOR_HEADER
 
 
 def create_tables_with_retry(max_retries: int = 10, delay_seconds: int = 2) -> None:
@@ -34,7 +29,8 @@ def create_tables_with_retry(max_retries: int = 10, delay_seconds: int = 2) -> N
     while attempt <= max_retries:
         try:
             print(f"[backend] Intentando crear tablas en la BD (intento {attempt}/{max_retries})...")
-            Base.metadata.create_all(bind=engine)
+            # Tablas nuevas, y columnas e índices que falten en las existentes
+            upgrade_schema(engine)
             print("[backend] Tablas creadas (o ya existían).")
             return
         except OperationalError as e:
@@ -46,11 +42,57 @@ def create_tables_with_retry(max_retries: int = 10, delay_seconds: int = 2) -> N
     print("[backend] No fue posible conectar con la BD después de varios intentos.")
 
 
-@app.on_event("startup")
-def on_startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     # Crear tablas al arrancar, con reintentos
     create_tables_with_retry()
+    # Retomar trabajos de tiling interrumpidos por un reinicio
+    try:
+        resume_pending_jobs()
+    except OperationalError as e:
+        print(f"[backend] No se pudieron reanudar los trabajos de tiling: {e}")
+    # Clientes HTTP compartidos para Ollama y Rasa
+    http_clients.start()
+    app.state.http_clients = http_clients
+    # Chequeos de salud de los nodos de Ollama (si hay más de uno)
+    ollama_pool.start_health_checks(http_clients.ollama)
+    # Cargar los modelos y dejar evaluado el prompt fijo de SCT
+    start_warm_up(
+        http_clients.ollama,
+        [node.url for node in ollama_pool.nodes],
+        {SCT_MODEL: sct.SCT_SYSTEM_PROMPT}
+    )
+    # Mantener abastecido el banco SCT para los temas más pedidos
+    start_refill_task(partial(sct.generate_for_bank, http_clients.ollama))
     print("[backend] Servicio FastAPI iniciado correctamente.")
+    
+    yield
+    
+    stop_refill_task()
+    stop_warm_up()
+    ollama_pool.stop_health_checks()
+    await http_clients.aclose()
+    shutdown_tiling_pool()
+    shutdown_executors()
+
+
+app = FastAPI(title="Backend TB Educativa", lifespan=lifespan)
+
+# --- CORS ---
+# Si quieres permitir todo en desarrollo, puedes cambiar a allow_origins=["*"]
+origins = [
+    "http://localhost:3000",
+    "http://127.0.0.1:3000",
+]
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,        # dominios permitidos
+    allow_credentials=True,
+    allow_methods=["*"],          # GET, POST, etc.
+    allow_headers=["*"],          # Authorization, Content-Type, etc.
+    expose_headers=[NEXT_CURSOR_HEADER],  # cursor de la siguiente página (ver pagination)
+)
 
 
 @app.get("/health")
@@ -58,11 +100,24 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/health/http-pools")
+def http_pools():
+    """Estadísticas de los pools de conexiones a Ollama y Rasa"""
+    return http_clients.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Telemetría de las llamadas al LLM en formato Prometheus"""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
 # Incluir los routers (endpoints /api/chat, /api/cases y /api/sct)
 app.include_router(chat.router)
 app.include_router(cases.router)
 app.include_router(sct.router)
 app.include_router(medical_images.router)
+app.include_router(llm.router)
 
 # Servir archivos estáticos para imágenes
 from fastapi.staticfiles import StaticFiles
@@ -0,0 +1,152 @@
+"""
+Métricas en formato de texto de Prometheus (GET /metrics).
+
+Implementación mínima de contadores e histogramas con etiquetas, sin
+dependencias: basta para que Prometheus (o cualquier scraper compatible)
+lea la telemetría de las llamadas al LLM. Se actualizan desde el event loop,
+por lo que no usan locks.
+
+Las métricas del LLM se registran en ollama_models.record_timings (una por
+respuesta de Ollama) y en llm_gateway.acquire (espera en la cola). El
+estado actual del gateway y de los nodos se lee al momento del scrape.
+"""
+import math
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Buckets en segundos: desde un token hasta una generación SCT de minutos
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 200, 500)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Por etiqueta: cuentas por bucket (no acumuladas), suma y total
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# Métricas leídas al momento del scrape: (nombre, tipo, ayuda, etiquetas, [(valores, valor)])
+Sample = Tuple[str, str, str, Sequence[str], Iterable[Tuple[LabelValues, float]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = SECONDS_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, label_names, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for values, value in samples:
+                    lines.append(f"{name}{_format_labels(label_names, values)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Llamadas al LLM ---
+_LLM_LABELS = ("caller", "model", "difficulty")
+
+LLM_CALLS = registry.counter("llm_calls_total", "Respuestas de Ollama recibidas", _LLM_LABELS)
+LLM_PROMPT_TOKENS = registry.counter("llm_prompt_tokens_total", "Tokens de prompt evaluados", _LLM_LABELS)
+LLM_COMPLETION_TOKENS = registry.counter("llm_completion_tokens_total", "Tokens generados", _LLM_LABELS)
+LLM_LOAD_SECONDS = registry.histogram(
+    "llm_load_duration_seconds", "Tiempo de carga del modelo (alto = el modelo se recargó)", _LLM_LABELS
+)
+LLM_PROMPT_EVAL_SECONDS = registry.histogram(
+    "llm_prompt_eval_duration_seconds", "Tiempo de evaluación del prompt", _LLM_LABELS
+)
+LLM_EVAL_SECONDS = registry.histogram("llm_eval_duration_seconds", "Tiempo de generación", _LLM_LABELS)
+LLM_TOTAL_SECONDS = registry.histogram("llm_total_duration_seconds", "Duración total informada por Ollama", _LLM_LABELS)
+LLM_PROMPT_SIZE = registry.histogram(
+    "llm_prompt_size_tokens", "Tamaño del prompt en tokens", _LLM_LABELS, buckets=TOKEN_BUCKETS
+)
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "llm_tokens_per_second", "Velocidad de generación (tokens/s)", _LLM_LABELS, buckets=RATE_BUCKETS
+)
+LLM_QUEUE_WAIT_SECONDS = registry.histogram(
+    "llm_queue_wait_seconds", "Espera en la cola del gateway antes de llamar a Ollama", ("priority",)
+)
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, DateTime, Boolean, JSON, ForeignKey, Index, LargeBinary, UniqueConstraint
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
+import os
 from .db import Base
 
 class User(Base):
@@ -23,14 +24,71 @@ class MedicalImage(Base):
     description = Column(Text, nullable=True)
     pathology_type = Column(String(200), nullable=True)  # Necrosis, Células de Langerhans, etc.
     file_type = Column(String(20), nullable=False)  # svs, jpg, png, etc.
-    file_size = Column(Integer, nullable=True)  # tamaño en bytes
+    file_size = Column(BigInteger, nullable=True)  # tamaño en bytes
     file_path = Column(String(500), nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 del contenido
+    source_path = Column(String(1000), nullable=True, index=True)  # archivo de origen en importaciones masivas
     dzi_path = Column(String(500), nullable=True)  # ruta al DZI si fue procesado
+    # Metadatos de la lámina extraídos al subirla (ver slide_metadata)
+    width = Column(Integer, nullable=True)  # dimensiones del nivel de resolución completa
+    height = Column(Integer, nullable=True)
+    level_count = Column(Integer, nullable=True)
+    mpp_x = Column(Float, nullable=True)  # micrones por pixel
+    mpp_y = Column(Float, nullable=True)
+    objective_power = Column(Float, nullable=True, index=True)  # aumento del objetivo (20, 40, ...)
+    vendor = Column(String(50), nullable=True, index=True)  # aperio, hamamatsu, ...
+    slide_metadata = Column(JSON, nullable=True)  # dimensiones y downsamples por nivel, formato, etc.
+    tissue_fraction = Column(Float, nullable=True)  # fracción de la lámina con tejido (ver tissue_mask)
     uploaded_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
     
     uploader = relationship("User", back_populates="uploaded_images")
+    tiling_jobs = relationship("TilingJob", back_populates="image", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Orden de /api/medical-images/list (ver pagination)
+        Index("ix_medical_images_active_created", "is_active", "created_at", "id"),
+    )
+    
+    @property
+    def stored_name(self) -> str:
+        """
+        Nombre del archivo almacenado. Varios registros deduplicados pueden
+        compartirlo, por eso los tiles y previews se indexan por este nombre.
+        """
+        return os.path.basename(self.file_path)
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    id = Column(String(36), primary_key=True)  # uuid de la subida
+    original_filename = Column(String(200), nullable=False)
+    title = Column(String(200), nullable=False)
+    description = Column(Text, nullable=True)
+    pathology_type = Column(String(200), nullable=True)
+    file_type = Column(String(20), nullable=False)
+    total_size = Column(BigInteger, nullable=False)
+    received_bytes = Column(BigInteger, default=0)
+    expected_hash = Column(String(64), nullable=True)  # sha256 informado por el cliente (opcional)
+    uploaded_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class TilingJob(Base):
+    __tablename__ = "tiling_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey("medical_images.id"), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, done, failed, cancelled
+    total_tiles = Column(Integer, nullable=True)
+    done_tiles = Column(Integer, default=0)
+    skipped_tiles = Column(Integer, default=0)  # tiles de fondo enlazados al tile en blanco compartido
+    completed_rows = Column(JSON, nullable=False, default=list)  # ["nivel:fila", ...] ya terminadas
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    image = relationship("MedicalImage", back_populates="tiling_jobs")
 
 class Case(Base):
     __tablename__ = "cases"
@@ -39,6 +97,11 @@ class Case(Base):
     description = Column(Text, nullable=False)   # resumen del caso
     body = Column(Text, nullable=False)          # caso clínico completo
     is_active = Column(Boolean, default=True)
+    
+    __table_args__ = (
+        # Orden de /api/cases (ver pagination)
+        Index("ix_cases_active_id", "is_active", "id"),
+    )
 
 class Document(Base):
     __tablename__ = "documents"
@@ -62,6 +125,83 @@ class SCTTest(Base):
     difficulty = Column(String(50), nullable=False)     # pregrado, internado, residente
     focus = Column(String(200), nullable=False)         # tuberculosis pulmonar, diabetes, etc.
     num_items = Column(Integer, nullable=False)         # Cantidad de ítems
-    items_json = Column(JSON, nullable=False)           # Array de ítems SCT
+    # Ítems de los tests guardados antes de sct_test_items (ver sct_items);
+    # los tests nuevos lo dejan vacío. Diferido: no se lee al consultar el test
+    items_json = deferred(Column(JSON, nullable=False))
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    
+    __table_args__ = (
+        # Orden de /api/sct/list (ver pagination)
+        Index("ix_sct_tests_active_created", "is_active", "created_at", "id"),
+    )
+
+class SCTTestItem(Base):
+    """Ítem de un test SCT guardado, en el orden del test (position 1..n)"""
+    __tablename__ = "sct_test_items"
+    id = Column(Integer, primary_key=True, index=True)
+    test_id = Column(Integer, ForeignKey("sct_tests.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    vignette = Column(Text, nullable=False)
+    hypothesis = Column(Text, nullable=False)
+    new_info = Column(Text, nullable=False)
+    correct_answer = Column(Integer, nullable=False)
+    explanation = Column(Text, nullable=True)
+    bank_id = Column(Integer, ForeignKey("sct_bank_items.id"), nullable=True)
+    
+    __table_args__ = (
+        UniqueConstraint("test_id", "position", name="uq_sct_test_items_position"),
+    )
+
+class SCTBankItem(Base):
+    """Ítem SCT individual del banco, reutilizable para armar tests sin el LLM"""
+    __tablename__ = "sct_bank_items"
+    id = Column(Integer, primary_key=True, index=True)
+    difficulty = Column(String(50), nullable=False)
+    focus = Column(String(200), nullable=False)
+    focus_key = Column(String(200), nullable=False)             # focus normalizado (ver sct_bank)
+    hypothesis_key = Column(String(500), nullable=False, index=True)  # hipótesis normalizada
+    content_hash = Column(String(64), unique=True, nullable=False)    # sha256 de viñeta+hipótesis+nueva info
+    vignette = Column(Text, nullable=False)
+    hypothesis = Column(Text, nullable=False)
+    new_info = Column(Text, nullable=False)
+    correct_answer = Column(Integer, nullable=False)
+    explanation = Column(Text, nullable=True)
+    source = Column(String(20), nullable=False, default="generated")  # generated, saved, refill
+    test_id = Column(Integer, ForeignKey("sct_tests.id"), nullable=True)  # test guardado de origen
+    times_used = Column(Integer, default=0)  # veces que se incluyó en un test armado
+    created_at = Column(DateTime, default=datetime.utcnow)
+    is_active = Column(Boolean, default=True)
+    
+    __table_args__ = (
+        Index("ix_sct_bank_items_pair", "difficulty", "focus_key", "is_active"),
+    )
+
+class SCTAnswerSheet(Base):
+    """
+    Respuestas de un estudiante o de un experto del panel a un test SCT: un
+    int8 por ítem (-2..+2, -128 = sin responder), en el orden del test.
+    Las hojas de un test se apilan en una matriz respondente × ítem para
+    calcular los puntajes (ver sct_scoring).
+    """
+    __tablename__ = "sct_answer_sheets"
+    id = Column(Integer, primary_key=True, index=True)
+    test_id = Column(Integer, ForeignKey("sct_tests.id"), nullable=False)
+    role = Column(String(20), nullable=False)         # student, panel
+    respondent = Column(String(200), nullable=False)  # identificador del estudiante o experto
+    answers = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("test_id", "role", "respondent", name="uq_sct_answer_sheets_respondent"),
+        Index("ix_sct_answer_sheets_test_role", "test_id", "role", "updated_at"),
+    )
+
+class SCTBankDemand(Base):
+    """Pedidos por (dificultad, tema), para saber qué pares mantener abastecidos"""
+    __tablename__ = "sct_bank_demand"
+    difficulty = Column(String(50), primary_key=True)
+    focus_key = Column(String(200), primary_key=True)
+    focus = Column(String(200), nullable=False)  # texto original del último pedido
+    requests = Column(Integer, default=0)
+    last_requested_at = Column(DateTime, default=datetime.utcnow)
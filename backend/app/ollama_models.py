@@ -0,0 +1,169 @@
+"""
+Modelos de Ollama: precalentamiento, keep_alive y tiempos de evaluación.
+
+Al arrancar el backend se carga cada modelo configurado en todos los nodos
+y, para el modelo SCT, se evalúa una vez el prompt de sistema fijo; así la
+primera generación no paga la carga del modelo y las siguientes reutilizan
+el prefijo ya evaluado (el prompt SCT pone las variables al final).
+
+Cada llamada registra los tiempos que informa Ollama (carga del modelo,
+evaluación del prompt y generación): los promedios recientes en
+/api/llm/stats y los histogramas por llamador, modelo y dificultad en
+/metrics.
+
+Variables de entorno:
+  SCT_MODEL                  modelo de generación SCT (default: llama3:8b)
+  OLLAMA_NUM_CTX             contexto de todas las llamadas a un modelo (default:
+                             8192). Ollama recarga el modelo si cambia num_ctx,
+                             así que el chat y SCT usan el mismo valor
+  OLLAMA_NUM_CTX_MODELS      valores por modelo, ej: "llama3:8b=8192,phi3=4096"
+  OLLAMA_KEEP_ALIVE          tiempo que Ollama mantiene un modelo cargado sin
+                             uso (default: 30m; -1 = siempre)
+  OLLAMA_KEEP_ALIVE_MODELS   valores por modelo, ej: "llama3:8b=1h,phi3=5m"
+  LLM_WARMUP                 precalentar los modelos al arrancar (default: true)
+  LLM_WARMUP_MODELS          modelos a precalentar, separados por comas
+                             (default: SCT_MODEL y LLM_MODEL)
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import httpx
+
+from . import metrics
+
+SCT_MODEL = os.getenv("SCT_MODEL", "llama3:8b")
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+OLLAMA_NUM_CTX_MODELS = {
+    model.strip(): int(value)
+    for model, value in (
+        entry.split("=", 1) for entry in os.getenv("OLLAMA_NUM_CTX_MODELS", "").split(",") if "=" in entry
+    )
+}
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE_MODELS = dict(
+    entry.strip().split("=", 1)
+    for entry in os.getenv("OLLAMA_KEEP_ALIVE_MODELS", "").split(",")
+    if "=" in entry
+)
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() in ("1", "true", "yes")
+LLM_WARMUP_MODELS = [
+    model.strip()
+    for model in os.getenv("LLM_WARMUP_MODELS", ",".join(dict.fromkeys([SCT_MODEL, os.getenv("LLM_MODEL", SCT_MODEL)]))).split(",")
+    if model.strip()
+]
+
+# Muestras recientes por llamador para los promedios
+_TIMING_SAMPLES = 200
+_WARMUP_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+_timings: Dict[str, Deque[dict]] = {}
+_warmup_task: Optional[asyncio.Task] = None
+
+
+def keep_alive_for(model: Optional[str]) -> str:
+    return OLLAMA_KEEP_ALIVE_MODELS.get(model or "", OLLAMA_KEEP_ALIVE)
+
+
+def num_ctx_for(model: Optional[str]) -> int:
+    """Contexto de todas las llamadas al modelo (chat, SCT y precalentamiento)"""
+    return OLLAMA_NUM_CTX_MODELS.get(model or "", OLLAMA_NUM_CTX)
+
+
+def record_timings(caller: str, model: Optional[str], data: dict, difficulty: str = "") -> Optional[dict]:
+    """
+    Guarda los tiempos de una respuesta de Ollama (vienen en nanosegundos)
+    y los retorna en milisegundos.
+    """
+    if "prompt_eval_duration" not in data and "eval_duration" not in data:
+        return None
+    _observe(caller, model or "", difficulty, data)
+    sample = {
+        "model": model,
+        "load_ms": data.get("load_duration", 0) / 1e6,
+        "prompt_tokens": data.get("prompt_eval_count", 0),
+        "prompt_eval_ms": data.get("prompt_eval_duration", 0) / 1e6,
+        "eval_tokens": data.get("eval_count", 0),
+        "eval_ms": data.get("eval_duration", 0) / 1e6,
+        "total_ms": data.get("total_duration", 0) / 1e6,
+    }
+    _timings.setdefault(caller, deque(maxlen=_TIMING_SAMPLES)).append(sample)
+    print(
+        f"[LLM] {caller}: carga {sample['load_ms']:.0f}ms, "
+        f"prompt {sample['prompt_tokens']} tokens en {sample['prompt_eval_ms']:.0f}ms, "
+        f"generación {sample['eval_tokens']} tokens en {sample['eval_ms']:.0f}ms"
+    )
+    return sample
+
+
+def _observe(caller: str, model: str, difficulty: str, data: dict) -> None:
+    labels = {"caller": caller, "model": model, "difficulty": difficulty}
+    eval_seconds = data.get("eval_duration", 0) / 1e9
+    metrics.LLM_CALLS.inc(**labels)
+    metrics.LLM_PROMPT_TOKENS.inc(data.get("prompt_eval_count", 0), **labels)
+    metrics.LLM_COMPLETION_TOKENS.inc(data.get("eval_count", 0), **labels)
+    metrics.LLM_LOAD_SECONDS.observe(data.get("load_duration", 0) / 1e9, **labels)
+    metrics.LLM_PROMPT_EVAL_SECONDS.observe(data.get("prompt_eval_duration", 0) / 1e9, **labels)
+    metrics.LLM_EVAL_SECONDS.observe(eval_seconds, **labels)
+    metrics.LLM_TOTAL_SECONDS.observe(data.get("total_duration", 0) / 1e9, **labels)
+    metrics.LLM_PROMPT_SIZE.observe(data.get("prompt_eval_count", 0), **labels)
+    if eval_seconds > 0:
+        metrics.LLM_TOKENS_PER_SECOND.observe(data.get("eval_count", 0) / eval_seconds, **labels)
+
+
+def timing_stats() -> dict:
+    result = {}
+    for caller, samples in _timings.items():
+        count = len(samples)
+        result[caller] = {
+            "calls": count,
+            **{
+                f"{field}_avg": round(sum(sample[field] for sample in samples) / count, 1)
+                for field in ("load_ms", "prompt_tokens", "prompt_eval_ms", "eval_tokens", "eval_ms")
+            },
+            "last": samples[-1],
+        }
+    return result
+
+
+async def warm_up(client: httpx.AsyncClient, node_urls: List[str], prefixes: Dict[str, str]) -> None:
+    """
+    Carga cada modelo en cada nodo con su keep_alive; si el modelo tiene un
+    prompt de sistema fijo, lo evalúa para dejarlo en la caché del servidor.
+    """
+    async def warm(url: str, model: str) -> None:
+        started = time.monotonic()
+        prefix = prefixes.get(model)
+        payload = {
+            "model": model,
+            "messages": [{"role": "system", "content": prefix}] if prefix else [],
+            "stream": False,
+            "keep_alive": keep_alive_for(model),
+            # Mismo num_ctx que las llamadas reales; otro valor recargaría el modelo
+            "options": {"num_predict": 1, "num_ctx": num_ctx_for(model)},
+        }
+        try:
+            response = await client.post(f"{url}/api/chat", json=payload, timeout=_WARMUP_TIMEOUT)
+            response.raise_for_status()
+            record_timings("warmup", model, response.json())
+            print(f"[LLM] {model} precalentado en {url} ({time.monotonic() - started:.1f}s)")
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"[LLM] No se pudo precalentar {model} en {url}: {e}")
+
+    await asyncio.gather(*[warm(url, model) for url in node_urls for model in LLM_WARMUP_MODELS])
+
+
+def start_warm_up(client: httpx.AsyncClient, node_urls: List[str], prefixes: Dict[str, str]) -> None:
+    """Lanza el precalentamiento en segundo plano (no retrasa el arranque)"""
+    global _warmup_task
+    if LLM_WARMUP and _warmup_task is None:
+        _warmup_task = asyncio.get_running_loop().create_task(warm_up(client, node_urls, prefixes))
+
+
+def stop_warm_up() -> None:
+    global _warmup_task
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+        _warmup_task = None
@@ -0,0 +1,250 @@
+"""
+Balanceo de carga entre varias instancias de Ollama.
+
+OLLAMA_URL acepta una lista separada por comas; cada llamada se envía al
+nodo sano con menos peticiones en curso, prefiriendo los que ya tienen el
+modelo descargado (según /api/tags). Un chequeo periódico marca los nodos
+caídos y, tras varios errores seguidos, un nodo queda excluido un tiempo
+(outlier ejection). Los errores de conexión y los 502/503/504 se reintentan
+en otro nodo: generar una respuesta no tiene efectos secundarios.
+
+Con una sola URL el comportamiento es el de antes.
+
+Variables de entorno:
+  OLLAMA_URL                 una o varias URLs separadas por comas
+  OLLAMA_HEALTH_INTERVAL     segundos entre chequeos de /api/tags (default: 10)
+  OLLAMA_EJECT_FAILURES      errores seguidos para excluir un nodo (default: 3)
+  OLLAMA_EJECT_SECONDS       exclusión inicial; se duplica en cada exclusión
+                             seguida, hasta 10 veces (default: 30)
+  OLLAMA_RETRIES             reintentos en otro nodo (default: 1)
+"""
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Optional, Set
+
+import httpx
+
+from . import metrics
+
+OLLAMA_URLS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("OLLAMA_URL", "http://ollama:11434").split(",")
+    if url.strip()
+]
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_EJECT_FAILURES = int(os.getenv("OLLAMA_EJECT_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "1"))
+
+# Respuestas del nodo que justifican probar otro
+_RETRY_STATUS = (502, 503, 504)
+_HEALTH_TIMEOUT = httpx.Timeout(3.0)
+
+
+class NoOllamaNode(httpx.TransportError):
+    """No quedan nodos a los que enviar la llamada"""
+
+
+class OllamaNode:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.models: Optional[Set[str]] = None  # None = aún no consultado
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and time.monotonic() >= self.ejected_until
+
+    def has_model(self, model: Optional[str]) -> bool:
+        if not model or self.models is None:
+            return True
+        return model in self.models or f"{model}:latest" in self.models
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.ejections = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= OLLAMA_EJECT_FAILURES:
+            self.ejections = min(self.ejections + 1, 10)
+            self.ejected_until = time.monotonic() + OLLAMA_EJECT_SECONDS * 2 ** (self.ejections - 1)
+            self.consecutive_failures = 0
+            print(f"[Ollama] Nodo {self.url} excluido por {OLLAMA_EJECT_SECONDS * 2 ** (self.ejections - 1):.0f}s")
+
+
+class OllamaPool:
+    def __init__(self, urls: Iterable[str]):
+        self.nodes = [OllamaNode(url) for url in urls]
+        self._health_task: Optional[asyncio.Task] = None
+
+    def pick(self, model: Optional[str] = None, exclude: Iterable[OllamaNode] = ()) -> OllamaNode:
+        """Nodo disponible con el modelo y con menos peticiones en curso"""
+        candidates = [node for node in self.nodes if node not in exclude]
+        if not candidates:
+            raise NoOllamaNode("No hay nodos de Ollama disponibles")
+        available = [node for node in candidates if node.available] or candidates
+        with_model = [node for node in available if node.has_model(model)] or available
+        fewest = min(node.outstanding for node in with_model)
+        return random.choice([node for node in with_model if node.outstanding == fewest])
+
+    def _attempts(self) -> int:
+        return min(OLLAMA_RETRIES + 1, len(self.nodes))
+
+    async def post(
+        self,
+        client: httpx.AsyncClient,
+        path: str,
+        json: dict,
+        timeout: Optional[httpx.Timeout] = None,
+    ) -> httpx.Response:
+        """POST al mejor nodo, reintentando en otro si falla la conexión o el nodo"""
+        tried: List[OllamaNode] = []
+        for attempt in range(self._attempts()):
+            node = self.pick(json.get("model"), tried)
+            tried.append(node)
+            node.outstanding += 1
+            node.requests += 1
+            try:
+                kwargs = {"timeout": timeout} if timeout is not None else {}
+                response = await client.post(f"{node.url}{path}", json=json, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                node.record_failure()
+                if attempt + 1 >= self._attempts():
+                    raise
+                continue
+            except httpx.HTTPError:
+                # Timeout de lectura: reintentar duplicaría la espera
+                node.record_failure()
+                raise
+            finally:
+                node.outstanding -= 1
+
+            if response.status_code in _RETRY_STATUS and attempt + 1 < self._attempts():
+                node.record_failure()
+                continue
+            if response.status_code >= 500:
+                node.record_failure()
+            else:
+                node.record_success()
+            return response
+        raise NoOllamaNode("No hay nodos de Ollama disponibles")
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        client: httpx.AsyncClient,
+        path: str,
+        json: dict,
+        timeout: Optional[httpx.Timeout] = None,
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        Como client.stream("POST", ...) sobre el mejor nodo. Solo se reintenta
+        si falla antes de recibir la respuesta.
+        """
+        tried: List[OllamaNode] = []
+        kwargs = {"timeout": timeout} if timeout is not None else {}
+        for attempt in range(self._attempts()):
+            node = self.pick(json.get("model"), tried)
+            tried.append(node)
+            node.outstanding += 1
+            node.requests += 1
+            try:
+                request = client.build_request("POST", f"{node.url}{path}", json=json, **kwargs)
+                try:
+                    response = await client.send(request, stream=True)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                    node.record_failure()
+                    if attempt + 1 >= self._attempts():
+                        raise
+                    continue
+                except httpx.HTTPError:
+                    node.record_failure()
+                    raise
+
+                if response.status_code in _RETRY_STATUS and attempt + 1 < self._attempts():
+                    await response.aclose()
+                    node.record_failure()
+                    continue
+                try:
+                    yield response
+                finally:
+                    await response.aclose()
+                if response.status_code >= 500:
+                    node.record_failure()
+                else:
+                    node.record_success()
+                return
+            finally:
+                node.outstanding -= 1
+        raise NoOllamaNode("No hay nodos de Ollama disponibles")
+
+    async def check_health(self, client: httpx.AsyncClient) -> None:
+        async def check(node: OllamaNode) -> None:
+            try:
+                response = await client.get(f"{node.url}/api/tags", timeout=_HEALTH_TIMEOUT)
+                response.raise_for_status()
+                node.models = {model.get("name") for model in response.json().get("models", [])}
+                if not node.healthy:
+                    print(f"[Ollama] Nodo {node.url} disponible nuevamente")
+                node.healthy = True
+            except (httpx.HTTPError, ValueError) as e:
+                if node.healthy:
+                    print(f"[Ollama] Nodo {node.url} no responde: {e}")
+                node.healthy = False
+
+        await asyncio.gather(*[check(node) for node in self.nodes])
+
+    async def _health_loop(self, client: httpx.AsyncClient) -> None:
+        while True:
+            await self.check_health(client)
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+
+    def start_health_checks(self, client: httpx.AsyncClient) -> None:
+        # Con un solo nodo no hay a dónde desviar el tráfico
+        if len(self.nodes) > 1 and self._health_task is None:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(client))
+
+    def stop_health_checks(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            {
+                "url": node.url,
+                "healthy": node.healthy,
+                "ejected_seconds": round(max(node.ejected_until - now, 0), 1),
+                "outstanding": node.outstanding,
+                "requests": node.requests,
+                "failures": node.failures,
+                "models": sorted(node.models) if node.models is not None else None,
+            }
+            for node in self.nodes
+        ]
+
+
+    def collect_metrics(self):
+        """Carga y estado de cada nodo para /metrics"""
+        yield ("ollama_node_outstanding", "gauge", "Peticiones en curso por nodo de Ollama", ("node",),
+               [((node.url,), node.outstanding) for node in self.nodes])
+        yield ("ollama_node_available", "gauge", "1 si el nodo está sano y no excluido", ("node",),
+               [((node.url,), int(node.available)) for node in self.nodes])
+        yield ("ollama_node_failures_total", "counter", "Errores por nodo de Ollama", ("node",),
+               [((node.url,), node.failures) for node in self.nodes])
+
+
+ollama_pool = OllamaPool(OLLAMA_URLS)
+metrics.registry.add_collector(ollama_pool.collect_metrics)
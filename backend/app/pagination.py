@@ -0,0 +1,101 @@
+"""
+Paginación por cursor (keyset) para los endpoints de listado.
+
+Cada listado tiene un orden estable (con el id como desempate) respaldado
+por un índice, y pide las filas posteriores a la última entregada en lugar
+de usar OFFSET: cada página cuesta lo mismo sin importar cuántas filas haya
+antes.
+
+El cuerpo de la respuesta sigue siendo la lista de siempre; si hay más
+filas, el cursor de la siguiente página va en el header X-Next-Cursor:
+
+    GET /api/cases?limit=50
+    GET /api/cases?limit=50&cursor=<X-Next-Cursor>
+
+Variables de entorno:
+  PAGE_DEFAULT_LIMIT   filas por página si no se indica limit (default: 100)
+  PAGE_MAX_LIMIT       máximo de limit (default: 500)
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query as SAQuery
+
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "100"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "500"))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    """Parámetros limit/cursor comunes; se usa con Depends(PageParams)"""
+
+    def __init__(
+        self,
+        limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1, le=PAGE_MAX_LIMIT, description="Filas por página"),
+        cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+
+
+def encode_cursor(values: Sequence) -> str:
+    encoded = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(encoded).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("largo incorrecto")
+        return [
+            datetime.fromisoformat(value) if value is not None and _is_datetime(column) else value
+            for value, column in zip(values, columns)
+        ]
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cursor inválido: {e}")
+
+
+def _is_datetime(column) -> bool:
+    try:
+        return column.type.python_type is datetime
+    except NotImplementedError:
+        return False
+
+
+def _after(columns: Sequence, values: Sequence, descending: bool):
+    """Condición keyset: (c1, c2, ...) > (v1, v2, ...) (o < si es descendente)"""
+    conditions = []
+    for index, (column, value) in enumerate(zip(columns, values)):
+        beyond = column < value if descending else column > value
+        conditions.append(and_(*[c == v for c, v in zip(columns[:index], values[:index])], beyond))
+    return or_(*conditions)
+
+
+def paginate(
+    query: SAQuery,
+    columns: Sequence,
+    page: PageParams,
+    response: Response,
+    descending: bool = False,
+) -> List:
+    """
+    Una página de query ordenada por columns (la última debe ser única, ej.
+    el id). Las columnas deben estar entre las seleccionadas por query.
+    Agrega X-Next-Cursor a la respuesta si quedan filas.
+    """
+    if page.cursor:
+        query = query.filter(_after(columns, decode_cursor(page.cursor, columns), descending))
+    order = [column.desc() for column in columns] if descending else list(columns)
+    rows = query.order_by(*order).limit(page.limit + 1).all()
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(last, column.key) for column in columns])
+    return rows
@@ -0,0 +1,114 @@
+"""
+Caché en disco de previews JPEG de las imágenes médicas.
+
+Cada preview se genera una sola vez por (imagen, tamaño) y se guarda en
+uploads/previews. Para láminas SVS se lee el nivel de la pirámide más cercano
+al tamaño pedido en vez de la resolución base, y al generar un tamaño se
+aprovecha la misma imagen para derivar los tamaños menores.
+"""
+import os
+import threading
+from typing import Optional
+
+PREVIEW_DIR = "uploads/previews"
+PREVIEW_SIZES = (256, 1024, 4096, 8192)
+PREVIEW_QUALITY = 90
+
+os.makedirs(PREVIEW_DIR, exist_ok=True)
+
+# Un lock por imagen para no generar la misma preview dos veces en paralelo
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def normalize_size(size: Optional[int]) -> int:
+    """Ajusta el tamaño pedido al menor tamaño de preview que lo cubre"""
+    if size is None:
+        return PREVIEW_SIZES[-1]
+    for candidate in PREVIEW_SIZES:
+        if candidate >= size:
+            return candidate
+    return PREVIEW_SIZES[-1]
+
+
+def preview_path(filename: str, size: int) -> str:
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(PREVIEW_DIR, f"{stem}_{size}.jpeg")
+
+
+def preview_etag(filename: str, size: int) -> str:
+    stem = os.path.splitext(filename)[0]
+    return f'"{stem}-preview-{size}"'
+
+
+def _image_lock(filename: str) -> threading.Lock:
+    with _locks_guard:
+        lock = _locks.get(filename)
+        if lock is None:
+            lock = _locks[filename] = threading.Lock()
+        return lock
+
+
+def _load_svs(file_path: str, size: int):
+    import openslide
+
+    slide = openslide.open_slide(file_path)
+    try:
+        width, height = slide.dimensions
+        downsample = max(width / size, height / size, 1.0)
+        level = slide.get_best_level_for_downsample(downsample)
+        region = slide.read_region((0, 0), level, slide.level_dimensions[level])
+    finally:
+        slide.close()
+
+    # read_region devuelve RGBA con el fondo transparente; se compone sobre blanco
+    from PIL import Image as PILImage
+    background = PILImage.new("RGB", region.size, (255, 255, 255))
+    background.paste(region, mask=region.split()[3])
+    return background
+
+
+def _load_pillow(file_path: str, size: int):
+    from PIL import Image as PILImage
+
+    image = PILImage.open(file_path)
+    # Para JPEG, draft decodifica directamente a una escala reducida
+    image.draft("RGB", (size, size))
+    return image.convert("RGB")
+
+
+def get_preview(file_path: str, filename: str, file_type: str, size: int) -> str:
+    """
+    Retorna la ruta de la preview del tamaño indicado, generándola si no existe.
+    """
+    path = preview_path(filename, size)
+    if os.path.exists(path):
+        return path
+
+    with _image_lock(filename):
+        if os.path.exists(path):
+            return path
+
+        if file_type == "svs":
+            image = _load_svs(file_path, size)
+        else:
+            image = _load_pillow(file_path, size)
+
+        # Generar el tamaño pedido y, a partir de él, los menores que falten
+        for candidate in sorted((s for s in PREVIEW_SIZES if s <= size), reverse=True):
+            candidate_path = preview_path(filename, candidate)
+            image.thumbnail((candidate, candidate))
+            if os.path.exists(candidate_path):
+                continue
+            tmp_path = f"{candidate_path}.tmp"
+            image.save(tmp_path, format="JPEG", quality=PREVIEW_QUALITY)
+            os.replace(tmp_path, candidate_path)
+
+    return path
+
+
+def delete_previews(filename: str) -> None:
+    for size in PREVIEW_SIZES:
+        path = preview_path(filename, size)
+        if os.path.exists(path):
+            os.remove(path)
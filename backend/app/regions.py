@@ -0,0 +1,153 @@
+"""
+Extracción de regiones arbitrarias de una lámina (OpenSlide.read_region).
+
+Pensado para herramientas de anotación y el análisis de imágenes TB, que
+necesitan recortes como "esta región de 2048x2048 en el nivel 1" sin
+descargar la lámina completa ni unir decenas de tiles. El tamaño de salida
+y la cantidad de lecturas simultáneas están acotados, y las regiones ya
+codificadas se guardan en una caché LRU acotada por bytes.
+"""
+import os
+import threading
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from .slide_cache import BytesLRUCache, tile_server
+
+REGION_MAX_SIDE = int(os.getenv("REGION_MAX_SIDE", "4096"))
+REGION_CONCURRENCY = int(os.getenv("REGION_CONCURRENCY", "4"))
+REGION_CACHE_MB = int(os.getenv("REGION_CACHE_MB", "128"))
+REGION_WAIT_SECONDS = 10
+REGION_QUALITY = 90
+
+# Formatos de salida admitidos: alias -> (formato Pillow, media type)
+REGION_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+region_cache = BytesLRUCache(REGION_CACHE_MB * 1024 * 1024)
+_region_slots = threading.BoundedSemaphore(REGION_CONCURRENCY)
+
+# Geometría de cada lámina ya abierta: (dimensiones del nivel 0, dimensiones
+# por nivel, downsamples). Permite normalizar el pedido y responder desde la
+# caché sin esperar un cupo ni abrir la lámina
+SlideGeometry = Tuple[Tuple[int, int], Tuple[Tuple[int, int], ...], Tuple[float, ...]]
+_geometries: Dict[int, SlideGeometry] = {}
+
+
+class RegionBusyError(Exception):
+    """No hubo un cupo libre para leer la región dentro del tiempo de espera"""
+
+
+def normalize_format(fmt: str) -> str:
+    fmt = fmt.lower()
+    if fmt not in REGION_FORMATS:
+        raise ValueError(f"Formato no soportado. Formatos aceptados: {', '.join(REGION_FORMATS)}")
+    return "jpeg" if fmt == "jpg" else fmt
+
+
+def _normalize(geometry: SlideGeometry, x: int, y: int, level: int, width: int, height: int) -> Tuple[int, int]:
+    """
+    Recorta la región a los bordes de la lámina para que pedidos
+    equivalentes compartan la misma entrada de caché; retorna (ancho, alto)
+    """
+    (base_width, base_height), level_dimensions, downsamples = geometry
+    if level < 0 or level >= len(level_dimensions):
+        raise ValueError(f"Nivel {level} fuera de rango")
+    if x >= base_width or y >= base_height:
+        raise ValueError("La región está fuera de la lámina")
+    level_width, level_height = level_dimensions[level]
+    downsample = downsamples[level]
+    return min(width, level_width - int(x / downsample)), min(height, level_height - int(y / downsample))
+
+
+def _cached(image_id: int, x: int, y: int, level: int, width: int, height: int, fmt: str) -> Optional[Tuple[bytes, str]]:
+    geometry = _geometries.get(image_id)
+    if geometry is None:
+        return None
+    width, height = _normalize(geometry, x, y, level, width, height)
+    return region_cache.get((image_id, level, x, y, width, height, fmt))
+
+
+def read_region(
+    image_id: int,
+    stored_name: str,
+    file_path: str,
+    x: int,
+    y: int,
+    level: int,
+    width: int,
+    height: int,
+    fmt: str,
+) -> Tuple[bytes, str, str]:
+    """
+    Retorna (contenido, ETag, media type) de la región pedida.
+    x, y están en coordenadas del nivel 0, como en OpenSlide; width y height
+    en píxeles del nivel pedido. La región se recorta a los bordes de la lámina.
+    Lanza ValueError si los parámetros son inválidos y RegionBusyError si
+    se alcanzó el límite de lecturas simultáneas.
+    """
+    fmt = normalize_format(fmt)
+    if width <= 0 or height <= 0:
+        raise ValueError("El ancho y el alto deben ser positivos")
+    if width > REGION_MAX_SIDE or height > REGION_MAX_SIDE:
+        raise ValueError(f"La región no puede superar {REGION_MAX_SIDE}x{REGION_MAX_SIDE} píxeles")
+    if x < 0 or y < 0:
+        raise ValueError("Las coordenadas deben ser positivas")
+
+    # Las regiones en caché no esperan cupo ni abren la lámina
+    cached = _cached(image_id, x, y, level, width, height, fmt)
+    if cached is not None:
+        data, etag = cached
+        return data, etag, REGION_FORMATS[fmt][1]
+
+    if not _region_slots.acquire(timeout=REGION_WAIT_SECONDS):
+        raise RegionBusyError("Demasiadas extracciones de regiones en curso")
+    try:
+        with tile_server.slides.acquire_slide(file_path) as slide:
+            geometry = _geometries.get(image_id)
+            if geometry is None:
+                geometry = (
+                    tuple(slide.dimensions),
+                    tuple(tuple(dims) for dims in slide.level_dimensions),
+                    tuple(slide.level_downsamples),
+                )
+                _geometries[image_id] = geometry
+            width, height = _normalize(geometry, x, y, level, width, height)
+
+            # Otro pedido pudo generarla mientras se esperaba el cupo
+            key = (image_id, level, x, y, width, height, fmt)
+            cached = region_cache.get(key)
+            if cached is not None:
+                data, etag = cached
+                return data, etag, REGION_FORMATS[fmt][1]
+
+            region = slide.read_region((x, y), level, (width, height))
+
+        # La codificación también queda dentro del cupo para acotar la memoria
+        pil_format, media_type = REGION_FORMATS[fmt]
+        if pil_format == "JPEG":
+            # read_region devuelve RGBA con el fondo transparente; se compone sobre blanco
+            from PIL import Image as PILImage
+            background = PILImage.new("RGB", region.size, (255, 255, 255))
+            background.paste(region, mask=region.split()[3])
+            region = background
+
+        buffer = BytesIO()
+        region.save(buffer, pil_format, quality=REGION_QUALITY)
+        data = buffer.getvalue()
+    finally:
+        _region_slots.release()
+
+    stem = os.path.splitext(stored_name)[0]
+    etag = f'"{stem}-region-{level}-{x}-{y}-{width}-{height}.{fmt}"'
+    region_cache.put(key, data, etag)
+    return data, etag, media_type
+
+
+def evict_image(image_id: int) -> None:
+    _geometries.pop(image_id, None)
+    region_cache.evict_where(lambda key: key[0] == image_id)
@@ -1,17 +1,25 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
 from typing import Optional
 from ..db import get_db
 from ..models import Case
+from ..pagination import PageParams, paginate
 from ..schemas import CaseOut, CaseCreate
 
 router = APIRouter(prefix="/api", tags=["cases"])
 
+# Columnas de CaseOut: el listado no lee el cuerpo completo del caso
+_CASE_OUT_COLUMNS = (Case.id, Case.title, Case.description)
+
+
 @router.get("/cases", response_model=list[CaseOut])
-def list_cases(db: Session = Depends(get_db)):
-    cases = db.query(Case).filter(Case.is_active == True).all()
-    return cases
+def list_cases(response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
+    """
+    Casos activos por id, paginados con limit/cursor (ver pagination)
+    """
+    query = db.query(*_CASE_OUT_COLUMNS).filter(Case.is_active == True)
+    return [row._asdict() for row in paginate(query, (Case.id,), page, response)]
 
 
 @router.post("/cases", response_model=CaseOut)
@@ -41,7 +49,7 @@ def search_cases(
     Busca casos clínicos por palabras clave en título, descripción, 
     síntomas, diagnóstico, etc.
     """
-    query = db.query(Case).filter(Case.is_active == True)
+    query = db.query(*_CASE_OUT_COLUMNS).filter(Case.is_active == True)
     
     if q:
         search_term = f"%{q}%"
@@ -54,4 +62,4 @@ def search_cases(
         )
     
     cases = query.limit(limit).all()
-    return cases
+    return [row._asdict() for row in cases]
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 import httpx
 import os
 import logging
 
+from ..http_clients import get_rasa_client, RASA_TIMEOUT
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,7 +20,7 @@ class ChatRequest(BaseModel):
 
 
 @router.post("/chat")
-async def chat(req: ChatRequest):
+async def chat(req: ChatRequest, client: httpx.AsyncClient = Depends(get_rasa_client)):
     payload = {
         "sender": "usuario_demo",
         "message": req.text,
@@ -28,29 +30,29 @@ async def chat(req: ChatRequest):
     logger.info(f"Payload: {payload}")
 
     try:
-        async with httpx.AsyncClient(timeout=180.0) as client:
-            resp = await client.post(RASA_URL, json=payload)
-            logger.info(f"Rasa respondió con status: {resp.status_code}")
-            logger.info(f"Respuesta: {resp.text[:200]}")
-            
-            if resp.status_code != 200:
-                # Rasa devolvió error explícito
-                raise HTTPException(
-                    status_code=502,
-                    detail=f"Rasa devolvió un error HTTP {resp.status_code}: {resp.text}",
-                )
+        # Cliente compartido: reutiliza conexiones abiertas con Rasa
+        resp = await client.post(RASA_URL, json=payload, timeout=RASA_TIMEOUT)
+        logger.info(f"Rasa respondió con status: {resp.status_code}")
+        logger.info(f"Respuesta: {resp.text[:200]}")
+        
+        if resp.status_code != 200:
+            # Rasa devolvió error explícito
+            raise HTTPException(
+                status_code=502,
+                detail=f"Rasa devolvió un error HTTP {resp.status_code}: {resp.text}",
+            )
 
-            try:
-                rasa_messages = resp.json()  # lista de {text, ...}
-            except ValueError as e:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"No se pudo parsear la respuesta de Rasa como JSON: {e}",
-                )
+        try:
+            rasa_messages = resp.json()  # lista de {text, ...}
+        except ValueError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"No se pudo parsear la respuesta de Rasa como JSON: {e}",
+            )
 
-            # Normalizamos la respuesta para el frontend
-            return {"messages": rasa_messages}
-            
+        # Normalizamos la respuesta para el frontend
+        return {"messages": rasa_messages}
+        
     except httpx.HTTPError as e:
         # Error al conectar con Rasa
         logger.error(f"Excepción al conectar con Rasa: {type(e).__name__}: {e}")
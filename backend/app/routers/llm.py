@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException
+import httpx
+import time
+
+from ..http_clients import get_ollama_client, OLLAMA_TIMEOUT
+from ..llm_gateway import llm_gateway, INTERACTIVE
+from ..ollama_pool import ollama_pool
+from ..ollama_models import keep_alive_for, num_ctx_for, record_timings, timing_stats
+from ..sct_salvage import salvage_stats
+
+router = APIRouter(prefix="/api/llm", tags=["LLM"])
+
+
+@router.post("/chat")
+async def llm_chat(payload: dict, client: httpx.AsyncClient = Depends(get_ollama_client)):
+    """
+    Proxy de Ollama /api/chat con prioridad interactiva (lo usa la acción
+    ActionConsultarLLMMedico de Rasa). Sin respuesta en streaming.
+
+    Si el modelo está saturado responde 429/503 con Retry-After.
+    """
+    model = payload.get("model")
+    # El mismo num_ctx que SCT y el precalentamiento: otro valor haría que
+    # Ollama recargue el modelo al alternar chat y generación SCT
+    options = {**(payload.get("options") or {}), "num_ctx": num_ctx_for(model)}
+    payload = {"keep_alive": keep_alive_for(model), **payload, "options": options, "stream": False}
+    async with llm_gateway.slot(INTERACTIVE):
+        started = time.monotonic()
+        try:
+            response = await ollama_pool.post(client, "/api/chat", json=payload, timeout=OLLAMA_TIMEOUT)
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Error al conectar con Ollama: {e}")
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Ollama devolvió un error HTTP {response.status_code}: {response.text}")
+
+    data = response.json()
+    record_timings("chat", model, data)
+    print(f"[LLM] Chat respondido en {time.monotonic() - started:.1f}s")
+    return data
+
+
+@router.get("/stats")
+def llm_stats():
+    """
+    Cupos, colas y tiempos de espera por prioridad, estado de cada nodo de
+    Ollama, tiempos promedio de carga y evaluación del prompt por llamador y
+    recuperación de respuestas SCT mal formadas
+    """
+    return {
+        **llm_gateway.stats(),
+        "nodes": ollama_pool.stats(),
+        "timings": timing_stats(),
+        "sct_salvage": salvage_stats.stats(),
+    }
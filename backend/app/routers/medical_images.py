@@ -1,20 +1,34 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form, Request, Query
+from fastapi.responses import FileResponse, RedirectResponse, Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
 import uuid
 import shutil
+import hashlib
 from datetime import datetime
-from io import BytesIO
 from ..db import get_db
-from ..models import MedicalImage, User
+from ..models import MedicalImage, User, TilingJob, UploadSession
+from ..pagination import PageParams, paginate
+from ..schemas import UploadInitRequest
+from .. import chunked_uploads
+from ..slide_cache import tile_server, dzi_paths, dzi_tiles_url, build_dzi_xml, DZI_DIR, DZI_FORMAT, DZI_TILE_SIZE, DZI_OVERLAP
+from ..slide_metadata import extract_metadata, apply_metadata, copy_metadata
+from ..tile_codec import tile_codec
+from ..file_responses import RangeFileResponse
+from ..http_cache import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, etag_matches, not_modified
+from ..tile_pack import delete_pack
+from ..regions import read_region, evict_image as evict_regions, RegionBusyError
+from ..previews import get_preview, normalize_size, preview_etag, delete_previews
+from ..tissue_mask import mask_path, delete_mask
+from ..executors import run_slide_io, run_file_io
+from ..tiling_jobs import enqueue_tiling_job, cancel_jobs_for_image, TILING_ON_UPLOAD
 
 router = APIRouter(prefix="/api/medical-images", tags=["medical-images"])
 
 # Directorio para almacenar las imágenes
 UPLOAD_DIR = "uploads/medical_images"
-DZI_DIR = "uploads/dzi_tiles"
 
 # Crear directorios si no existen
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -37,6 +51,162 @@ def get_current_user(db: Session = Depends(get_db)) -> User:
         db.refresh(user)
     return user
 
+ALLOWED_EXTENSIONS = [".svs", ".jpg", ".jpeg", ".png", ".tiff", ".tif"]
+
+def _get_active_image(db: Session, image_id: int, require_file: bool = False) -> MedicalImage:
+    """Imagen activa o 404. Es bloqueante: en endpoints async usar run_in_threadpool"""
+    image = db.query(MedicalImage).filter(
+        MedicalImage.id == image_id,
+        MedicalImage.is_active == True
+    ).first()
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    
+    if require_file and not os.path.exists(image.file_path):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
+    
+    return image
+
+def _check_upload_permission(current_user: User):
+    if current_user.role not in ["docente", "administrador"]:
+        raise HTTPException(
+            status_code=403, 
+            detail="No tienes permisos para subir imágenes. Solo docentes y administradores."
+        )
+
+def _validate_extension(filename: str) -> str:
+    file_extension = os.path.splitext(filename)[1].lower()
+    
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato no permitido. Formatos aceptados: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    return file_extension
+
+def store_medical_image(
+    part_file: Optional[str],
+    content_hash: str,
+    file_extension: str,
+    original_filename: str,
+    title: str,
+    description: Optional[str],
+    pathology_type: Optional[str],
+    db: Session,
+    current_user: User
+):
+    """
+    Registra una imagen almacenada por contenido (sha256).
+    Si ya existe un archivo con el mismo hash, el nuevo registro apunta al
+    archivo y a los tiles existentes y el archivo recibido se descarta.
+    Retorna (medical_image, deduplicated, tiling_job_id).
+    """
+    existing = db.query(MedicalImage).filter(
+        MedicalImage.content_hash == content_hash
+    ).first()
+    
+    deduplicated = existing is not None and os.path.exists(existing.file_path)
+    if deduplicated:
+        if part_file and os.path.exists(part_file):
+            os.remove(part_file)
+        file_path = existing.file_path
+        file_size = existing.file_size
+        dzi_path = existing.dzi_path
+        metadata = None
+    else:
+        file_path = os.path.join(UPLOAD_DIR, f"{content_hash}{file_extension}")
+        os.replace(part_file, file_path)
+        file_size = os.path.getsize(file_path)
+        dzi_path = None
+        # Leer los metadatos de la lámina una sola vez, al ingresarla
+        try:
+            metadata = extract_metadata(file_path, file_extension[1:])
+        except Exception as e:
+            print(f"Error leyendo metadatos de la imagen: {e}")
+            metadata = None
+    
+    # Crear registro en la base de datos
+    medical_image = MedicalImage(
+        filename=f"{uuid.uuid4()}{file_extension}",
+        original_filename=original_filename,
+        title=title,
+        description=description,
+        pathology_type=pathology_type,
+        file_type=file_extension[1:],  # sin el punto
+        file_size=file_size,
+        file_path=file_path,
+        content_hash=content_hash,
+        dzi_path=dzi_path,
+        uploaded_by=current_user.id
+    )
+    if deduplicated:
+        copy_metadata(existing, medical_image)
+    else:
+        apply_metadata(medical_image, metadata)
+    
+    db.add(medical_image)
+    db.commit()
+    db.refresh(medical_image)
+    
+    # Si es SVS, registrar el descriptor DZI; los tiles se generan
+    # bajo demanda en /{id}/dzi/... por lo que la lámina es visible de inmediato
+    tiling_job_id = None
+    if file_extension == ".svs" and medical_image.dzi_path is None:
+        try:
+            register_dzi(medical_image, db)
+            # Pre-generar los tiles en segundo plano con el pool de procesos
+            if TILING_ON_UPLOAD and not deduplicated:
+                tiling_job_id = enqueue_tiling_job(medical_image.id)
+        except Exception as e:
+            print(f"Error registrando DZI: {e}")
+            # No falla la carga, solo no tendrá tiles
+    
+    return medical_image, deduplicated, tiling_job_id
+
+def _slide_metadata_fields(image: MedicalImage) -> dict:
+    """Metadatos de la lámina guardados en la BD (sin abrir el archivo)"""
+    return {
+        "width": image.width,
+        "height": image.height,
+        "level_count": image.level_count,
+        "mpp_x": image.mpp_x,
+        "mpp_y": image.mpp_y,
+        "objective_power": image.objective_power,
+        "vendor": image.vendor,
+    }
+
+def _viewer_tile_source(image: MedicalImage) -> Optional[dict]:
+    """
+    Tile source de OpenSeadragon en formato DZI-JSON, para que el visor se
+    configure con la respuesta de /info sin pedir el descriptor .dzi
+    """
+    if image.dzi_path is None or image.width is None:
+        return None
+    return {
+        "Image": {
+            "xmlns": "http://schemas.microsoft.com/deepzoom/2008",
+            "Url": dzi_tiles_url(router.prefix, image.id),
+            "Format": DZI_FORMAT,
+            "Overlap": str(DZI_OVERLAP),
+            "TileSize": str(DZI_TILE_SIZE),
+            "Size": {"Width": str(image.width), "Height": str(image.height)}
+        }
+    }
+
+def _upload_response(medical_image: MedicalImage, deduplicated: bool, tiling_job_id: Optional[int]) -> dict:
+    return {
+        "id": medical_image.id,
+        "filename": medical_image.filename,
+        "title": medical_image.title,
+        "file_type": medical_image.file_type,
+        "file_size": medical_image.file_size,
+        "content_hash": medical_image.content_hash,
+        "deduplicated": deduplicated,
+        "tiling_job_id": tiling_job_id,
+        "message": "Imagen subida exitosamente"
+    }
+
 @router.post("/upload")
 async def upload_medical_image(
     file: UploadFile = File(...),
@@ -47,88 +217,283 @@ async def upload_medical_image(
     current_user: User = Depends(get_current_user)
 ):
     """
-    Subir una imagen médica (SVS, JPG, PNG, etc.)
+    Subir una imagen médica (SVS, JPG, PNG, etc.) en una sola petición
     Solo usuarios con rol docente o administrador pueden subir
+    Para archivos grandes usar la subida por partes (/uploads)
     """
     # Verificar permisos
-    if current_user.role not in ["docente", "administrador"]:
-        raise HTTPException(
-            status_code=403, 
-            detail="No tienes permisos para subir imágenes. Solo docentes y administradores."
-        )
+    _check_upload_permission(current_user)
     
     # Obtener extensión del archivo
-    file_extension = os.path.splitext(file.filename)[1].lower()
-    allowed_extensions = [".svs", ".jpg", ".jpeg", ".png", ".tiff", ".tif"]
+    file_extension = _validate_extension(file.filename)
     
-    if file_extension not in allowed_extensions:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Formato no permitido. Formatos aceptados: {', '.join(allowed_extensions)}"
-        )
-    
-    # Generar nombre único para el archivo
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    part_file = chunked_uploads.part_path(str(uuid.uuid4()))
     
-    # Guardar el archivo
+    # Guardar el archivo calculando su hash mientras se copia; la lectura es
+    # async y cada bloque se escribe en el pool de archivos
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Obtener tamaño del archivo
-        file_size = os.path.getsize(file_path)
+        hasher = hashlib.sha256()
+        buffer = await run_file_io(open, part_file, "wb")
+        try:
+            while True:
+                block = await file.read(chunked_uploads.UPLOAD_CHUNK_SIZE)
+                if not block:
+                    break
+                await run_file_io(_write_hashed, buffer, hasher, block)
+        finally:
+            await run_file_io(buffer.close)
         
-        # Crear registro en la base de datos
-        medical_image = MedicalImage(
-            filename=unique_filename,
-            original_filename=file.filename,
-            title=title,
-            description=description,
-            pathology_type=pathology_type,
-            file_type=file_extension[1:],  # sin el punto
-            file_size=file_size,
-            file_path=file_path,
-            uploaded_by=current_user.id
+        medical_image, deduplicated, tiling_job_id = await run_slide_io(
+            store_medical_image,
+            part_file, hasher.hexdigest(), file_extension, file.filename,
+            title, description, pathology_type, db, current_user
         )
-        
-        db.add(medical_image)
-        db.commit()
-        db.refresh(medical_image)
-        
-        # Si es SVS, procesarlo en segundo plano (opcional)
-        if file_extension == ".svs":
-            try:
-                process_svs_to_dzi(medical_image, db)
-            except Exception as e:
-                print(f"Error procesando SVS a DZI: {e}")
-                # No falla la carga, solo no tendrá tiles
-        
-        return {
-            "id": medical_image.id,
-            "filename": medical_image.filename,
-            "title": medical_image.title,
-            "file_type": medical_image.file_type,
-            "file_size": medical_image.file_size,
-            "message": "Imagen subida exitosamente"
-        }
+        return _upload_response(medical_image, deduplicated, tiling_job_id)
         
     except Exception as e:
         # Limpiar archivo si hubo error
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await run_file_io(_remove_if_exists, part_file)
         raise HTTPException(status_code=500, detail=f"Error al subir imagen: {str(e)}")
 
+def _write_hashed(buffer, hasher, block: bytes) -> None:
+    hasher.update(block)
+    buffer.write(block)
+
+def _remove_if_exists(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+def _upload_session_status(session: UploadSession) -> dict:
+    return {
+        "upload_id": session.id,
+        "offset": session.received_bytes,
+        "size": session.total_size,
+        "chunk_size": chunked_uploads.UPLOAD_CHUNK_SIZE,
+        "complete": session.received_bytes >= session.total_size
+    }
+
+def _get_upload_session(db: Session, upload_id: str, current_user: User) -> UploadSession:
+    """Subida en curso del usuario; el id de la subida solo no basta para usarla"""
+    _check_upload_permission(current_user)
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+    if session.uploaded_by != current_user.id:
+        raise HTTPException(status_code=403, detail="La subida pertenece a otro usuario")
+    return session
+
+@router.post("/uploads")
+def init_chunked_upload(
+    request: UploadInitRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Inicia una subida reanudable por partes.
+    Si el cliente envía el sha256 y el mismo usuario ya subió ese contenido,
+    la imagen se registra de inmediato sin transferir el archivo. Con
+    archivos de otros usuarios no: conocer el hash no prueba tener el
+    archivo, así que se sube completo y se deduplica al terminar, con el
+    hash calculado en el servidor.
+    """
+    _check_upload_permission(current_user)
+    file_extension = _validate_extension(request.filename)
+    
+    if request.sha256:
+        content_hash = request.sha256.lower()
+        existing = db.query(MedicalImage).filter(
+            MedicalImage.content_hash == content_hash,
+            MedicalImage.uploaded_by == current_user.id
+        ).first()
+        if existing and os.path.exists(existing.file_path):
+            medical_image, deduplicated, tiling_job_id = store_medical_image(
+                None, content_hash, file_extension, request.filename,
+                request.title, request.description, request.pathology_type, db, current_user
+            )
+            return {"upload_id": None, **_upload_response(medical_image, deduplicated, tiling_job_id)}
+    
+    session = UploadSession(
+        id=str(uuid.uuid4()),
+        original_filename=request.filename,
+        title=request.title,
+        description=request.description,
+        pathology_type=request.pathology_type,
+        file_type=file_extension[1:],
+        total_size=request.size,
+        received_bytes=0,
+        expected_hash=request.sha256.lower() if request.sha256 else None,
+        uploaded_by=current_user.id
+    )
+    db.add(session)
+    db.commit()
+    
+    open(chunked_uploads.part_path(session.id), "wb").close()
+    
+    return _upload_session_status(session)
+
+@router.get("/uploads/{upload_id}")
+def get_chunked_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Estado de una subida por partes: el offset indica desde dónde reanudar
+    """
+    return _upload_session_status(_get_upload_session(db, upload_id, current_user))
+
+def _check_chunk_size(size: int, remaining: int) -> None:
+    if size > chunked_uploads.MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=413, detail="Chunk demasiado grande")
+    if size > remaining:
+        raise HTTPException(status_code=400, detail="El chunk excede el tamaño declarado")
+
+async def _read_chunk(request: Request, remaining: int) -> bytes:
+    """
+    Lee el cuerpo del chunk cortando apenas supera MAX_CHUNK_SIZE o los bytes
+    que faltan de la subida, sin cargar en memoria un cuerpo excesivo
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        try:
+            declared = int(content_length)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Content-Length inválido")
+        _check_chunk_size(declared, remaining)
+    
+    data = bytearray()
+    async for block in request.stream():
+        data += block
+        _check_chunk_size(len(data), remaining)
+    return bytes(data)
+
+@router.put("/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., description="Posición en bytes del chunk dentro del archivo"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Envía un chunk (cuerpo binario) en la posición indicada.
+    Los chunks deben enviarse en orden; si el offset no coincide con lo ya
+    recibido se responde 409 con el offset correcto para reanudar.
+    """
+    session = await run_in_threadpool(_get_upload_session, db, upload_id, current_user)
+    
+    if offset != session.received_bytes:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Offset inválido", "offset": session.received_bytes}
+        )
+    
+    data = await _read_chunk(request, session.total_size - session.received_bytes)
+    
+    session.received_bytes = await run_file_io(
+        chunked_uploads.append_chunk, upload_id, session.received_bytes, data
+    )
+    session.updated_at = datetime.utcnow()
+    await run_in_threadpool(db.commit)
+    
+    return _upload_session_status(session)
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_chunked_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Finaliza una subida por partes y registra la imagen.
+    """
+    session = await run_in_threadpool(_get_upload_session, db, upload_id, current_user)
+    
+    if session.received_bytes != session.total_size:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "La subida está incompleta", "offset": session.received_bytes}
+        )
+    
+    # Tras un reinicio el hash se reconstruye leyendo el archivo completo
+    part_file, content_hash = await run_file_io(chunked_uploads.finish, upload_id, session.received_bytes)
+    
+    if session.expected_hash and session.expected_hash != content_hash:
+        await run_file_io(chunked_uploads.discard, upload_id)
+        await run_in_threadpool(_delete_upload_session, db, session)
+        raise HTTPException(status_code=400, detail="El sha256 del archivo no coincide con el informado")
+    
+    try:
+        medical_image, deduplicated, tiling_job_id = await run_slide_io(
+            store_medical_image,
+            part_file, content_hash, f".{session.file_type}", session.original_filename,
+            session.title, session.description, session.pathology_type, db, current_user
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al registrar imagen: {str(e)}")
+    
+    await run_in_threadpool(_delete_upload_session, db, session)
+    
+    return _upload_response(medical_image, deduplicated, tiling_job_id)
+
+def _delete_upload_session(db: Session, session: UploadSession) -> None:
+    db.delete(session)
+    db.commit()
+
+@router.delete("/uploads/{upload_id}")
+def abort_chunked_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Cancela una subida por partes y elimina lo recibido.
+    """
+    session = _get_upload_session(db, upload_id, current_user)
+    chunked_uploads.discard(upload_id)
+    db.delete(session)
+    db.commit()
+    return {"message": "Subida cancelada"}
+
+# Columnas que devuelve /list: sin rutas de archivo ni slide_metadata
+_LIST_COLUMNS = (
+    MedicalImage.id,
+    MedicalImage.filename,
+    MedicalImage.title,
+    MedicalImage.description,
+    MedicalImage.pathology_type,
+    MedicalImage.file_type,
+    MedicalImage.file_size,
+    (MedicalImage.dzi_path != None).label("has_dzi"),
+    MedicalImage.width,
+    MedicalImage.height,
+    MedicalImage.level_count,
+    MedicalImage.mpp_x,
+    MedicalImage.mpp_y,
+    MedicalImage.objective_power,
+    MedicalImage.vendor,
+    MedicalImage.created_at,
+)
+
 @router.get("/list")
-async def list_medical_images(
+def list_medical_images(
+    response: Response,
+    page: PageParams = Depends(),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Listar todas las imágenes médicas disponibles
+    Listar las imágenes médicas disponibles, de la más reciente a la más
+    antigua, paginadas con limit/cursor (ver pagination)
     Todos los usuarios autenticados pueden ver la lista
     """
-    images = db.query(MedicalImage).filter(MedicalImage.is_active == True).all()
+    # El nombre de quien la subió viene en la misma consulta (sin lazy load por fila)
+    query = (
+        db.query(*_LIST_COLUMNS, User.name.label("uploader_name"))
+        .outerjoin(User, MedicalImage.uploaded_by == User.id)
+        .filter(MedicalImage.is_active == True)
+    )
+    images = paginate(query, (MedicalImage.created_at, MedicalImage.id), page, response, descending=True)
     
     return [
         {
@@ -139,9 +504,10 @@ async def list_medical_images(
             "pathology_type": img.pathology_type,
             "file_type": img.file_type,
             "file_size": img.file_size,
-            "has_dzi": img.dzi_path is not None,
+            "has_dzi": bool(img.has_dzi),
+            **_slide_metadata_fields(img),
             "created_at": img.created_at.isoformat(),
-            "uploader_name": img.uploader.name if img.uploader else "Desconocido"
+            "uploader_name": img.uploader_name or "Desconocido"
         }
         for img in images
     ]
@@ -149,47 +515,29 @@ async def list_medical_images(
 @router.get("/view/{image_id}")
 async def view_image(
     image_id: int,
+    request: Request,
+    size: Optional[int] = Query(None, description="Lado máximo de la preview en píxeles (256, 1024, 4096 u 8192)"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     Ver/servir una imagen médica optimizada para el navegador
-    Para SVS genera un preview JPG, para otros formatos los sirve directamente
+    Para SVS (o si se pide un tamaño) sirve una preview JPG cacheada en disco,
+    para otros formatos sin tamaño los sirve directamente
     """
-    image = db.query(MedicalImage).filter(
-        MedicalImage.id == image_id,
-        MedicalImage.is_active == True
-    ).first()
-    
-    if not image:
-        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    image = await run_in_threadpool(_get_active_image, db, image_id, True)
     
-    if not os.path.exists(image.file_path):
-        raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
-    
-    # Si es SVS, generar un preview JPG
-    if image.file_type == 'svs':
+    # Si es SVS o se pidió un tamaño, servir la preview cacheada
+    if image.file_type == 'svs' or size is not None:
+        preview_size = normalize_size(size)
+        etag = preview_etag(image.stored_name, preview_size)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        
         try:
-            import openslide
-            from PIL import Image as PILImage
-            
-            # Abrir el archivo SVS
-            slide = openslide.OpenSlide(image.file_path)
-            
-            # Obtener thumbnail de alta resolución
-            # Aumentar a 8192x8192 para mejor calidad (similar a QuPath)
-            thumbnail_size = (8192, 8192)  # Thumbnail de alta resolución
-            thumbnail = slide.get_thumbnail(thumbnail_size)
-            
-            # Convertir a bytes con máxima calidad
-            img_byte_arr = BytesIO()
-            thumbnail.save(img_byte_arr, format='JPEG', quality=95, optimize=True)
-            img_byte_arr.seek(0)
-            
-            slide.close()
-            
-            return StreamingResponse(img_byte_arr, media_type="image/jpeg")
-            
+            path = await run_slide_io(
+                get_preview, image.file_path, image.stored_name, image.file_type, preview_size
+            )
         except ImportError as e:
             # Si OpenSlide no está disponible, informar al usuario
             raise HTTPException(
@@ -197,21 +545,28 @@ async def view_image(
                 detail="OpenSlide no está instalado. Los archivos SVS requieren OpenSlide. Por favor, sube imágenes en formato JPG, PNG o TIFF, o instala OpenSlide en el servidor."
             )
         except Exception as e:
-            print(f"Error procesando SVS: {str(e)}")
+            print(f"Error generando preview: {str(e)}")
             raise HTTPException(
                 status_code=500,
-                detail=f"Error procesando archivo SVS: {str(e)}. Intenta subir la imagen en formato JPG o PNG."
+                detail=f"Error procesando archivo {image.file_type.upper()}: {str(e)}. Intenta subir la imagen en formato JPG o PNG."
             )
-    else:
-        # Para otros formatos, servir directamente
+        
         return FileResponse(
+            path,
+            media_type="image/jpeg",
+            headers={"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        )
+    else:
+        # Para otros formatos, servir directamente (con soporte de Range y 304)
+        return RangeFileResponse(
             image.file_path,
             media_type=f"image/{image.file_type}",
-            filename=image.original_filename
+            filename=image.original_filename,
+            content_hash=image.content_hash
         )
 
-@router.get("/download/{image_id}")
-async def download_image(
+@router.api_route("/download/{image_id}", methods=["GET", "HEAD"])
+def download_image(
     image_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -230,10 +585,12 @@ async def download_image(
     if not os.path.exists(image.file_path):
         raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
     
-    return FileResponse(
+    # Soporta descargas reanudables (Range) y revalidación con ETag/Last-Modified
+    return RangeFileResponse(
         image.file_path,
         media_type=f"image/{image.file_type}",
-        filename=image.original_filename
+        filename=image.original_filename,
+        content_hash=image.content_hash
     )
 
 @router.delete("/{image_id}")
@@ -249,34 +606,77 @@ async def delete_medical_image(
     if current_user.role not in ["docente", "administrador"]:
         raise HTTPException(status_code=403, detail="No tienes permisos para eliminar imágenes")
     
-    image = db.query(MedicalImage).filter(MedicalImage.id == image_id).first()
+    image = await run_in_threadpool(
+        lambda: db.query(MedicalImage).filter(MedicalImage.id == image_id).first()
+    )
     
     if not image:
         raise HTTPException(status_code=404, detail="Imagen no encontrada")
     
-    # Eliminar archivo físico
+    # Liberar los tiles y regiones en memoria de este registro
+    tile_server.tiles.evict_where(lambda key: key[0] == image.id)
+    evict_regions(image.id)
+    
+    shared = await run_in_threadpool(_release_tiling_jobs, db, image)
+    if not shared:
+        # Liberar el handle OpenSlide y borrar los archivos; borrar una
+        # carpeta DZI puede tomar minutos, por eso va al pool de archivos
+        tile_server.evict(image.id, image.file_path)
+        await run_file_io(_remove_image_files, image.file_path, image.dzi_path, image.stored_name)
+    
+    # Eliminar de la base de datos
+    await run_in_threadpool(_delete_image_row, db, image)
+    
+    return {"message": "Imagen eliminada exitosamente"}
+
+def _release_tiling_jobs(db: Session, image: MedicalImage) -> bool:
+    """
+    Otros registros deduplicados pueden compartir el archivo y sus tiles:
+    en ese caso el tiling en curso pasa al registro que queda y se retorna
+    True. Si no, se detiene el tiling y se retorna False.
+    """
+    other = db.query(MedicalImage.id).filter(
+        MedicalImage.file_path == image.file_path,
+        MedicalImage.id != image.id
+    ).first()
+    
+    if other is None:
+        cancel_jobs_for_image(image.id, db)
+        return False
+    
+    db.query(TilingJob).filter(TilingJob.image_id == image.id).update(
+        {TilingJob.image_id: other.id}, synchronize_session=False
+    )
+    return True
+
+def _remove_image_files(file_path: str, dzi_path: Optional[str], stored_name: str) -> None:
     try:
-        if os.path.exists(image.file_path):
-            os.remove(image.file_path)
+        # Eliminar archivo físico
+        if os.path.exists(file_path):
+            os.remove(file_path)
         
         # Eliminar tiles DZI si existen
-        if image.dzi_path and os.path.exists(image.dzi_path):
+        if dzi_path and os.path.exists(dzi_path):
             # Eliminar carpeta de tiles
-            dzi_folder = image.dzi_path.replace(".dzi", "_files")
+            dzi_folder = dzi_path.replace(".dzi", "_files")
             if os.path.exists(dzi_folder):
                 shutil.rmtree(dzi_folder)
-            os.remove(image.dzi_path)
+            os.remove(dzi_path)
+        
+        # Eliminar el pack de tiles (un solo unlink), las previews cacheadas
+        # y la máscara de tejido
+        delete_pack(stored_name)
+        delete_previews(stored_name)
+        delete_mask(stored_name)
     except Exception as e:
         print(f"Error eliminando archivos: {e}")
-    
-    # Eliminar de la base de datos
+
+def _delete_image_row(db: Session, image: MedicalImage) -> None:
     db.delete(image)
     db.commit()
-    
-    return {"message": "Imagen eliminada exitosamente"}
 
 @router.get("/info/{image_id}")
-async def get_image_info(
+def get_image_info(
     image_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -301,6 +701,10 @@ async def get_image_info(
         "file_size": image.file_size,
         "original_filename": image.original_filename,
         "has_dzi": image.dzi_path is not None,
+        **_slide_metadata_fields(image),
+        "slide_metadata": image.slide_metadata,
+        "tissue_fraction": image.tissue_fraction,
+        "tile_source": _viewer_tile_source(image),
         "created_at": image.created_at.isoformat(),
         "uploader": {
             "id": image.uploader.id,
@@ -309,63 +713,251 @@ async def get_image_info(
     }
 
 
-def process_svs_to_dzi(medical_image: MedicalImage, db: Session):
+@router.get("/{image_id}.dzi")
+async def get_dzi_descriptor(
+    image_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
     """
-    Procesar un archivo SVS para generar tiles DZI (Deep Zoom Image)
-    Esto permite visualizar imágenes de alta resolución sin cargar todo en memoria
+    Descriptor Deep Zoom de una imagen. El atributo Url apunta al endpoint
+    de tiles bajo demanda, por lo que OpenSeadragon lo usa directamente.
+    La URL del descriptor no cambia con el perfil de codificación, así que
+    se revalida en lugar de guardarse como inmutable.
     """
+    image = await run_in_threadpool(_get_active_image, db, image_id)
+    
+    etag = f'"{os.path.splitext(image.stored_name)[0]}-dzi-{tile_codec.version}.{DZI_FORMAT}"'
+    if etag_matches(request, etag):
+        return not_modified(etag, REVALIDATE_CACHE_CONTROL)
+    
+    tiles_url = dzi_tiles_url(router.prefix, image_id)
+    # Con los metadatos guardados el descriptor sale de la BD sin abrir la lámina
+    if image.width is not None:
+        dzi_xml = build_dzi_xml(image.width, image.height, tiles_url)
+    elif not os.path.exists(image.file_path):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado en el servidor")
+    else:
+        dzi_xml = await run_slide_io(_read_dzi_descriptor, image.file_path, tiles_url)
+    
+    return Response(
+        content=dzi_xml,
+        media_type="application/xml",
+        headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    )
+
+def _read_dzi_descriptor(file_path: str, tiles_url: str) -> str:
     try:
-        import openslide
-        from openslide import deepzoom
-        
-        # Abrir el archivo SVS
-        slide = openslide.OpenSlide(medical_image.file_path)
-        
-        # Crear generador de tiles
-        tile_size = 256
-        overlap = 1
-        dz_generator = deepzoom.DeepZoomGenerator(slide, tile_size=tile_size, overlap=overlap)
-        
-        # Crear directorio para los tiles
-        dzi_filename = f"{os.path.splitext(medical_image.filename)[0]}.dzi"
-        dzi_path = os.path.join(DZI_DIR, dzi_filename)
-        tiles_dir = os.path.join(DZI_DIR, f"{os.path.splitext(medical_image.filename)[0]}_files")
-        
-        os.makedirs(tiles_dir, exist_ok=True)
-        
-        # Generar tiles para todos los niveles de zoom
-        for level in range(dz_generator.level_count):
-            level_dir = os.path.join(tiles_dir, str(level))
-            os.makedirs(level_dir, exist_ok=True)
-            
-            cols, rows = dz_generator.level_tiles[level]
-            for row in range(rows):
-                for col in range(cols):
-                    tile = dz_generator.get_tile(level, (col, row))
-                    tile_path = os.path.join(level_dir, f"{col}_{row}.jpeg")
-                    tile.save(tile_path, "JPEG", quality=90)
-        
-        # Generar archivo DZI XML
-        dzi_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-<Image xmlns="http://schemas.microsoft.com/deepzoom/2008"
-  Format="jpeg"
-  Overlap="{overlap}"
-  TileSize="{tile_size}">
-  <Size Height="{dz_generator.level_dimensions[-1][1]}"
-    Width="{dz_generator.level_dimensions[-1][0]}"/>
-</Image>'''
-        
-        with open(dzi_path, 'w') as f:
-            f.write(dzi_xml)
-        
-        # Actualizar registro en base de datos
-        medical_image.dzi_path = dzi_path
-        db.commit()
-        
-        print(f"SVS procesado exitosamente: {medical_image.title}")
-        
+        return tile_server.descriptor(file_path, tiles_url)
     except ImportError:
-        print("openslide-python no está instalado. No se pueden procesar archivos SVS.")
+        raise HTTPException(status_code=501, detail="OpenSlide no está instalado en el servidor")
     except Exception as e:
-        print(f"Error procesando SVS: {e}")
-        raise
+        raise HTTPException(status_code=500, detail=f"Error leyendo la imagen: {str(e)}")
+
+@router.get("/{image_id}/dzi/{level}/{col}_{row}.{tile_format}")
+async def redirect_unversioned_dzi_tile(image_id: int, level: int, col: int, row: int, tile_format: str):
+    """
+    Tiles pedidos sin versión (descriptores anteriores a las URLs versionadas):
+    redirige a la URL del perfil de codificación actual
+    """
+    return RedirectResponse(f"{dzi_tiles_url(router.prefix, image_id)}{level}/{col}_{row}.{tile_format}")
+
+@router.get("/{image_id}/dzi/{version}/{level}/{col}_{row}.{tile_format}")
+async def get_dzi_tile(
+    image_id: int,
+    version: str,
+    level: int,
+    col: int,
+    row: int,
+    tile_format: str,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Tile Deep Zoom generado bajo demanda.
+    Se sirve desde memoria si está caliente; en ese caso no se consulta la BD
+    (la sesión no abre conexión hasta la primera consulta).
+    """
+    # Una versión de otro perfil de codificación se redirige a la actual,
+    # así la caché inmutable nunca guarda bytes de un perfil con la URL de otro
+    if version != tile_codec.version:
+        return RedirectResponse(f"{dzi_tiles_url(router.prefix, image_id)}{level}/{col}_{row}.{tile_format}")
+    
+    # El formato lo define el perfil de codificación (ver tile_codec)
+    if tile_format != DZI_FORMAT:
+        raise HTTPException(status_code=404, detail=f"Los tiles se sirven en formato {DZI_FORMAT}")
+    
+    # Un tile caliente se responde directamente desde el event loop
+    cached = tile_server.cached_tile(image_id, level, col, row)
+    
+    if cached is None:
+        image = await run_in_threadpool(_get_active_image, db, image_id, True)
+        
+        try:
+            cached = await run_slide_io(
+                tile_server.get_tile,
+                image.id, image.stored_name, image.file_path, level, col, row
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ImportError:
+            raise HTTPException(status_code=501, detail="OpenSlide no está instalado en el servidor")
+    
+    data, etag = cached
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    return Response(
+        content=data,
+        media_type=tile_codec.media_type,
+        headers={"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    )
+
+def _tiling_job_status(job: TilingJob) -> dict:
+    progress = None
+    if job.total_tiles:
+        progress = round(job.done_tiles / job.total_tiles, 4)
+    
+    return {
+        "job_id": job.id,
+        "image_id": job.image_id,
+        "status": job.status,
+        "done_tiles": job.done_tiles,
+        "skipped_tiles": job.skipped_tiles,
+        "total_tiles": job.total_tiles,
+        "progress": progress,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+@router.get("/{image_id}/tiling")
+def get_tiling_status(
+    image_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Estado del último trabajo de tiling en segundo plano de una imagen
+    """
+    job = db.query(TilingJob).filter(
+        TilingJob.image_id == image_id
+    ).order_by(TilingJob.id.desc()).first()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="La imagen no tiene trabajos de tiling")
+    
+    return _tiling_job_status(job)
+
+@router.post("/{image_id}/tiling")
+def start_tiling(
+    image_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Lanza (o reanuda desde la última fila terminada) el tiling de una imagen
+    Solo docentes y administradores
+    """
+    if current_user.role not in ["docente", "administrador"]:
+        raise HTTPException(status_code=403, detail="No tienes permisos para procesar imágenes")
+    
+    image = db.query(MedicalImage).filter(
+        MedicalImage.id == image_id,
+        MedicalImage.is_active == True
+    ).first()
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    
+    job_id = enqueue_tiling_job(image.id)
+    job = db.query(TilingJob).filter(TilingJob.id == job_id).first()
+    return _tiling_job_status(job)
+
+@router.get("/{image_id}/tissue-mask")
+def get_tissue_mask(
+    image_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Máscara de tejido calculada al generar los tiles (PNG, blanco = tejido).
+    Su escala respecto de la resolución completa es width / ancho_de_la_máscara.
+    """
+    image = db.query(MedicalImage).filter(
+        MedicalImage.id == image_id,
+        MedicalImage.is_active == True
+    ).first()
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    
+    if image.tissue_fraction is None:
+        raise HTTPException(status_code=404, detail="La imagen aún no tiene máscara de tejido")
+    
+    return RangeFileResponse(
+        mask_path(image.stored_name),
+        media_type="image/png",
+        content_disposition_type="inline"
+    )
+
+@router.get("/{image_id}/region")
+async def get_image_region(
+    image_id: int,
+    request: Request,
+    x: int = Query(..., description="Coordenada x de la esquina superior izquierda (nivel 0)"),
+    y: int = Query(..., description="Coordenada y de la esquina superior izquierda (nivel 0)"),
+    w: int = Query(..., description="Ancho en píxeles del nivel pedido"),
+    h: int = Query(..., description="Alto en píxeles del nivel pedido"),
+    level: int = Query(0, description="Nivel de la pirámide OpenSlide"),
+    format: str = Query("jpeg", description="jpeg, png o webp"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Extrae una región arbitraria de la lámina (p. ej. 2048x2048 en el nivel 1)
+    """
+    image = await run_in_threadpool(_get_active_image, db, image_id, True)
+    
+    try:
+        data, etag, media_type = await run_slide_io(
+            read_region,
+            image.id, image.stored_name, image.file_path, x, y, level, w, h, format
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RegionBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except ImportError:
+        raise HTTPException(status_code=501, detail="OpenSlide no está instalado en el servidor")
+    
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    return Response(
+        content=data,
+        media_type=media_type,
+        headers={"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    )
+
+
+def register_dzi(medical_image: MedicalImage, db: Session):
+    """
+    Escribe el descriptor .dzi de una imagen sin generar tiles.
+    Los tiles se renderizan bajo demanda con el tile server.
+    """
+    dzi_path, _ = dzi_paths(medical_image.stored_name)
+    tiles_url = dzi_tiles_url(router.prefix, medical_image.id)
+    if medical_image.width is not None:
+        dzi_xml = build_dzi_xml(medical_image.width, medical_image.height, tiles_url)
+    else:
+        dzi_xml = tile_server.descriptor(medical_image.file_path, tiles_url)
+    
+    with open(dzi_path, 'w') as f:
+        f.write(dzi_xml)
+    
+    medical_image.dzi_path = dzi_path
+    db.commit()
+
@@ -1,26 +1,47 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 import httpx
 import json
+import asyncio
 import os
-from typing import List
+import time
+from typing import AsyncIterator, List, Optional
 from sqlalchemy.orm import Session
 from datetime import datetime
-from ..schemas import SCTGenerateRequest, SCTResponse, SCTItem, SCTSaveRequest, SCTTestOut, SCTTestDetail
+from ..schemas import (
+    SCTGenerateRequest, SCTAssembleRequest, SCTResponse, SCTItem, SCTSaveRequest, SCTTestOut, SCTTestDetail,
+    SCTAnswersSubmit, SCTAnswersStored, SCTScoresOut, SCTStudentScore, SCTItemStats
+)
 from ..models import SCTTest
 from ..db import get_db
+from ..pagination import PageParams, paginate
+from .. import sct_bank, sct_items, sct_scoring
+from ..http_clients import get_ollama_client, OLLAMA_TIMEOUT, OLLAMA_STREAMING_TIMEOUT
+from ..llm_gateway import llm_gateway, BATCH, LLM_BATCH_MAX_IN_FLIGHT
+from ..ollama_pool import ollama_pool
+from ..ollama_models import SCT_MODEL, keep_alive_for, num_ctx_for, record_timings
+from ..sct_stream import SCTItemStreamParser
+from ..sct_salvage import SCT_TOPUP_ROUNDS, parse_items, salvage_stats
+from ..sct_fanout import (
+    SCT_PARALLEL, SCT_FANOUT_CONCURRENCY, batch_scenario, dedupe_items, split_batches
+)
 
 router = APIRouter(prefix="/api/sct", tags=["SCT"])
 
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://ollama:11434")
-
-# Plantilla de prompt genérica para generar ítems SCT sobre cualquier tema médico
+# Instrucciones genéricas para generar ítems SCT sobre cualquier tema médico.
+# No tiene variables: se envía idéntico en cada llamada (mensaje de sistema)
+# para que Ollama reutilice el prefijo ya evaluado. El tema, la dificultad y
+# la cantidad van al final, en SCT_REQUEST_PROMPT.
 SCT_SYSTEM_PROMPT = """Eres un experto en educación médica con amplio conocimiento en todas las especialidades clínicas.
 
 Tu tarea es generar ítems de Script Concordance Test (SCT) para evaluar el razonamiento clínico de estudiantes de medicina.
 
 **¿Qué es un ítem SCT?**
 Un ítem SCT evalúa cómo el estudiante modifica su razonamiento ante nueva información. Cada ítem tiene:
-1. **Viñeta clínica**: Descripción breve de un paciente con sospecha o diagnóstico relacionado con {focus}
+1. **Viñeta clínica**: Descripción breve de un paciente con sospecha o diagnóstico relacionado con el tema indicado
 2. **Hipótesis clínica**: Un diagnóstico, examen o conducta a considerar
 3. **Nueva información**: Resultado de examen, síntoma adicional, imagen, dato de laboratorio, etc.
 4. **Escala de respuesta**: -2 a +2 donde:
@@ -74,18 +95,13 @@ Si dificultad = "residente":
 - **Hipótesis clínicas MUY COMPLEJAS**: deben involucrar complicaciones GRAVES (ej: insuficiencia respiratoria aguda, shock séptico, SDRA, coagulación intravascular diseminada), diagnósticos POCO FRECUENTES o atípicos, co-infecciones múltiples, reacciones adversas graves a medicamentos, resistencia antimicrobiana, enfermedades sistémicas
 - **Nueva información ALTAMENTE ESPECIALIZADA**: resultados de biopsias con histopatología detallada, cultivos especiales con antibiogramas, estudios inmunológicos complejos (complemento, anticuerpos específicos), evolución del paciente con deterioro progresivo o mejoría inesperada, respuesta paradójica a tratamiento, aparición de complicaciones nuevas con datos clínicos y paraclínicos adicionales
 
-**CONTEXTO ESPECÍFICO**:
-- Tema médico: {focus}
-- Dificultad: {difficulty}
-- Cantidad de ítems: {num_items}
-
 **INSTRUCCIONES CRÍTICAS**:
-- Genera ítems SCT ÚNICAMENTE sobre: {focus}
+- Genera ítems SCT ÚNICAMENTE sobre el tema médico indicado en el pedido
 - NO incluyas casos de otras enfermedades o patologías
-- Todos los casos deben estar directamente relacionados con: {focus}
+- Todos los casos deben estar directamente relacionados con ese tema
 - RESPETA ESTRICTAMENTE la longitud mínima de palabras según la dificultad
 - Para nivel RESIDENTE: casos DEBEN ser extensos y muy detallados con datos numéricos específicos
-- Usa terminología médica apropiada para {focus}
+- Usa terminología médica apropiada para el tema
 - Sé preciso y basado en evidencia médica actualizada
 - **TODOS LOS CASOS DEBEN ESTAR COMPLETAMENTE EN ESPAÑOL - OBLIGATORIO**
 - **NUNCA GENERES TEXTO EN INGLÉS - TODO DEBE SER EN ESPAÑOL**
@@ -95,120 +111,497 @@ Si dificultad = "residente":
 
 **Formato de salida** (JSON estricto):
 ```json
-{{
+{
   "items": [
-    {{
+    {
       "id": 1,
-      "vignette": "Descripción del caso clínico relacionado con {focus}",
+      "vignette": "Descripción del caso clínico relacionado con el tema",
       "hypothesis": "Hipótesis diagnóstica o conducta a evaluar",
       "new_info": "Nueva información relevante (examen, síntoma, etc.)",
       "correct_answer": 2,
       "explanation": "Explicación médica de por qué esta es la respuesta correcta"
-    }}
+    }
   ]
-}}
-```
+}
+```"""
+
+# Parte variable del prompt (mensaje de usuario, después del prefijo fijo)
+SCT_REQUEST_PROMPT = """**CONTEXTO ESPECÍFICO**:
+- Tema médico: {focus}
+- Dificultad: {difficulty}
+- Cantidad de ítems: {num_items}
 
 Genera ahora {num_items} ítems SCT EXCLUSIVAMENTE sobre {focus} con nivel de dificultad {difficulty}."""
 
+# Instrucción extra para cada lote del modo paralelo
+SCT_BATCH_PROMPT = """
+
+Este pedido es el lote {batch} de {batches} de un mismo test. Para no repetir casos de los otros lotes, centra la viñeta en {scenario}."""
+
+# Límite global de llamadas simultáneas a Ollama en modo paralelo. No supera
+# los cupos batch del gateway: los lotes que no caben esperan aquí, sin
+# límite de tiempo, en vez de vencer LLM_MAX_WAIT_BATCH en la cola del gateway
+_fanout_slots = asyncio.Semaphore(max(min(SCT_FANOUT_CONCURRENCY, LLM_BATCH_MAX_IN_FLIGHT), 1))
+
+def _ollama_payload(
+    request: SCTGenerateRequest,
+    stream: bool,
+    num_items: Optional[int] = None,
+    batch: Optional[int] = None,
+    batches: Optional[int] = None
+) -> dict:
+    """Petición a Ollama /api/chat para generar los ítems (o un lote de ellos)"""
+    num_items = num_items or request.num_items
+    # Construir la parte variable del prompt con los parámetros
+    prompt = SCT_REQUEST_PROMPT.format(
+        num_items=num_items,
+        difficulty=request.difficulty.value,
+        focus=request.focus
+    )
+    if batch is not None:
+        prompt += SCT_BATCH_PROMPT.format(
+            batch=batch + 1, batches=batches, scenario=batch_scenario(batch)
+        )
+    
+    # Para nivel residente, usar parámetros que permitan mayor complejidad
+    return {
+        "model": SCT_MODEL,
+        "messages": [
+            {"role": "system", "content": SCT_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "stream": stream,
+        "keep_alive": keep_alive_for(SCT_MODEL),
+        "format": "json",
+        "options": {
+            "temperature": 0.8,  # Mayor creatividad para casos complejos
+            "top_p": 0.95,  # Permitir mayor diversidad en respuestas
+            # Permitir respuestas más largas; un lote pequeño necesita menos tokens
+            "num_predict": 4096 if batch is None else min(4096, 1024 * num_items),
+            # El mismo contexto en todas las llamadas al modelo (también el
+            # chat), para no recargarlo ni invalidar la caché
+            "num_ctx": num_ctx_for(SCT_MODEL)
+        }
+    }
+
+def _build_sct_item(idx: int, item: dict) -> SCTItem:
+    return SCTItem(
+        id=idx,
+        vignette=item.get("vignette", ""),
+        hypothesis=item.get("hypothesis", ""),
+        new_info=item.get("new_info", ""),
+        correct_answer=item.get("correct_answer", 0),
+        explanation=item.get("explanation", ""),
+        bank_id=item.get("bank_id")
+    )
+
+def _item_fields(item: SCTItem) -> dict:
+    return item.dict(include={"vignette", "hypothesis", "new_info", "correct_answer", "explanation"})
+
+async def _store_in_bank(
+    items: List[SCTItem],
+    difficulty: str,
+    focus: str,
+    source: str = "generated",
+    test_id: Optional[int] = None
+) -> None:
+    """Guarda los ítems en el banco y completa su bank_id; un error no interrumpe la respuesta"""
+    if not items:
+        return
+    try:
+        bank_ids = await run_in_threadpool(
+            sct_bank.with_session, sct_bank.store_items,
+            [_item_fields(item) for item in items], difficulty, focus, source, test_id
+        )
+    except Exception as e:
+        print(f"[SCT] No se pudieron guardar los ítems en el banco: {e}")
+        return
+    for item, bank_id in zip(items, bank_ids):
+        item.bank_id = bank_id
+
+def _check_sct_item(item: SCTItem) -> None:
+    """Validación estricta de un ítem recibido en streaming"""
+    if not (item.vignette.strip() and item.hypothesis.strip() and item.new_info.strip()):
+        raise ValueError("El ítem no tiene viñeta, hipótesis o nueva información")
+    if item.correct_answer not in (-2, -1, 0, 1, 2):
+        raise ValueError(f"Respuesta fuera de la escala: {item.correct_answer}")
+
+def _valid_items(items_data: List[dict], size: int) -> List[dict]:
+    """Ítems que pasan la validación de SCTItem, hasta size; el resto se descarta"""
+    valid = []
+    for data in items_data:
+        try:
+            _check_sct_item(_build_sct_item(0, data))
+        except (ValidationError, ValueError, AttributeError, TypeError):
+            continue
+        valid.append(data)
+    salvage_stats.record_rejected(len(items_data) - len(valid))
+    return valid[:size]
+
+async def _request_items(
+    client: httpx.AsyncClient,
+    request: SCTGenerateRequest,
+    size: int,
+    caller: str,
+    batch: Optional[int] = None,
+    batches: Optional[int] = None
+) -> List[dict]:
+    """Una llamada al LLM; retorna los ítems válidos rescatados de la respuesta"""
+    async with llm_gateway.slot(BATCH):
+        response = await ollama_pool.post(
+            client,
+            "/api/chat",
+            json=_ollama_payload(request, stream=False, num_items=size, batch=batch, batches=batches),
+            timeout=OLLAMA_TIMEOUT
+        )
+    response.raise_for_status()
+    data = response.json()
+    record_timings(caller, SCT_MODEL, data, request.difficulty.value)
+    return _valid_items(parse_items(data.get("message", {}).get("content", "")), size)
+
+async def _generate_batch(
+    client: httpx.AsyncClient,
+    request: SCTGenerateRequest,
+    size: int,
+    batch: int,
+    batches: int
+) -> List[dict]:
+    """Genera un lote de ítems; los ítems inválidos se descartan"""
+    async with _fanout_slots:
+        started = time.monotonic()
+        valid = await _request_items(client, request, size, "sct_batch", batch, batches)
+    print(f"[SCT] Lote {batch + 1}/{batches}: {len(valid)}/{size} ítems en {time.monotonic() - started:.1f}s")
+    return valid
+
+async def _generate_parallel(request: SCTGenerateRequest, client: httpx.AsyncClient) -> SCTResponse:
+    """
+    Divide el pedido en lotes concurrentes, descarta duplicados y, si faltan
+    ítems (lotes fallidos o duplicados), hace una ronda más con lo que falta.
+    """
+    started = time.monotonic()
+    collected: List[dict] = []
+    batch_offset = 0
+    errors = []
+    
+    for _ in range(2):
+        missing = request.num_items - len(collected)
+        if missing <= 0:
+            break
+        sizes = split_batches(missing)
+        total_batches = batch_offset + len(sizes)
+        results = await asyncio.gather(*[
+            _generate_batch(client, request, size, batch_offset + i, total_batches)
+            for i, size in enumerate(sizes)
+        ], return_exceptions=True)
+        batch_offset = total_batches
+        
+        # Resultados en orden de lote, no de llegada: ids estables
+        for result in results:
+            if isinstance(result, BaseException):
+                errors.append(result)
+                print(f"[SCT] Lote fallido: {result!r}")
+                continue
+            collected.extend(result)
+        collected = dedupe_items(collected)
+
+    if not collected:
+        if errors and all(isinstance(e, HTTPException) for e in errors):
+            # Gateway saturado: propagar el 429/503 con su Retry-After
+            raise errors[0]
+        if errors and all(isinstance(e, httpx.HTTPError) for e in errors):
+            raise HTTPException(status_code=503, detail=f"Error al conectar con Ollama: {str(errors[0])}")
+        raise HTTPException(status_code=500, detail="LLaMA 3 no generó ítems válidos")
+    
+    items = [
+        _build_sct_item(idx, item)
+        for idx, item in enumerate(collected[:request.num_items], 1)
+    ]
+    print(f"[SCT] {len(items)} ítems en paralelo en {time.monotonic() - started:.1f}s")
+    return SCTResponse(
+        items=items,
+        total=len(items),
+        difficulty=request.difficulty.value,
+        focus=request.focus
+    )
+
 @router.post("/generate", response_model=SCTResponse)
-async def generate_sct_items(request: SCTGenerateRequest):
+async def generate_sct_items(
+    request: SCTGenerateRequest, client: httpx.AsyncClient = Depends(get_ollama_client)
+):
     """
     Genera ítems de Script Concordance Test sobre tuberculosis usando LLaMA 3.
     
     - **num_items**: Cantidad de ítems a generar (default: 5)
     - **difficulty**: Nivel de dificultad (pregrado, internado, residente)
     - **focus**: Tema específico (default: "tuberculosis pulmonar")
+    - **parallel**: Generar en lotes concurrentes (default: SCT_PARALLEL)
+    
+    Los ítems generados quedan en el banco SCT (ver /assemble).
     """
     print(f"[SCT] Recibida petición: num_items={request.num_items}, difficulty={request.difficulty}, focus={request.focus}")
+    parallel = SCT_PARALLEL if request.parallel is None else request.parallel
+    if parallel and request.num_items > 1:
+        response = await _generate_parallel(request, client)
+    else:
+        response = await _generate_single(request, client)
+    await _store_in_bank(response.items, request.difficulty.value, request.focus)
+    return response
+
+async def generate_for_bank(
+    client: httpx.AsyncClient, difficulty: str, focus: str, num_items: int
+) -> List[dict]:
+    """Genera ítems para reabastecer el banco (ver sct_bank.start_refill_task)"""
+    request = SCTGenerateRequest(num_items=num_items, difficulty=difficulty, focus=focus)
+    response = await _generate_parallel(request, client)
+    return [_item_fields(item) for item in response.items]
+
+async def _generate_single(request: SCTGenerateRequest, client: httpx.AsyncClient) -> SCTResponse:
+    """
+    Genera todos los ítems en una sola llamada al LLM. Si la respuesta viene
+    truncada o con ítems inválidos se conserva lo rescatado y se piden solo
+    los ítems que faltan.
+    """
     try:
-        # Construir el prompt con los parámetros
-        prompt = SCT_SYSTEM_PROMPT.format(
-            num_items=request.num_items,
-            difficulty=request.difficulty.value,
-            focus=request.focus
-        )
+        # Llamar a Ollama con timeout extendido (OLLAMA_READ_TIMEOUT, 5 minutos para casos complejos)
+        items_data = await _request_items(client, request, request.num_items, "sct")
         
-        # Preparar la petición a Ollama usando /api/chat
-        # Para nivel residente, usar parámetros que permitan mayor complejidad
-        ollama_payload = {
-            "model": "llama3:8b",
-            "messages": [
-                {"role": "system", "content": prompt}
-            ],
-            "stream": False,
-            "temperature": 0.8,  # Mayor creatividad para casos complejos
-            "top_p": 0.95,  # Permitir mayor diversidad en respuestas
-            "num_predict": 4096,  # Permitir respuestas más largas
-            "format": "json"
-        }
+        for _ in range(SCT_TOPUP_ROUNDS):
+            missing = request.num_items - len(items_data)
+            if missing <= 0:
+                break
+            print(f"[SCT] Faltan {missing} de {request.num_items} ítems; se piden solo esos")
+            try:
+                extra = await _request_items(client, request, missing, "sct_topup")
+            except (httpx.HTTPError, HTTPException) as e:
+                # Mejor entregar lo rescatado que perderlo
+                print(f"[SCT] No se pudieron completar los ítems faltantes: {e!r}")
+                break
+            salvage_stats.record_topup(missing, len(extra))
+            items_data = dedupe_items(items_data + extra)
         
-        # Llamar a Ollama con timeout extendido (5 minutos para casos complejos)
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.post(
-                f"{OLLAMA_URL}/api/chat",
-                json=ollama_payload
-            )
-            response.raise_for_status()
-            data = response.json()
+        if not items_data:
+            raise HTTPException(status_code=500, detail="LLaMA 3 no generó ítems válidos")
         
-        # Extraer la respuesta del modelo
-        llama_response = data.get("message", {}).get("content", "")
-        
-        if not llama_response:
-            raise HTTPException(status_code=500, detail="LLaMA 3 no generó respuesta")
+        # Construir los ítems SCT
+        items = [
+            _build_sct_item(idx, item)
+            for idx, item in enumerate(items_data[:request.num_items], 1)
+        ]
         
-        # Parsear el JSON generado por LLaMA
-        try:
-            sct_data = json.loads(llama_response)
-            items_data = sct_data.get("items", [])
-            
-            if not items_data:
-                raise ValueError("No se generaron ítems")
-            
-            # Validar y construir los ítems SCT
-            items = []
-            for idx, item in enumerate(items_data[:request.num_items], 1):
-                sct_item = SCTItem(
-                    id=idx,
-                    vignette=item.get("vignette", ""),
-                    hypothesis=item.get("hypothesis", ""),
-                    new_info=item.get("new_info", ""),
-                    correct_answer=item.get("correct_answer", 0),
-                    explanation=item.get("explanation", "")
-                )
-                items.append(sct_item)
-            
-            # Construir respuesta
-            return SCTResponse(
-                items=items,
-                total=len(items),
-                difficulty=request.difficulty.value,
-                focus=request.focus
-            )
-            
-        except json.JSONDecodeError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al parsear respuesta de LLaMA 3: {str(e)}"
-            )
-        except ValueError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error en la estructura de datos: {str(e)}"
-            )
+        # Construir respuesta
+        return SCTResponse(
+            items=items,
+            total=len(items),
+            difficulty=request.difficulty.value,
+            focus=request.focus
+        )
             
     except httpx.HTTPError as e:
         raise HTTPException(
             status_code=503,
             detail=f"Error al conectar con Ollama: {str(e)}"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error interno: {str(e)}"
         )
 
+def _encode_event(event: dict, sse: bool) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    if sse:
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+class _GatewaySlot:
+    """Cupo batch ya adquirido; release() se puede llamar más de una vez"""
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.released = False
+    
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            llm_gateway.release(BATCH, time.monotonic() - self.started)
+
+async def _stream_sct_items(
+    request: SCTGenerateRequest, sse: bool, client: httpx.AsyncClient, slot: _GatewaySlot
+) -> AsyncIterator[str]:
+    """
+    Consume el stream de tokens de Ollama y emite cada ítem apenas su objeto
+    JSON se cierra. Eventos: item, skipped (ítem inválido), error y done.
+    """
+    try:
+        async for event in _stream_sct_events(request, sse, client):
+            yield event
+    finally:
+        slot.release()
+
+def _record_stream_timings(final_chunk: Optional[dict], tokens: int, elapsed: float, difficulty: str) -> None:
+    """
+    Registra los tiempos de un stream SCT en cualquier salida. Si Ollama no
+    llegó a enviar done (se cortó al completar los ítems, por error o porque
+    el cliente se desconectó) se usan el tiempo de pared y los tokens vistos;
+    la evaluación del prompt queda incluida en la generación.
+    """
+    if final_chunk is None:
+        elapsed_ns = int(elapsed * 1e9)
+        final_chunk = {"eval_count": tokens, "eval_duration": elapsed_ns, "total_duration": elapsed_ns}
+    record_timings("sct_stream", SCT_MODEL, final_chunk, difficulty)
+
+async def _stream_sct_events(
+    request: SCTGenerateRequest, sse: bool, client: httpx.AsyncClient
+) -> AsyncIterator[str]:
+    started = time.monotonic()
+    first_item_seconds = None
+    parser = SCTItemStreamParser()
+    count = 0
+    streamed: List[SCTItem] = []
+    # Tiempos del último chunk (done) y tokens vistos hasta ahora: el stream
+    # suele cortarse antes de que Ollama envíe done
+    final_chunk = None
+    tokens = 0
+    
+    try:
+        async with ollama_pool.stream(
+            client, "/api/chat", json=_ollama_payload(request, stream=True),
+            timeout=OLLAMA_STREAMING_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("done"):
+                    final_chunk = chunk
+                elif chunk.get("message", {}).get("content"):
+                    # Ollama envía un token por chunk
+                    tokens += 1
+                if chunk.get("error"):
+                    yield _encode_event({"type": "error", "detail": chunk["error"]}, sse)
+                    return
+                
+                for data in parser.feed(chunk.get("message", {}).get("content", "")):
+                    try:
+                        item = _build_sct_item(count + 1, data)
+                        _check_sct_item(item)
+                    except (ValidationError, ValueError) as e:
+                        yield _encode_event({"type": "skipped", "detail": str(e)}, sse)
+                        continue
+                    
+                    count += 1
+                    streamed.append(item)
+                    if first_item_seconds is None:
+                        first_item_seconds = round(time.monotonic() - started, 2)
+                        print(f"[SCT] Primer ítem en {first_item_seconds}s")
+                    yield _encode_event({"type": "item", "item": item.dict()}, sse)
+                    if count >= request.num_items:
+                        break
+                
+                # Al salir del bloque se cierra la conexión y Ollama deja de generar
+                if count >= request.num_items or parser.finished or chunk.get("done"):
+                    break
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        yield _encode_event({"type": "error", "detail": f"Error al conectar con Ollama: {str(e)}"}, sse)
+        return
+    finally:
+        _record_stream_timings(final_chunk, tokens, time.monotonic() - started, request.difficulty.value)
+    
+    await _store_in_bank(streamed, request.difficulty.value, request.focus)
+    yield _encode_event({
+        "type": "done",
+        "total": count,
+        "difficulty": request.difficulty.value,
+        "focus": request.focus,
+        "first_item_seconds": first_item_seconds,
+        "elapsed_seconds": round(time.monotonic() - started, 2)
+    }, sse)
+
+@router.post("/generate/stream")
+async def generate_sct_items_stream(
+    request: SCTGenerateRequest,
+    http_request: Request,
+    client: httpx.AsyncClient = Depends(get_ollama_client)
+):
+    """
+    Variante en streaming de /generate: cada ítem se envía apenas el modelo
+    termina de escribirlo, validado como SCTItem.
+    
+    Responde NDJSON (una línea JSON por evento) o Server-Sent Events si el
+    cliente envía Accept: text/event-stream.
+    """
+    print(f"[SCT] Recibida petición (stream): num_items={request.num_items}, difficulty={request.difficulty}, focus={request.focus}")
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+    # El cupo se pide antes de responder para poder devolver 429/503
+    await llm_gateway.acquire(BATCH)
+    slot = _GatewaySlot()
+    return StreamingResponse(
+        _stream_sct_items(request, sse, client, slot),
+        # Si el stream nunca llega a iterarse, el cupo se libera igual
+        background=BackgroundTask(slot.release),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        # Evita que un proxy acumule la respuesta antes de enviarla
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/assemble", response_model=SCTResponse)
+async def assemble_sct_test(
+    request: SCTAssembleRequest,
+    db: Session = Depends(get_db),
+    client: httpx.AsyncClient = Depends(get_ollama_client)
+):
+    """
+    Arma un test con ítems del banco SCT, sin esperar al LLM.
+    
+    Los ítems se eligen sin repetir hipótesis ni viñetas casi duplicadas y
+    repartiendo las respuestas correctas. Solo los ítems que falten se
+    generan con LLaMA 3 (si allow_generate es verdadero).
+    
+    - **exclude_ids**: Ids del banco a omitir (ej: ítems ya respondidos)
+    """
+    started = time.monotonic()
+    difficulty = request.difficulty.value
+    await run_in_threadpool(sct_bank.record_demand, db, difficulty, request.focus)
+    collected = await run_in_threadpool(
+        sct_bank.select_items, db, difficulty, request.focus, request.num_items, request.exclude_ids
+    )
+    from_bank = len(collected)
+    
+    shortfall = request.num_items - from_bank
+    if shortfall > 0 and request.allow_generate:
+        print(f"[SCT] Banco con {from_bank}/{request.num_items} ítems para ({difficulty}, {request.focus}); generando {shortfall}")
+        try:
+            generated = await _generate_parallel(SCTGenerateRequest(
+                num_items=shortfall, difficulty=request.difficulty, focus=request.focus
+            ), client)
+        except HTTPException:
+            # Con ítems del banco se entrega un test más corto en vez de fallar
+            if not collected:
+                raise
+        else:
+            await _store_in_bank(generated.items, difficulty, request.focus)
+            collected = dedupe_items(collected + [item.dict() for item in generated.items])
+    
+    if not collected:
+        raise HTTPException(status_code=404, detail="No hay ítems en el banco para esa dificultad y tema")
+    
+    items = [
+        _build_sct_item(idx, item)
+        for idx, item in enumerate(collected[:request.num_items], 1)
+    ]
+    print(f"[SCT] Test armado en {(time.monotonic() - started) * 1000:.0f}ms ({from_bank} del banco)")
+    return SCTResponse(
+        items=items,
+        total=len(items),
+        difficulty=difficulty,
+        focus=request.focus,
+        from_bank=from_bank,
+        generated=len(items) - from_bank
+    )
+
 @router.get("/example", response_model=SCTResponse)
 async def get_example_sct():
     """
@@ -252,23 +645,25 @@ async def save_sct_test(request: SCTSaveRequest, db: Session = Depends(get_db)):
     - **items**: Lista de ítems SCT
     """
     try:
-        # Convertir items a dict para JSON
-        items_dict = [item.dict() for item in request.items]
-        
-        # Crear registro en BD
+        # Crear la cabecera; los ítems van a sct_test_items
         sct_test = SCTTest(
             name=request.name,
             difficulty=request.difficulty,
             focus=request.focus,
             num_items=request.num_items,
-            items_json=items_dict,
+            items_json=[],
             created_at=datetime.utcnow()
         )
         
         db.add(sct_test)
+        db.flush()
+        sct_items.add_items(db, sct_test.id, [item.dict() for item in request.items])
         db.commit()
         db.refresh(sct_test)
         
+        # Los ítems guardados también pasan al banco SCT
+        await _store_in_bank(request.items, request.difficulty, request.focus, "saved", sct_test.id)
+        
         return SCTTestOut(
             id=sct_test.id,
             name=sct_test.name,
@@ -286,12 +681,18 @@ async def save_sct_test(request: SCTSaveRequest, db: Session = Depends(get_db)):
         )
 
 @router.get("/list", response_model=List[SCTTestOut])
-async def list_sct_tests(db: Session = Depends(get_db)):
+async def list_sct_tests(response: Response, page: PageParams = Depends(), db: Session = Depends(get_db)):
     """
-    Lista todos los tests SCT guardados.
+    Lista los tests SCT guardados, del más reciente al más antiguo,
+    paginados con limit/cursor (ver pagination).
     """
     try:
-        tests = db.query(SCTTest).filter(SCTTest.is_active == True).order_by(SCTTest.created_at.desc()).all()
+        # Solo las columnas de la cabecera, sin ítems
+        query = (
+            db.query(SCTTest.id, SCTTest.name, SCTTest.difficulty, SCTTest.focus, SCTTest.num_items, SCTTest.created_at)
+            .filter(SCTTest.is_active == True)
+        )
+        tests = paginate(query, (SCTTest.created_at, SCTTest.id), page, response, descending=True)
         
         return [
             SCTTestOut(
@@ -304,35 +705,43 @@ async def list_sct_tests(db: Session = Depends(get_db)):
             )
             for test in tests
         ]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error al listar tests SCT: {str(e)}"
         )
 
+def _active_test(db: Session, test_id: int):
+    """Cabecera del test (sin ítems) o 404"""
+    test = (
+        db.query(SCTTest.id, SCTTest.name, SCTTest.difficulty, SCTTest.focus, SCTTest.num_items, SCTTest.created_at)
+        .filter(SCTTest.id == test_id, SCTTest.is_active == True)
+        .first()
+    )
+    if not test:
+        raise HTTPException(status_code=404, detail="Test SCT no encontrado")
+    return test
+
 @router.get("/{test_id}", response_model=SCTTestDetail)
 async def get_sct_test(test_id: int, db: Session = Depends(get_db)):
     """
     Obtiene un test SCT específico por ID.
     """
     try:
-        test = db.query(SCTTest).filter(SCTTest.id == test_id, SCTTest.is_active == True).first()
-        
-        if not test:
-            raise HTTPException(status_code=404, detail="Test SCT no encontrado")
+        test = _active_test(db, test_id)
         
-        # Convertir items_json a objetos SCTItem
-        items = [SCTItem(**item) for item in test.items_json]
-        
-        return SCTTestDetail(
-            id=test.id,
-            name=test.name,
-            difficulty=test.difficulty,
-            focus=test.focus,
-            num_items=test.num_items,
-            items=items,
-            created_at=test.created_at.isoformat()
-        )
+        # Un diccionario: FastAPI valida la respuesta una sola vez con response_model
+        return {
+            "id": test.id,
+            "name": test.name,
+            "difficulty": test.difficulty,
+            "focus": test.focus,
+            "num_items": test.num_items,
+            "items": sct_items.load_items(db, test_id),
+            "created_at": test.created_at.isoformat()
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -340,3 +749,83 @@ async def get_sct_test(test_id: int, db: Session = Depends(get_db)):
             status_code=500,
             detail=f"Error al obtener test SCT: {str(e)}"
         )
+
+
+def _test_num_items(db: Session, test_id: int) -> int:
+    _active_test(db, test_id)
+    return sct_items.item_count(db, test_id)
+
+@router.get("/{test_id}/items", response_model=List[SCTItem])
+def get_sct_test_items(test_id: int, start: int = 1, limit: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Ítems de un test desde la posición start (1 = primero), hasta limit ítems.
+    """
+    _active_test(db, test_id)
+    if start < 1 or (limit is not None and limit < 1):
+        raise HTTPException(status_code=400, detail="start y limit deben ser mayores que 0")
+    return sct_items.load_items(db, test_id, start, limit)
+
+@router.get("/{test_id}/items/{position}", response_model=SCTItem)
+def get_sct_test_item(test_id: int, position: int, db: Session = Depends(get_db)):
+    """
+    Un ítem del test por su posición (1 = primero).
+    """
+    _active_test(db, test_id)
+    items = sct_items.load_items(db, test_id, position, 1) if position >= 1 else []
+    if not items or items[0]["id"] != position:
+        raise HTTPException(status_code=404, detail="Ítem no encontrado")
+    return items[0]
+
+@router.post("/{test_id}/answers", response_model=SCTAnswersStored)
+def submit_sct_answers(test_id: int, request: SCTAnswersSubmit, db: Session = Depends(get_db)):
+    """
+    Registra las respuestas de estudiantes (role=student) o de los expertos
+    del panel de referencia (role=panel). Acepta una o muchas hojas; si un
+    respondente ya respondió, sus respuestas se reemplazan.
+    
+    - **answers**: una respuesta por ítem en el orden del test (-2 a +2, null = sin responder)
+    """
+    if request.role not in sct_scoring.ROLES:
+        raise HTTPException(status_code=400, detail=f"role debe ser uno de: {', '.join(sct_scoring.ROLES)}")
+    num_items = _test_num_items(db, test_id)
+    try:
+        sheets = [
+            (sheet.respondent, sct_scoring.encode_answers(sheet.answers, num_items))
+            for sheet in request.sheets
+        ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    stored = sct_scoring.store_sheets(db, test_id, request.role, sheets)
+    return SCTAnswersStored(test_id=test_id, role=request.role, stored=stored)
+
+@router.get("/{test_id}/scores", response_model=SCTScoresOut)
+def get_sct_scores(test_id: int, db: Session = Depends(get_db)):
+    """
+    Puntajes por el método agregado contra el panel de expertos: porcentaje,
+    z-score y escala del panel (media 80, DE 5) de cada estudiante, y
+    estadísticas de cada ítem. Se recalcula solo si cambiaron las respuestas.
+    """
+    result, cached, elapsed = sct_scoring.test_scores(db, test_id, _test_num_items(db, test_id))
+    scores = [
+        SCTStudentScore(
+            respondent=respondent, answered=answered, raw_score=raw, score=score, z_score=z, scaled_score=scaled
+        )
+        for respondent, answered, raw, score, z, scaled in zip(
+            result["respondents"], result["answered"], result["raw_score"],
+            result["score"], result["z_score"], result["scaled_score"]
+        )
+    ]
+    return SCTScoresOut(
+        test_id=test_id,
+        students=result["students"],
+        panel_members=result["panel_members"],
+        scored_items=result["scored_items"],
+        panel_mean=result["panel_mean"],
+        panel_sd=result["panel_sd"],
+        cohort_mean=result["cohort_mean"],
+        cohort_sd=result["cohort_sd"],
+        scores=scores,
+        items=[SCTItemStats(**item) for item in result["items"]],
+        cached=cached,
+        elapsed_ms=round(elapsed, 1)
+    )
@@ -0,0 +1,66 @@
+"""
+Actualización del esquema al arrancar.
+
+El backend crea las tablas con Base.metadata.create_all, que no modifica
+tablas que ya existen: en una base creada con una versión anterior faltarían
+las columnas nuevas (content_hash, source_path, metadatos de la lámina,
+tissue_fraction, ...) y toda consulta a esa tabla fallaría con "no such
+column". upgrade_schema agrega las columnas que faltan antes de que nada
+consulte la base; es idempotente y se puede ejecutar en cada arranque.
+
+Solo agrega columnas (siempre como NULL, sin valor por defecto) y amplía
+INTEGER a BIGINT; no borra ni renombra nada. Después crea los índices que
+falten, que create_all tampoco agrega a tablas existentes; un índice que no
+se puede crear se informa y se omite sin detener el arranque.
+"""
+from sqlalchemy import BigInteger, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+from .db import Base
+from . import models  # noqa: F401  (registra las tablas en Base.metadata)
+
+
+def _add_missing_columns(engine: Engine) -> int:
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    added = 0
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            current = {column["name"]: column for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                name = preparer.quote(column.name)
+                table_name = preparer.quote(table.name)
+                if column.name not in current:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+                    print(f"[backend] Columna agregada: {table.name}.{column.name} ({column_type})")
+                    added += 1
+                elif (
+                    isinstance(column.type, BigInteger)
+                    and not isinstance(current[column.name]["type"], BigInteger)
+                    and engine.dialect.name == "postgresql"
+                ):
+                    # En SQLite INTEGER ya es de 64 bits; en PostgreSQL hay que ampliarla
+                    connection.execute(text(f"ALTER TABLE {table_name} ALTER COLUMN {name} TYPE BIGINT"))
+                    print(f"[backend] Columna ampliada a BIGINT: {table.name}.{column.name}")
+    return added
+
+
+def _create_missing_indexes(engine: Engine) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except DBAPIError as e:
+                print(f"[backend] No se pudo crear el índice {index.name}: {e.orig}")
+
+
+def upgrade_schema(engine: Engine) -> None:
+    """Crea las tablas nuevas, agrega las columnas y después los índices que falten"""
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns(engine)
+    _create_missing_indexes(engine)
@@ -26,6 +26,14 @@ class SCTGenerateRequest(BaseModel):
     num_items: int = 5
     difficulty: DifficultyLevel = DifficultyLevel.pregrado
     focus: str = "tuberculosis pulmonar"
+    parallel: Optional[bool] = None  # Generar en lotes concurrentes (None = SCT_PARALLEL)
+
+class SCTAssembleRequest(BaseModel):
+    num_items: int = 5
+    difficulty: DifficultyLevel = DifficultyLevel.pregrado
+    focus: str = "tuberculosis pulmonar"
+    exclude_ids: List[int] = []  # Ítems del banco que no deben repetirse (ej: ya respondidos)
+    allow_generate: bool = True  # Completar con el LLM si el banco no alcanza
 
 class SCTItem(BaseModel):
     id: int
@@ -41,12 +49,15 @@ class SCTItem(BaseModel):
     ]
     correct_answer: int  # Valor de -2 a +2
     explanation: str  # Explicación de la respuesta correcta
+    bank_id: Optional[int] = None  # Id del ítem en el banco SCT
 
 class SCTResponse(BaseModel):
     items: List[SCTItem]
     total: int
     difficulty: str
     focus: str
+    from_bank: Optional[int] = None  # Ítems tomados del banco (solo /assemble)
+    generated: Optional[int] = None  # Ítems generados por el LLM (solo /assemble)
 
 class SCTSaveRequest(BaseModel):
     name: str  # Nombre identificador del test
@@ -77,3 +88,58 @@ class SCTTestDetail(BaseModel):
     
     class Config:
         orm_mode = True
+
+class SCTAnswerSheetIn(BaseModel):
+    respondent: str  # Identificador del estudiante o experto
+    answers: List[Optional[int]]  # Una respuesta por ítem (-2 a +2), null = sin responder
+
+class SCTAnswersSubmit(BaseModel):
+    role: str = "student"  # student o panel (expertos de referencia)
+    sheets: List[SCTAnswerSheetIn]
+
+class SCTAnswersStored(BaseModel):
+    test_id: int
+    role: str
+    stored: int
+
+class SCTStudentScore(BaseModel):
+    respondent: str
+    answered: int
+    raw_score: float  # Suma de créditos (máximo 1 por ítem)
+    score: float  # Porcentaje del máximo
+    z_score: Optional[float] = None  # Respecto del panel
+    scaled_score: Optional[float] = None  # Escala del panel: media 80, DE 5
+
+class SCTItemStats(BaseModel):
+    item_id: int
+    panel_answers: int
+    panel_modal: Optional[int] = None  # Respuesta más elegida por el panel
+    panel_agreement: float  # Fracción del panel que eligió la modal
+    answered: int
+    distribution: List[int]  # Respuestas de estudiantes por valor (-2..+2)
+    mean_credit: float  # Índice de dificultad (crédito promedio)
+    discrimination: Optional[float] = None  # Correlación ítem-resto
+
+class SCTScoresOut(BaseModel):
+    test_id: int
+    students: int
+    panel_members: int
+    scored_items: int  # Ítems con respuestas del panel
+    panel_mean: Optional[float] = None
+    panel_sd: Optional[float] = None
+    cohort_mean: Optional[float] = None
+    cohort_sd: Optional[float] = None
+    scores: List[SCTStudentScore]
+    items: List[SCTItemStats]
+    cached: bool
+    elapsed_ms: float
+
+# ========== Medical Images Schemas ==========
+
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int  # tamaño total en bytes
+    title: str
+    description: Optional[str] = None
+    pathology_type: Optional[str] = None
+    sha256: Optional[str] = None  # permite deduplicar sin enviar el archivo
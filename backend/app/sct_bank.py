@@ -0,0 +1,280 @@
+"""
+Banco de ítems SCT.
+
+Cada ítem generado por el LLM o guardado en un test se almacena por separado
+en sct_bank_items, indexado por dificultad, tema normalizado e hipótesis
+normalizada. Con eso /api/sct/assemble arma un test en milisegundos y solo
+recurre al LLM para los ítems que falten.
+
+Al armar un test se aplican restricciones de diversidad: no se repite una
+hipótesis, no se incluyen viñetas casi duplicadas (ver sct_fanout) y las
+respuestas correctas se reparten entre los valores de la escala. Se
+prefieren los ítems menos usados.
+
+Una tarea en segundo plano mantiene abastecidos los pares (dificultad, tema)
+más pedidos.
+
+Variables de entorno:
+  SCT_BANK_TARGET            ítems disponibles deseados por par (default: 30)
+  SCT_BANK_POPULAR_PAIRS     pares más pedidos que se reabastecen (default: 5)
+  SCT_BANK_REFILL_INTERVAL   segundos entre revisiones; 0 desactiva la tarea
+                             (default: 600)
+  SCT_BANK_REFILL_BATCH      ítems generados por par en cada revisión
+                             (default: 10)
+"""
+import asyncio
+import hashlib
+import math
+import os
+import random
+from datetime import datetime
+from typing import Awaitable, Callable, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .db import SessionLocal
+from .models import SCTBankDemand, SCTBankItem
+from .sct_fanout import SCT_DUPLICATE_THRESHOLD, item_fingerprint, normalize_text, similarity
+
+SCT_BANK_TARGET = int(os.getenv("SCT_BANK_TARGET", "30"))
+SCT_BANK_POPULAR_PAIRS = int(os.getenv("SCT_BANK_POPULAR_PAIRS", "5"))
+SCT_BANK_REFILL_INTERVAL = float(os.getenv("SCT_BANK_REFILL_INTERVAL", "600"))
+SCT_BANK_REFILL_BATCH = int(os.getenv("SCT_BANK_REFILL_BATCH", "10"))
+
+# Candidatos leídos por ítem pedido, para tener margen al aplicar la diversidad
+_CANDIDATES_PER_ITEM = 10
+
+_ITEM_FIELDS = ("vignette", "hypothesis", "new_info", "correct_answer", "explanation")
+
+_refill_task: Optional[asyncio.Task] = None
+
+
+def focus_key(focus: str) -> str:
+    return normalize_text(focus)[:200]
+
+
+def content_hash(item: dict) -> str:
+    text = "\n".join(normalize_text(str(item.get(field, ""))) for field in ("vignette", "hypothesis", "new_info"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def bank_item_dict(bank_item: SCTBankItem) -> dict:
+    return {field: getattr(bank_item, field) for field in _ITEM_FIELDS}
+
+
+def store_items(
+    db: Session,
+    items: Sequence[dict],
+    difficulty: str,
+    focus: str,
+    source: str = "generated",
+    test_id: Optional[int] = None,
+) -> List[int]:
+    """
+    Guarda los ítems que aún no están en el banco y retorna el id de banco de
+    cada uno, en el mismo orden (los repetidos reutilizan el existente).
+    """
+    hashes = [content_hash(item) for item in items]
+    for attempt in range(2):
+        existing = dict(
+            db.query(SCTBankItem.content_hash, SCTBankItem.id)
+            .filter(SCTBankItem.content_hash.in_(set(hashes)))
+            .all()
+        ) if hashes else {}
+
+        new_rows = {}
+        for item, item_hash in zip(items, hashes):
+            if item_hash in existing or item_hash in new_rows:
+                continue
+            new_rows[item_hash] = SCTBankItem(
+                difficulty=difficulty,
+                focus=focus,
+                focus_key=focus_key(focus),
+                hypothesis_key=normalize_text(item.get("hypothesis", ""))[:500],
+                content_hash=item_hash,
+                vignette=item.get("vignette", ""),
+                hypothesis=item.get("hypothesis", ""),
+                new_info=item.get("new_info", ""),
+                correct_answer=int(item.get("correct_answer", 0)),
+                explanation=item.get("explanation", ""),
+                source=source,
+                test_id=test_id,
+            )
+        db.add_all(new_rows.values())
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            # Otro proceso guardó el mismo ítem a la vez: releer y reintentar
+            db.rollback()
+            if attempt:
+                raise
+
+    existing.update({item_hash: row.id for item_hash, row in new_rows.items()})
+    return [existing[item_hash] for item_hash in hashes]
+
+
+def record_demand(db: Session, difficulty: str, focus: str) -> None:
+    key = focus_key(focus)
+    demand = db.query(SCTBankDemand).filter(
+        SCTBankDemand.difficulty == difficulty,
+        SCTBankDemand.focus_key == key
+    ).first()
+    if demand is None:
+        demand = SCTBankDemand(difficulty=difficulty, focus_key=key, focus=focus, requests=0)
+        db.add(demand)
+    demand.requests = (demand.requests or 0) + 1
+    demand.focus = focus
+    demand.last_requested_at = datetime.utcnow()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Primer pedido simultáneo del mismo par; basta con uno
+        db.rollback()
+
+
+def available_count(db: Session, difficulty: str, focus: str) -> int:
+    return db.query(func.count(SCTBankItem.id)).filter(
+        SCTBankItem.difficulty == difficulty,
+        SCTBankItem.focus_key == focus_key(focus),
+        SCTBankItem.is_active == True
+    ).scalar() or 0
+
+
+def _pick(
+    candidates: List[SCTBankItem],
+    num_items: int,
+    chosen: List[SCTBankItem],
+    answer_cap: Optional[int],
+    unique_hypothesis: bool,
+) -> None:
+    hypotheses = {item.hypothesis_key for item in chosen}
+    fingerprints = [item_fingerprint(bank_item_dict(item)) for item in chosen]
+    answers = {}
+    for item in chosen:
+        answers[item.correct_answer] = answers.get(item.correct_answer, 0) + 1
+
+    for candidate in candidates:
+        if len(chosen) >= num_items:
+            return
+        if candidate in chosen or (unique_hypothesis and candidate.hypothesis_key in hypotheses):
+            continue
+        if answer_cap is not None and answers.get(candidate.correct_answer, 0) >= answer_cap:
+            continue
+        fingerprint = item_fingerprint(bank_item_dict(candidate))
+        if any(similarity(fingerprint, other) >= SCT_DUPLICATE_THRESHOLD for other in fingerprints):
+            continue
+        chosen.append(candidate)
+        hypotheses.add(candidate.hypothesis_key)
+        fingerprints.append(fingerprint)
+        answers[candidate.correct_answer] = answers.get(candidate.correct_answer, 0) + 1
+
+
+def select_items(
+    db: Session,
+    difficulty: str,
+    focus: str,
+    num_items: int,
+    exclude_ids: Iterable[int] = (),
+) -> List[dict]:
+    """
+    Elige hasta num_items ítems diversos del banco, priorizando los menos
+    usados, y actualiza su contador de uso. Retorna los campos del ítem más
+    su bank_id.
+    """
+    query = db.query(SCTBankItem).filter(
+        SCTBankItem.difficulty == difficulty,
+        SCTBankItem.focus_key == focus_key(focus),
+        SCTBankItem.is_active == True
+    )
+    exclude_ids = list(exclude_ids)
+    if exclude_ids:
+        query = query.filter(SCTBankItem.id.notin_(exclude_ids))
+    candidates = query.order_by(SCTBankItem.times_used, SCTBankItem.id).limit(
+        num_items * _CANDIDATES_PER_ITEM
+    ).all()
+    # Entre ítems igual de usados, orden aleatorio para variar los tests
+    candidates.sort(key=lambda item: (item.times_used or 0, random.random()))
+
+    chosen: List[SCTBankItem] = []
+    # Las restricciones se relajan de a una si no alcanzan los ítems; las
+    # viñetas casi duplicadas nunca se aceptan
+    answer_cap = max(1, math.ceil(num_items / 3))
+    _pick(candidates, num_items, chosen, answer_cap, unique_hypothesis=True)
+    _pick(candidates, num_items, chosen, None, unique_hypothesis=True)
+    _pick(candidates, num_items, chosen, None, unique_hypothesis=False)
+
+    selected = [dict(bank_item_dict(item), bank_id=item.id) for item in chosen]
+    for item in chosen:
+        item.times_used = (item.times_used or 0) + 1
+    db.commit()
+    return selected
+
+
+def pairs_to_refill(db: Session) -> List[Tuple[str, str, int]]:
+    """(dificultad, tema, ítems faltantes) de los pares más pedidos bajo el objetivo"""
+    popular = db.query(SCTBankDemand).order_by(
+        SCTBankDemand.requests.desc(),
+        SCTBankDemand.last_requested_at.desc()
+    ).limit(SCT_BANK_POPULAR_PAIRS).all()
+
+    pairs = []
+    for demand in popular:
+        missing = SCT_BANK_TARGET - available_count(db, demand.difficulty, demand.focus)
+        if missing > 0:
+            pairs.append((demand.difficulty, demand.focus, missing))
+    return pairs
+
+
+def with_session(func, *args):
+    """Ejecuta func(db, *args) con una sesión propia, fuera de un request"""
+    db = SessionLocal()
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+GenerateItems = Callable[[str, str, int], Awaitable[List[dict]]]
+
+
+async def refill_once(generate: GenerateItems) -> int:
+    """Genera ítems para los pares populares que están bajo el objetivo"""
+    added = 0
+    for difficulty, focus, missing in await run_in_threadpool(with_session, pairs_to_refill):
+        try:
+            items = await generate(difficulty, focus, min(missing, SCT_BANK_REFILL_BATCH))
+        except Exception as e:
+            print(f"[SCT bank] No se pudo reabastecer ({difficulty}, {focus}): {e}")
+            continue
+        if items:
+            await run_in_threadpool(with_session, store_items, items, difficulty, focus, "refill")
+            added += len(items)
+            print(f"[SCT bank] +{len(items)} ítems para ({difficulty}, {focus})")
+    return added
+
+
+async def _refill_loop(generate: GenerateItems) -> None:
+    while True:
+        await asyncio.sleep(SCT_BANK_REFILL_INTERVAL)
+        try:
+            await refill_once(generate)
+        except Exception as e:
+            print(f"[SCT bank] Error en el reabastecimiento: {e}")
+
+
+def start_refill_task(generate: GenerateItems) -> None:
+    """Lanza la tarea de reabastecimiento (llamar desde el event loop)"""
+    global _refill_task
+    if SCT_BANK_REFILL_INTERVAL > 0 and _refill_task is None:
+        _refill_task = asyncio.get_running_loop().create_task(_refill_loop(generate))
+
+
+def stop_refill_task() -> None:
+    global _refill_task
+    if _refill_task is not None:
+        _refill_task.cancel()
+        _refill_task = None
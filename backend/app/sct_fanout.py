@@ -0,0 +1,98 @@
+"""
+Generación de ítems SCT en paralelo (fan-out).
+
+Un test de 10 ítems nivel residente en una sola llamada al LLM es una
+respuesta enorme que tarda proporcional a la cantidad de ítems y a menudo
+queda truncada. En modo paralelo el pedido se divide en lotes pequeños que
+se generan de forma concurrente; luego se descartan los ítems casi
+duplicados y se asignan ids estables (orden de lote y posición, no de
+llegada).
+
+Variables de entorno:
+  SCT_PARALLEL                generar en paralelo por defecto (default: false)
+  SCT_FANOUT_BATCH_SIZE       ítems por llamada al LLM (default: 2)
+  SCT_FANOUT_CONCURRENCY      llamadas simultáneas a Ollama (default: 4); se
+                              limita a LLM_BATCH_MAX_IN_FLIGHT, así que para
+                              aprovecharlo hay que subir LLM_MAX_IN_FLIGHT y
+                              OLLAMA_NUM_PARALLEL
+  SCT_DUPLICATE_THRESHOLD     similitud (Jaccard de trigramas de palabras) desde
+                              la cual dos ítems se consideran duplicados
+                              (default: 0.6)
+"""
+import os
+import re
+import unicodedata
+from typing import List, Set, Tuple
+
+SCT_PARALLEL = os.getenv("SCT_PARALLEL", "false").lower() in ("1", "true", "yes")
+SCT_FANOUT_BATCH_SIZE = max(int(os.getenv("SCT_FANOUT_BATCH_SIZE", "2")), 1)
+SCT_FANOUT_CONCURRENCY = max(int(os.getenv("SCT_FANOUT_CONCURRENCY", "4")), 1)
+SCT_DUPLICATE_THRESHOLD = float(os.getenv("SCT_DUPLICATE_THRESHOLD", "0.6"))
+
+# Escenarios sugeridos a cada lote para que no generen el mismo caso
+BATCH_SCENARIOS = [
+    "un adulto joven sin comorbilidades",
+    "un adulto mayor con comorbilidades",
+    "un paciente pediátrico o adolescente",
+    "una paciente embarazada o en puerperio",
+    "un paciente inmunosuprimido",
+    "una presentación atípica o tardía",
+    "una complicación durante el tratamiento",
+    "un contexto de urgencia",
+    "el seguimiento ambulatorio",
+    "un paciente con factores de riesgo sociales u ocupacionales",
+]
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def split_batches(num_items: int, batch_size: int = SCT_FANOUT_BATCH_SIZE) -> List[int]:
+    """Tamaños de los lotes: split_batches(5, 2) -> [2, 2, 1]"""
+    sizes = [batch_size] * (num_items // batch_size)
+    if num_items % batch_size:
+        sizes.append(num_items % batch_size)
+    return sizes
+
+
+def batch_scenario(batch_index: int) -> str:
+    return BATCH_SCENARIOS[batch_index % len(BATCH_SCENARIOS)]
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin tildes ni puntuación: "¿Neumonía?" -> "neumonia" """
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return " ".join(_WORD_RE.findall("".join(c for c in normalized if not unicodedata.combining(c))))
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = normalize_text(text).split()
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def similarity(a: Set[Tuple[str, ...]], b: Set[Tuple[str, ...]]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def item_fingerprint(item: dict) -> Set[Tuple[str, ...]]:
+    text = " ".join(str(item.get(field, "")) for field in ("vignette", "hypothesis", "new_info"))
+    return _shingles(text)
+
+
+def dedupe_items(items: List[dict], threshold: float = SCT_DUPLICATE_THRESHOLD) -> List[dict]:
+    """
+    Descarta los ítems casi duplicados conservando el primero de cada grupo,
+    así el resultado depende solo del orden de entrada.
+    """
+    kept: List[dict] = []
+    fingerprints: List[Set[Tuple[str, ...]]] = []
+    for item in items:
+        fingerprint = item_fingerprint(item)
+        if any(similarity(fingerprint, other) >= threshold for other in fingerprints):
+            continue
+        kept.append(item)
+        fingerprints.append(fingerprint)
+    return kept
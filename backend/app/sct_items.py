@@ -0,0 +1,114 @@
+"""
+Ítems de los tests SCT guardados.
+
+Cada ítem es una fila de sct_test_items (test, posición); sct_tests solo
+guarda la cabecera. Así /api/sct/list no lee ítems, y un test, un ítem o un
+rango de ítems se obtienen con una consulta por índice.
+
+Los tests guardados antes de este cambio tienen los ítems en
+sct_tests.items_json; se migran al leerlos por primera vez, o todos juntos:
+    python -m app.sct_items backfill
+"""
+import sys
+from typing import List, Optional, Sequence
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import SCTTest, SCTTestItem
+
+_ITEM_FIELDS = ("vignette", "hypothesis", "new_info", "correct_answer", "explanation", "bank_id")
+
+
+def item_dict(row: SCTTestItem) -> dict:
+    """Campos de SCTItem; el id es la posición en el test"""
+    item = {"id": row.position, **{field: getattr(row, field) for field in _ITEM_FIELDS}}
+    # Los ítems antiguos pueden no tener explicación
+    item["explanation"] = item["explanation"] or ""
+    return item
+
+
+def add_items(db: Session, test_id: int, items: Sequence[dict]) -> None:
+    """Agrega los ítems de un test en orden (sin commit)"""
+    db.add_all([
+        SCTTestItem(
+            test_id=test_id,
+            position=position,
+            vignette=item.get("vignette", ""),
+            hypothesis=item.get("hypothesis", ""),
+            new_info=item.get("new_info", ""),
+            correct_answer=item.get("correct_answer", 0),
+            explanation=item.get("explanation") or "",
+            bank_id=item.get("bank_id"),
+        )
+        for position, item in enumerate(items, 1)
+    ])
+
+
+def _count(db: Session, test_id: int) -> int:
+    return db.query(func.count(SCTTestItem.id)).filter(SCTTestItem.test_id == test_id).scalar() or 0
+
+
+def _migrate_legacy(db: Session, test_id: int) -> int:
+    """
+    Pasa los ítems de items_json a sct_test_items; retorna cuántos ítems
+    tiene el test después de migrar (0 si no había ítems antiguos)
+    """
+    legacy = db.query(SCTTest.items_json).filter(SCTTest.id == test_id).scalar()
+    if not legacy:
+        return 0
+    add_items(db, test_id, legacy)
+    db.query(SCTTest).filter(SCTTest.id == test_id).update({SCTTest.items_json: []}, synchronize_session=False)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Otra petición migró el mismo test al mismo tiempo (uq_sct_test_items_position)
+        db.rollback()
+        return _count(db, test_id)
+    print(f"[SCT] Test {test_id}: {len(legacy)} ítems migrados a sct_test_items")
+    return len(legacy)
+
+
+def item_count(db: Session, test_id: int) -> int:
+    return _count(db, test_id) or _migrate_legacy(db, test_id)
+
+
+def load_items(db: Session, test_id: int, start: int = 1, limit: Optional[int] = None) -> List[dict]:
+    """Ítems del test desde la posición start (1 = primero), hasta limit ítems"""
+    def query():
+        rows = (
+            db.query(SCTTestItem)
+            .filter(SCTTestItem.test_id == test_id, SCTTestItem.position >= start)
+            .order_by(SCTTestItem.position)
+        )
+        return (rows.limit(limit) if limit is not None else rows).all()
+
+    rows = query()
+    if not rows and _migrate_legacy(db, test_id):
+        rows = query()
+    return [item_dict(row) for row in rows]
+
+
+def _backfill() -> None:
+    from .db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        migrated = (
+            db.query(SCTTest.id)
+            .outerjoin(SCTTestItem, SCTTestItem.test_id == SCTTest.id)
+            .filter(SCTTestItem.id == None)
+            .all()
+        )
+        total = sum(_migrate_legacy(db, test_id) for (test_id,) in migrated)
+        print(f"[SCT] {len(migrated)} tests revisados, {total} ítems migrados")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print("Uso: python -m app.sct_items backfill")
+        sys.exit(1)
+    _backfill()
@@ -0,0 +1,115 @@
+"""
+Recuperación de ítems SCT desde respuestas incompletas o mal formadas.
+
+Una generación larga puede terminar truncada (num_predict agotado, timeout)
+o con JSON levemente inválido (coma final, texto o ``` alrededor). En lugar
+de descartar toda la respuesta se rescata cada ítem completo con el parser
+incremental de sct_stream; los ítems se validan uno por uno y luego se piden
+al LLM solo los que faltan (ver _generate_single en routers/sct.py).
+
+Las métricas quedan en /api/llm/stats (campo "sct_salvage"):
+  clean      respuestas que eran JSON válido
+  repaired   respuestas inválidas de las que se rescató al menos un ítem
+  failed     respuestas de las que no se rescató nada
+  repair_rate   fracción de respuestas que necesitaron reparación
+  salvage_rate  fracción de las respuestas inválidas que se pudo rescatar
+
+Variables de entorno:
+  SCT_TOPUP_ROUNDS   llamadas extra para completar los ítems que faltan
+                     (default: 1; 0 = devolver solo lo rescatado)
+"""
+import json
+import os
+import re
+from typing import List
+
+from .sct_stream import SCTItemStreamParser, loads_lenient
+
+SCT_TOPUP_ROUNDS = max(int(os.getenv("SCT_TOPUP_ROUNDS", "1")), 0)
+
+CLEAN = "clean"
+REPAIRED = "repaired"
+FAILED = "failed"
+
+_CODE_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```\s*$")
+
+
+class SalvageStats:
+    def __init__(self):
+        self.responses = {CLEAN: 0, REPAIRED: 0, FAILED: 0}
+        self.items_salvaged = 0
+        self.items_rejected = 0
+        self.topup_calls = 0
+        self.topup_items_requested = 0
+        self.topup_items_received = 0
+
+    def record_rejected(self, count: int) -> None:
+        self.items_rejected += count
+
+    def record_topup(self, requested: int, received: int) -> None:
+        self.topup_calls += 1
+        self.topup_items_requested += requested
+        self.topup_items_received += received
+
+    def stats(self) -> dict:
+        total = sum(self.responses.values())
+        malformed = self.responses[REPAIRED] + self.responses[FAILED]
+        return {
+            **self.responses,
+            "repair_rate": round(malformed / total, 3) if total else 0.0,
+            "salvage_rate": round(self.responses[REPAIRED] / malformed, 3) if malformed else 0.0,
+            "items_salvaged": self.items_salvaged,
+            "items_rejected": self.items_rejected,
+            "topup_calls": self.topup_calls,
+            "topup_items_requested": self.topup_items_requested,
+            "topup_items_received": self.topup_items_received,
+        }
+
+
+salvage_stats = SalvageStats()
+
+
+def _items_of(data) -> List[dict]:
+    if isinstance(data, dict):
+        items = data.get("items")
+        if isinstance(items, list):
+            return [item for item in items if isinstance(item, dict)]
+        # Un solo ítem sin el arreglo alrededor
+        return [data] if "vignette" in data else []
+    if isinstance(data, list):
+        return [item for item in data if isinstance(item, dict)]
+    return []
+
+
+def parse_items(content: str) -> List[dict]:
+    """
+    Ítems de la respuesta del LLM, tolerando JSON truncado o mal formado.
+    No valida los campos: eso lo hace quien llama.
+    """
+    try:
+        items = _items_of(json.loads(content))
+    except json.JSONDecodeError:
+        pass
+    else:
+        salvage_stats.responses[CLEAN] += 1
+        return items
+
+    # Descartar lo que el modelo haya escrito antes o alrededor del JSON
+    text = _CODE_FENCE.sub("", content.strip())
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    text = text[min(starts):] if starts else ""
+
+    try:
+        items = _items_of(loads_lenient(text))
+    except json.JSONDecodeError:
+        # Truncado: rescatar cada ítem que alcanzó a cerrarse
+        items = SCTItemStreamParser().feed(text)
+
+    if items:
+        salvage_stats.responses[REPAIRED] += 1
+        salvage_stats.items_salvaged += len(items)
+        print(f"[SCT] Respuesta mal formada: se rescataron {len(items)} ítems")
+    else:
+        salvage_stats.responses[FAILED] += 1
+        print("[SCT] Respuesta mal formada: no se rescató ningún ítem")
+    return items
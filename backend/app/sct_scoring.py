@@ -0,0 +1,247 @@
+"""
+Puntaje de tests SCT por el método agregado (aggregate scoring).
+
+Un ítem SCT no tiene una sola respuesta correcta: cada valor de la escala
+recibe crédito según cuántos expertos del panel lo eligieron, dividido por
+los que eligieron la respuesta modal (la modal vale 1, una respuesta que
+nadie del panel eligió vale 0). El puntaje de un estudiante es la suma de
+créditos expresada como porcentaje de los ítems con respuestas del panel.
+
+Las respuestas se guardan como un int8 por ítem (ver SCTAnswerSheet) y se
+apilan en matrices respondente × ítem; todo el cálculo es vectorizado con
+NumPy, sin recorrer estudiantes en Python:
+
+  - puntaje bruto y porcentaje de cada estudiante
+  - z-score respecto del panel (cada experto puntuado contra el resto del
+    panel, leave-one-out) y puntaje en la escala del panel (media 80, DE 5)
+  - por ítem: modal y acuerdo del panel, distribución de respuestas,
+    crédito promedio y discriminación (correlación ítem-resto)
+
+Los resultados se guardan en caché por test y se recalculan cuando cambian
+las hojas del panel o de los estudiantes (cantidad o última actualización).
+
+Variables de entorno:
+  SCT_SCORE_CACHE_SIZE   tests con puntajes en caché (default: 64)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import SCTAnswerSheet
+
+SCT_SCORE_CACHE_SIZE = int(os.getenv("SCT_SCORE_CACHE_SIZE", "64"))
+
+STUDENT = "student"
+PANEL = "panel"
+ROLES = (STUDENT, PANEL)
+
+MISSING = -128
+SCALE = np.arange(-2, 3, dtype=np.int8)
+
+# Escala de referencia del panel para los puntajes transformados
+PANEL_SCALED_MEAN = 80.0
+PANEL_SCALED_SD = 5.0
+
+_cache: "OrderedDict[int, Tuple[tuple, dict]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def encode_answers(answers: Sequence[Optional[int]], num_items: int) -> bytes:
+    """Una hoja de respuestas como bytes (int8 por ítem); lanza ValueError si no es válida"""
+    if len(answers) != num_items:
+        raise ValueError(f"Se esperaban {num_items} respuestas y llegaron {len(answers)}")
+    if any(answer is not None and not -2 <= answer <= 2 for answer in answers):
+        raise ValueError("Las respuestas deben estar entre -2 y +2")
+    return np.array([MISSING if answer is None else answer for answer in answers], dtype=np.int8).tobytes()
+
+
+def stack_sheets(blobs: Sequence[bytes], num_items: int) -> np.ndarray:
+    """Matriz respondente × ítem (int8) a partir de las hojas guardadas"""
+    if not blobs:
+        return np.empty((0, num_items), dtype=np.int8)
+    return np.frombuffer(b"".join(blobs), dtype=np.int8).reshape(len(blobs), num_items)
+
+
+def option_counts(matrix: np.ndarray) -> np.ndarray:
+    """Cantidad de respuestas por ítem y valor de la escala (ítem × 5)"""
+    return (matrix[:, :, None] == SCALE).sum(axis=0)
+
+
+def credit_table(counts: np.ndarray) -> np.ndarray:
+    """Crédito de cada valor de la escala por ítem: respuestas / respuestas de la modal"""
+    modal = counts.max(axis=1, keepdims=True)
+    return np.divide(counts, modal, out=np.zeros(counts.shape), where=modal > 0)
+
+
+def item_credits(matrix: np.ndarray, credit: np.ndarray) -> np.ndarray:
+    """Crédito obtenido en cada ítem (respondente × ítem); sin responder = 0"""
+    answered = matrix != MISSING
+    index = np.where(answered, matrix.astype(np.int16) + 2, 0)
+    return credit[np.arange(matrix.shape[1]), index] * answered
+
+
+def panel_self_scores(panel: np.ndarray, counts: np.ndarray, scored: np.ndarray) -> np.ndarray:
+    """Puntaje (%) de cada experto contra el resto del panel (leave-one-out)"""
+    if panel.shape[0] < 2:
+        return 100 * item_credits(panel, credit_table(counts))[:, scored].sum(axis=1) / max(scored.sum(), 1)
+    own = panel[:, :, None] == SCALE
+    others = counts[None, :, :] - own
+    modal = others.max(axis=2)
+    agreeing = (others * own).sum(axis=2)
+    credit = np.divide(agreeing, modal, out=np.zeros(modal.shape), where=modal > 0)
+    return 100 * credit[:, scored].sum(axis=1) / max(scored.sum(), 1)
+
+
+def _mean_sd(values: np.ndarray) -> Tuple[Optional[float], Optional[float]]:
+    if values.size == 0:
+        return None, None
+    sd = float(values.std(ddof=1)) if values.size > 1 else 0.0
+    return float(values.mean()), sd
+
+
+def _round(values: np.ndarray, digits: int = 3) -> list:
+    return np.round(values, digits).tolist()
+
+
+def score_matrices(students: np.ndarray, panel: np.ndarray) -> dict:
+    """Puntajes de todos los estudiantes y estadísticas de ítems"""
+    num_items = students.shape[1]
+    counts = option_counts(panel)
+    credit = credit_table(counts)
+    scored = counts.sum(axis=1) > 0
+    num_scored = int(scored.sum())
+
+    credits = item_credits(students, credit)
+    raw = credits.sum(axis=1)
+    percent = 100 * raw / num_scored if num_scored else np.zeros(len(students))
+    answered = students != MISSING
+
+    panel_mean, panel_sd = _mean_sd(panel_self_scores(panel, counts, scored) if num_scored else np.empty(0))
+    cohort_mean, cohort_sd = _mean_sd(percent)
+    if panel_sd:
+        z = (percent - panel_mean) / panel_sd
+        z_scores, scaled = _round(z), _round(PANEL_SCALED_MEAN + PANEL_SCALED_SD * z, 2)
+    else:
+        z_scores = scaled = [None] * len(students)
+
+    # Discriminación: correlación de cada ítem con el puntaje del resto del test
+    rest = raw[:, None] - credits
+    item_centered = credits - credits.mean(axis=0)
+    rest_centered = rest - rest.mean(axis=0)
+    denominator = np.sqrt((item_centered ** 2).sum(axis=0) * (rest_centered ** 2).sum(axis=0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        discrimination = np.where(denominator > 0, (item_centered * rest_centered).sum(axis=0) / denominator, np.nan)
+
+    answered_per_item = answered.sum(axis=0)
+    panel_total = counts.sum(axis=1)
+    modal_index = counts.argmax(axis=1)
+    agreement = np.divide(counts.max(axis=1), panel_total, out=np.zeros(num_items), where=panel_total > 0)
+    mean_credit = np.divide(credits.sum(axis=0), answered_per_item, out=np.zeros(num_items), where=answered_per_item > 0)
+    distribution = option_counts(students)
+
+    return {
+        "students": len(students),
+        "panel_members": len(panel),
+        "scored_items": num_scored,
+        "panel_mean": panel_mean,
+        "panel_sd": panel_sd,
+        "cohort_mean": cohort_mean,
+        "cohort_sd": cohort_sd,
+        "answered": answered.sum(axis=1).tolist(),
+        "raw_score": _round(raw),
+        "score": _round(percent, 2),
+        "z_score": z_scores,
+        "scaled_score": scaled,
+        "items": [
+            {
+                "item_id": index + 1,
+                "panel_answers": int(panel_total[index]),
+                "panel_modal": int(modal_index[index]) - 2 if panel_total[index] else None,
+                "panel_agreement": round(float(agreement[index]), 3),
+                "answered": int(answered_per_item[index]),
+                "distribution": distribution[index].tolist(),
+                "mean_credit": round(float(mean_credit[index]), 3),
+                "discrimination": None if np.isnan(discrimination[index]) else round(float(discrimination[index]), 3),
+            }
+            for index in range(num_items)
+        ],
+    }
+
+
+def store_sheets(db: Session, test_id: int, role: str, sheets: Sequence[Tuple[str, bytes]]) -> int:
+    """Guarda o reemplaza las hojas (respondente, respuestas) de un test"""
+    now = datetime.utcnow()
+    by_respondent: Dict[str, bytes] = dict(sheets)
+    existing = {
+        sheet.respondent: sheet
+        for sheet in db.query(SCTAnswerSheet).filter(
+            SCTAnswerSheet.test_id == test_id,
+            SCTAnswerSheet.role == role,
+            SCTAnswerSheet.respondent.in_(list(by_respondent)),
+        )
+    }
+    for respondent, answers in by_respondent.items():
+        sheet = existing.get(respondent)
+        if sheet is None:
+            db.add(SCTAnswerSheet(test_id=test_id, role=role, respondent=respondent, answers=answers, updated_at=now))
+        else:
+            sheet.answers = answers
+            sheet.updated_at = now
+    db.commit()
+    return len(by_respondent)
+
+
+def _sheets_stamp(db: Session, test_id: int) -> tuple:
+    """Cambia cuando se agrega o reemplaza una hoja de cualquiera de los roles"""
+    rows = (
+        db.query(SCTAnswerSheet.role, func.count(SCTAnswerSheet.id), func.max(SCTAnswerSheet.updated_at))
+        .filter(SCTAnswerSheet.test_id == test_id)
+        .group_by(SCTAnswerSheet.role)
+        .all()
+    )
+    return tuple(sorted((role, count, str(updated)) for role, count, updated in rows))
+
+
+def _load(db: Session, test_id: int, role: str, num_items: int) -> Tuple[List[str], np.ndarray]:
+    rows = (
+        db.query(SCTAnswerSheet.respondent, SCTAnswerSheet.answers)
+        .filter(SCTAnswerSheet.test_id == test_id, SCTAnswerSheet.role == role)
+        .order_by(SCTAnswerSheet.id)
+        .all()
+    )
+    return [row[0] for row in rows], stack_sheets([bytes(row[1]) for row in rows], num_items)
+
+
+def test_scores(db: Session, test_id: int, num_items: int) -> Tuple[dict, bool, float]:
+    """
+    Puntajes del test, desde la caché si las hojas no cambiaron.
+    Retorna (resultado, desde_caché, milisegundos).
+    """
+    started = time.perf_counter()
+    stamp = (num_items, _sheets_stamp(db, test_id))
+    with _cache_lock:
+        entry = _cache.get(test_id)
+        if entry is not None and entry[0] == stamp:
+            _cache.move_to_end(test_id)
+            return entry[1], True, (time.perf_counter() - started) * 1000
+
+    respondents, students = _load(db, test_id, STUDENT, num_items)
+    _, panel = _load(db, test_id, PANEL, num_items)
+    result = score_matrices(students, panel)
+    result["respondents"] = respondents
+
+    with _cache_lock:
+        _cache[test_id] = (stamp, result)
+        _cache.move_to_end(test_id)
+        while len(_cache) > SCT_SCORE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"[SCT] Puntajes del test {test_id}: {len(students)} estudiantes, panel de {len(panel)} en {elapsed:.0f}ms")
+    return result, False, elapsed
@@ -0,0 +1,108 @@
+"""
+Parser incremental de la respuesta JSON del LLM para ítems SCT.
+
+Ollama entrega la respuesta de a pocos tokens; el parser recibe esos
+fragmentos y devuelve cada objeto del arreglo "items" apenas se cierra, sin
+esperar el final del documento. Acepta tanto {"items": [...]} como un
+arreglo de ítems en el nivel superior.
+"""
+import json
+import re
+from typing import List, Optional
+
+# Coma antes de un cierre, error frecuente del modelo: {"a": 1,}
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def loads_lenient(text: str):
+    """
+    json.loads que además tolera comas finales y saltos de línea sin escapar
+    dentro de los textos; lanza JSONDecodeError si no se puede
+    """
+    try:
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", text), strict=False)
+
+
+class SCTItemStreamParser:
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Claves del objeto de nivel superior, para ubicar "items"
+        self._key_chars: Optional[List[str]] = None
+        self._last_key: Optional[str] = None
+        # Profundidad del arreglo de ítems (None = aún no encontrado)
+        self._items_depth: Optional[int] = None
+        self._items_closed = False
+        # Texto del ítem en curso
+        self._item_chars: Optional[List[str]] = None
+
+    @property
+    def finished(self) -> bool:
+        """True cuando el arreglo de ítems ya se cerró"""
+        return self._items_closed
+
+    def feed(self, chunk: str) -> List[dict]:
+        """Procesa un fragmento y retorna los ítems que quedaron completos"""
+        items = []
+        for char in chunk:
+            if self._item_chars is not None:
+                self._item_chars.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._last_key = "".join(self._key_chars)
+                        self._key_chars = None
+                elif self._key_chars is not None:
+                    self._key_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._items_depth is None:
+                    self._key_chars = []
+            elif char in "{[":
+                self._depth += 1
+                if self._items_depth is None and char == "[":
+                    # {"items": [ ... ]} o directamente [ ... ]
+                    if self._depth == 1 or (self._depth == 2 and self._last_key == "items"):
+                        self._items_depth = self._depth
+                elif (
+                    char == "{"
+                    and self._items_depth is not None
+                    and not self._items_closed
+                    and self._depth == self._items_depth + 1
+                ):
+                    self._item_chars = ["{"]
+            elif char in "}]":
+                if (
+                    char == "}"
+                    and self._item_chars is not None
+                    and self._depth == self._items_depth + 1
+                ):
+                    item = self._close_item()
+                    if item is not None:
+                        items.append(item)
+                elif char == "]" and self._depth == self._items_depth:
+                    self._items_closed = True
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                self._last_key = None
+        return items
+
+    def _close_item(self) -> Optional[dict]:
+        text = "".join(self._item_chars)
+        self._item_chars = None
+        try:
+            item = loads_lenient(text)
+        except json.JSONDecodeError:
+            return None
+        return item if isinstance(item, dict) else None
@@ -0,0 +1,357 @@
+"""
+Servidor de tiles Deep Zoom bajo demanda.
+
+En lugar de pre-renderizar todos los tiles de una lámina al subirla, los tiles
+se generan cuando el visor los pide usando deepzoom.DeepZoomGenerator.
+Se mantienen tres niveles de caché:
+  1. Un pool LRU de handles OpenSlide abiertos (abrir un SVS es costoso)
+  2. Una caché en memoria de tiles "calientes" acotada por bytes
+  3. Una caché opcional en disco (write-through), como carpeta DZI o como
+     pack de un solo archivo (tile_pack), con el mismo layout que usan los
+     trabajos de tiling en segundo plano (tiling_jobs), por lo que los tiles
+     ya pre-renderizados se siguen aprovechando
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Hashable, Optional, Tuple
+
+from .tile_codec import tile_codec
+
+# Directorio donde se guardan descriptores .dzi y carpetas de tiles
+DZI_DIR = "uploads/dzi_tiles"
+
+# Parámetros de los tiles
+DZI_TILE_SIZE = 256
+DZI_OVERLAP = 1
+# Formato según el perfil de codificación del despliegue (ver tile_codec)
+DZI_FORMAT = tile_codec.format
+
+SLIDE_POOL_SIZE = int(os.getenv("SLIDE_POOL_SIZE", "8"))
+TILE_CACHE_MB = int(os.getenv("TILE_CACHE_MB", "256"))
+TILE_DISK_CACHE = os.getenv("TILE_DISK_CACHE", "true").lower() in ("1", "true", "yes")
+# Almacenamiento de tiles en disco: "files" (un archivo por tile) o "pack" (ver tile_pack)
+TILE_STORAGE = os.getenv("TILE_STORAGE", "files").lower()
+
+
+def dzi_paths(filename: str) -> Tuple[str, str]:
+    """Rutas del descriptor .dzi y de la carpeta de tiles de una imagen"""
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(DZI_DIR, f"{stem}.dzi"), os.path.join(DZI_DIR, f"{stem}_files")
+
+
+def dzi_tiles_dir(stored_name: str) -> str:
+    """
+    Carpeta de tiles de una imagen para el perfil de codificación actual:
+    <stem>_files/<versión>/<nivel>/<col>_<fila>.<fmt>, así un cambio de perfil
+    nunca sirve tiles guardados con otro
+    """
+    _, tiles_root = dzi_paths(stored_name)
+    return os.path.join(tiles_root, tile_codec.version)
+
+
+def dzi_tiles_url(prefix: str, image_id: int) -> str:
+    """URL base de los tiles de una imagen, versionada con el perfil de codificación"""
+    return f"{prefix}/{image_id}/dzi/{tile_codec.version}/"
+
+
+def build_dzi_xml(width: int, height: int, tiles_url: Optional[str] = None) -> str:
+    """
+    Genera el descriptor XML de Deep Zoom.
+    Si se indica tiles_url, se agrega el atributo Url que OpenSeadragon usa
+    para ubicar los tiles en lugar de derivarlo de la URL del descriptor.
+    """
+    url_attr = f'\n  Url="{tiles_url}"' if tiles_url else ""
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008"
+  Format="{DZI_FORMAT}"
+  Overlap="{DZI_OVERLAP}"
+  TileSize="{DZI_TILE_SIZE}"{url_attr}>
+  <Size Height="{height}"
+    Width="{width}"/>
+</Image>'''
+
+
+class BytesLRUCache:
+    """
+    Caché LRU en memoria acotada por la cantidad total de bytes almacenados.
+    Cada entrada guarda el contenido junto con su ETag.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, str]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, data: bytes, etag: str) -> None:
+        # Un elemento más grande que la caché completa no se guarda
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+
+            self._entries[key] = (data, etag)
+            self._size += len(data)
+
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def evict_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Elimina todas las entradas cuya clave cumpla el predicado"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                data, _ = self._entries.pop(key)
+                self._size -= len(data)
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class _PooledSlide:
+    def __init__(self, slide, generator):
+        self.slide = slide
+        self.generator = generator
+        self.users = 0
+        self.evicted = False
+
+
+class SlidePool:
+    """
+    Pool LRU de handles OpenSlide abiertos, cada uno con su DeepZoomGenerator.
+    Un handle expulsado del pool mientras está en uso se cierra recién
+    cuando el último usuario lo libera.
+    """
+
+    def __init__(self, max_open: int):
+        self.max_open = max_open
+        self._entries: "OrderedDict[str, _PooledSlide]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, file_path: str):
+        entry = self._checkout(file_path)
+        try:
+            yield entry.generator
+        finally:
+            self._release(entry)
+
+    @contextmanager
+    def acquire_slide(self, file_path: str):
+        """Igual que acquire, pero entrega el handle OpenSlide"""
+        entry = self._checkout(file_path)
+        try:
+            yield entry.slide
+        finally:
+            self._release(entry)
+
+    def _checkout(self, file_path: str) -> _PooledSlide:
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None:
+                self._entries.move_to_end(file_path)
+                entry.users += 1
+                return entry
+
+        # Abrir fuera del lock para no bloquear a otras láminas
+        import openslide
+        from openslide import deepzoom
+
+        slide = openslide.open_slide(file_path)
+        generator = deepzoom.DeepZoomGenerator(
+            slide, tile_size=DZI_TILE_SIZE, overlap=DZI_OVERLAP
+        )
+
+        with self._lock:
+            existing = self._entries.get(file_path)
+            if existing is not None:
+                # Otro hilo abrió la misma lámina mientras tanto
+                slide.close()
+                existing.users += 1
+                self._entries.move_to_end(file_path)
+                return existing
+
+            entry = _PooledSlide(slide, generator)
+            entry.users += 1
+            self._entries[file_path] = entry
+
+            while len(self._entries) > self.max_open:
+                _, evicted = self._entries.popitem(last=False)
+                self._retire(evicted)
+
+            return entry
+
+    def _release(self, entry: _PooledSlide) -> None:
+        with self._lock:
+            entry.users -= 1
+            if entry.evicted and entry.users == 0:
+                entry.slide.close()
+
+    def _retire(self, entry: _PooledSlide) -> None:
+        # Debe llamarse con el lock tomado
+        entry.evicted = True
+        if entry.users == 0:
+            entry.slide.close()
+
+    def close(self, file_path: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(file_path, None)
+            if entry is not None:
+                self._retire(entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open_slides": len(self._entries),
+                "max_open": self.max_open,
+                "in_use": sum(1 for entry in self._entries.values() if entry.users > 0),
+            }
+
+
+class DeepZoomTileServer:
+    """
+    Genera tiles DZI bajo demanda combinando el pool de láminas,
+    la caché en memoria y la caché opcional en disco.
+    """
+
+    def __init__(self, pool_size: int, cache_bytes: int, disk_cache: bool):
+        self.slides = SlidePool(pool_size)
+        self.tiles = BytesLRUCache(cache_bytes)
+        self.disk_cache = disk_cache
+
+    @staticmethod
+    def tile_etag(stored_name: str, level: int, col: int, row: int) -> str:
+        stem = os.path.splitext(stored_name)[0]
+        return f'"{stem}-{level}-{col}-{row}-{tile_codec.version}.{DZI_FORMAT}"'
+
+    def cached_tile(self, image_id: int, level: int, col: int, row: int) -> Optional[Tuple[bytes, str]]:
+        """Busca un tile solo en memoria, sin tocar la BD ni el disco"""
+        return self.tiles.get((image_id, level, col, row))
+
+    def descriptor(self, file_path: str, tiles_url: Optional[str] = None) -> str:
+        with self.slides.acquire(file_path) as generator:
+            width, height = generator.level_dimensions[-1]
+        return build_dzi_xml(width, height, tiles_url)
+
+    def get_tile(
+        self,
+        image_id: int,
+        stored_name: str,
+        file_path: str,
+        level: int,
+        col: int,
+        row: int,
+    ) -> Tuple[bytes, str]:
+        """
+        Obtiene un tile (contenido, ETag). Lanza ValueError si las
+        coordenadas están fuera de la pirámide de la lámina.
+        """
+        from . import tile_pack
+
+        key = (image_id, level, col, row)
+        cached = self.tiles.get(key)
+        if cached is not None:
+            return cached
+
+        etag = self.tile_etag(stored_name, level, col, row)
+
+        if self.disk_cache:
+            data = self._read_disk(stored_name, level, col, row)
+            if data is not None:
+                self.tiles.put(key, data, etag)
+                return data, etag
+
+        with self.slides.acquire(file_path) as generator:
+            if level < 0 or level >= generator.level_count:
+                raise ValueError(f"Nivel {level} fuera de rango")
+            cols, rows = generator.level_tiles[level]
+            if col < 0 or row < 0 or col >= cols or row >= rows:
+                raise ValueError(f"Tile ({col}, {row}) fuera de rango en nivel {level}")
+            level_tiles = generator.level_tiles
+            tile = generator.get_tile(level, (col, row))
+
+        data = tile_codec.encode(tile, level, len(level_tiles))
+
+        if self.disk_cache:
+            if TILE_STORAGE == "pack":
+                tile_pack.append_tiles(stored_name, level_tiles, [(level, col, row, data)])
+            else:
+                self._write_through(
+                    os.path.join(dzi_tiles_dir(stored_name), str(level), f"{col}_{row}.{DZI_FORMAT}"), data
+                )
+
+        self.tiles.put(key, data, etag)
+        return data, etag
+
+    @staticmethod
+    def _read_disk(stored_name: str, level: int, col: int, row: int) -> Optional[bytes]:
+        """Busca el tile en el pack de la lámina o, si no, en la carpeta DZI"""
+        from . import tile_pack
+
+        with tile_pack.acquire_pack(stored_name) as reader:
+            data = reader.get(level, col, row) if reader is not None else None
+        if data is not None:
+            return data
+
+        tile_path = os.path.join(dzi_tiles_dir(stored_name), str(level), f"{col}_{row}.{DZI_FORMAT}")
+        if os.path.exists(tile_path):
+            with open(tile_path, "rb") as f:
+                return f.read()
+        return None
+
+    @staticmethod
+    def _write_through(tile_path: str, data: bytes) -> None:
+        try:
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            # Escritura atómica para no servir nunca un tile a medio escribir
+            tmp_path = f"{tile_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, tile_path)
+        except OSError as e:
+            print(f"[tiles] No se pudo guardar el tile en disco {tile_path}: {e}")
+
+    def evict(self, image_id: int, file_path: str) -> None:
+        """Libera el handle y los tiles en memoria de una imagen eliminada"""
+        self.slides.close(file_path)
+        self.tiles.evict_where(lambda key: key[0] == image_id)
+
+    def stats(self) -> dict:
+        return {
+            "slides": self.slides.stats(),
+            "tiles": self.tiles.stats(),
+            "disk_cache": self.disk_cache,
+        }
+
+
+tile_server = DeepZoomTileServer(
+    pool_size=SLIDE_POOL_SIZE,
+    cache_bytes=TILE_CACHE_MB * 1024 * 1024,
+    disk_cache=TILE_DISK_CACHE,
+)
@@ -0,0 +1,167 @@
+"""
+Extracción de metadatos de las láminas al momento de la ingesta.
+
+Se abre el archivo una sola vez (OpenSlide para SVS y TIFF piramidales,
+Pillow para TIFF planos, JPG y PNG) y el resultado se guarda en la fila de
+MedicalImage, de modo que /list, /info y el descriptor DZI se responden con
+una lectura de la BD, sin abrir el archivo.
+
+Los micrones por pixel solo se toman de los formatos de lámina que lee
+OpenSlide. En JPG, PNG y TIFF planos la resolución (dpi) suele ser un valor
+por defecto del programa que los guardó (72 o 96 dpi) y no la del escáner,
+por lo que mpp queda en None.
+
+Para completar las imágenes subidas antes de este cambio (y quitar el mpp
+derivado de los dpi de imágenes genéricas):
+    python -m app.slide_metadata backfill
+"""
+import os
+import sys
+from typing import Optional
+
+# Metadatos que se guardan en columnas propias; el resto va a slide_metadata (JSON)
+METADATA_COLUMNS = ("width", "height", "level_count", "mpp_x", "mpp_y", "objective_power", "vendor")
+
+
+def _float_or_none(value) -> Optional[float]:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _from_openslide(file_path: str, strict: bool = False) -> dict:
+    """strict=True exige un formato de OpenSlide (sin recurrir a ImageSlide)"""
+    import openslide
+
+    slide = openslide.OpenSlide(file_path) if strict else openslide.open_slide(file_path)
+    try:
+        properties = slide.properties
+        return {
+            "width": slide.dimensions[0],
+            "height": slide.dimensions[1],
+            "level_count": slide.level_count,
+            "level_dimensions": [list(dims) for dims in slide.level_dimensions],
+            "level_downsamples": [float(d) for d in slide.level_downsamples],
+            "mpp_x": _float_or_none(properties.get(openslide.PROPERTY_NAME_MPP_X)),
+            "mpp_y": _float_or_none(properties.get(openslide.PROPERTY_NAME_MPP_Y)),
+            "objective_power": _float_or_none(properties.get(openslide.PROPERTY_NAME_OBJECTIVE_POWER)),
+            "vendor": properties.get(openslide.PROPERTY_NAME_VENDOR),
+            "associated_images": sorted(slide.associated_images.keys()),
+        }
+    finally:
+        slide.close()
+
+
+def _from_pillow(file_path: str) -> dict:
+    from PIL import Image as PILImage
+
+    # El límite de pixeles de Pillow es global y lo comparten las previews y
+    # otras cargas concurrentes, así que no se modifica: una imagen que lo
+    # supera por más del doble no se puede abrir y queda sin metadatos
+    try:
+        image = PILImage.open(file_path)
+    except PILImage.DecompressionBombError as e:
+        raise ValueError(f"Imagen demasiado grande para leerla con Pillow: {e}")
+
+    with image:
+        width, height = image.size
+
+        # Las páginas de un TIFF multipágina cuentan como niveles si son
+        # reducciones de la primera
+        level_dimensions = [[width, height]]
+        for frame in range(1, getattr(image, "n_frames", 1)):
+            image.seek(frame)
+            frame_width, frame_height = image.size
+            if frame_width < level_dimensions[-1][0] and frame_height < level_dimensions[-1][1]:
+                level_dimensions.append([frame_width, frame_height])
+
+        return {
+            "width": width,
+            "height": height,
+            "level_count": len(level_dimensions),
+            "level_dimensions": level_dimensions,
+            "level_downsamples": [width / dims[0] for dims in level_dimensions],
+            # Los dpi de una imagen genérica no son una resolución física
+            "mpp_x": None,
+            "mpp_y": None,
+            "objective_power": None,
+            "vendor": None,
+            "pil_format": image.format,
+            "mode": image.mode,
+        }
+
+
+def extract_metadata(file_path: str, file_type: str) -> dict:
+    """
+    Lee los metadatos de una lámina. Los SVS requieren OpenSlide; para TIFF
+    se intenta OpenSlide (TIFF piramidales) y si no, Pillow.
+    """
+    file_type = file_type.lower()
+    if file_type == "svs":
+        return _from_openslide(file_path)
+
+    if file_type in ("tif", "tiff"):
+        try:
+            return _from_openslide(file_path, strict=True)
+        except Exception:
+            pass
+
+    return _from_pillow(file_path)
+
+
+def apply_metadata(medical_image, metadata: Optional[dict]) -> None:
+    """Copia los metadatos a las columnas de una MedicalImage"""
+    if not metadata:
+        return
+    for column in METADATA_COLUMNS:
+        setattr(medical_image, column, metadata[column])
+    medical_image.slide_metadata = {
+        key: value for key, value in metadata.items() if key not in METADATA_COLUMNS
+    }
+
+
+def copy_metadata(source, target) -> None:
+    """Copia los metadatos ya extraídos de otra fila (imágenes deduplicadas)"""
+    for column in METADATA_COLUMNS + ("slide_metadata",):
+        setattr(target, column, getattr(source, column))
+
+
+def _backfill() -> None:
+    from .db import SessionLocal
+    from .models import MedicalImage
+
+    db = SessionLocal()
+    try:
+        # Imágenes genéricas (leídas con Pillow) con mpp derivado de los dpi
+        cleared = 0
+        for image in db.query(MedicalImage).filter(MedicalImage.mpp_x != None):
+            if (image.slide_metadata or {}).get("pil_format"):
+                image.mpp_x = image.mpp_y = None
+                cleared += 1
+        if cleared:
+            db.commit()
+            print(f"[slide_metadata] mpp quitado de {cleared} imágenes genéricas")
+
+        images = db.query(MedicalImage).filter(MedicalImage.width == None).all()
+        for image in images:
+            if not os.path.exists(image.file_path):
+                print(f"[slide_metadata] {image.id}: archivo no encontrado, se omite")
+                continue
+            try:
+                apply_metadata(image, extract_metadata(image.file_path, image.file_type))
+            except Exception as e:
+                print(f"[slide_metadata] {image.id}: error leyendo metadatos: {e}")
+                continue
+            db.commit()
+            print(f"[slide_metadata] {image.id}: {image.width}x{image.height}, {image.level_count} niveles")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print("Uso: python -m app.slide_metadata backfill")
+        sys.exit(1)
+    _backfill()
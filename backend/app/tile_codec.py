@@ -0,0 +1,94 @@
+"""
+Perfil de codificación de los tiles DZI, configurable por despliegue.
+
+Variables de entorno:
+  TILE_FORMAT          jpeg o webp (default: jpeg)
+  TILE_QUALITY         calidad por defecto (default: 90)
+  TILE_LEVEL_QUALITY   calidad por nivel contando desde el de mayor resolución,
+                       p. ej. "0:75,1:82" (nivel completo a 75, el siguiente a 82)
+  TILE_SUBSAMPLING     submuestreo de croma JPEG: 4:4:4, 4:2:2 o 4:2:0
+                       (WebP con pérdida siempre usa 4:2:0)
+  TILE_ENCODE_THREADS  hilos de codificación por proceso de tiling (default: 2)
+
+Los niveles de mayor resolución concentran la gran mayoría de los tiles,
+por lo que bajar solo su calidad reduce el tamaño total sin afectar la
+vista general de la lámina.
+
+Cada perfil tiene una versión corta (hash de sus parámetros) que forma parte
+de la URL y del ETag de los tiles: al cambiar el perfil cambian las URLs y los
+navegadores y proxies no siguen usando los tiles anteriores. También forma
+parte de la ruta de los tiles en disco (carpeta y pack), por lo que los
+tiles de otro perfil no se vuelven a servir.
+"""
+import hashlib
+import os
+from io import BytesIO
+from typing import Dict, Optional
+
+TILE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+TILE_ENCODE_THREADS = int(os.getenv("TILE_ENCODE_THREADS", "2"))
+
+
+def _parse_level_quality(value: str) -> Dict[int, int]:
+    level_quality = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        offset, _, quality = part.partition(":")
+        level_quality[int(offset)] = int(quality)
+    return level_quality
+
+
+class TileCodec:
+    def __init__(
+        self,
+        format: str = "jpeg",
+        quality: int = 90,
+        level_quality: Optional[Dict[int, int]] = None,
+        subsampling: Optional[str] = None,
+    ):
+        format = format.lower()
+        if format == "jpg":
+            format = "jpeg"
+        if format not in TILE_FORMATS:
+            raise ValueError(f"Formato de tile no soportado: {format}")
+
+        self.format = format
+        self.quality = quality
+        self.level_quality = level_quality or {}
+        self.subsampling = subsampling or None
+        self.pil_format, self.media_type = TILE_FORMATS[format]
+        profile = repr((format, quality, sorted(self.level_quality.items()), self.subsampling))
+        self.version = hashlib.sha1(profile.encode()).hexdigest()[:8]
+
+    @classmethod
+    def from_env(cls) -> "TileCodec":
+        return cls(
+            format=os.getenv("TILE_FORMAT", "jpeg"),
+            quality=int(os.getenv("TILE_QUALITY", "90")),
+            level_quality=_parse_level_quality(os.getenv("TILE_LEVEL_QUALITY", "")),
+            subsampling=os.getenv("TILE_SUBSAMPLING"),
+        )
+
+    def quality_for(self, level: int, level_count: int) -> int:
+        """Calidad del nivel DZI indicado (el último nivel es el de resolución completa)"""
+        return self.level_quality.get(level_count - 1 - level, self.quality)
+
+    def encode(self, tile, level: int, level_count: int) -> bytes:
+        options = {"quality": self.quality_for(level, level_count)}
+        if self.pil_format == "JPEG" and self.subsampling:
+            options["subsampling"] = self.subsampling
+        if tile.mode not in ("RGB", "L"):
+            tile = tile.convert("RGB")
+
+        buffer = BytesIO()
+        tile.save(buffer, self.pil_format, **options)
+        return buffer.getvalue()
+
+
+tile_codec = TileCodec.from_env()
@@ -0,0 +1,393 @@
+"""
+Formato contenedor de tiles: un archivo de datos por lámina más un índice.
+
+En vez de cientos de miles de JPEG sueltos en
+<uuid>_files/<versión>/<nivel>/<col>_<fila>.jpeg se guardan dos archivos junto
+al descriptor .dzi:
+
+  <stem>.<ver>.tpk  datos: los tiles concatenados, solo se agregan al final
+  <stem>.<ver>.tpi  índice: cabecera con la geometría de la pirámide, un
+                    registro fijo (offset, largo) por tile en orden
+                    nivel/fila/columna y un último registro para el tile de
+                    fondo compartido (ver tissue_mask)
+
+<ver> es la versión del perfil de codificación (ver tile_codec), así un
+cambio de formato o de calidad nunca sirve tiles del perfil anterior.
+
+Como cada tile tiene una posición fija en el índice, la búsqueda es O(1) y la
+lectura es un slice de un archivo mapeado en memoria, sin open() por tile.
+Las escrituras (tile server y procesos de tiling) se serializan con flock.
+
+Uso para convertir carpetas DZI existentes:
+    python -m app.tile_pack convert [--delete]
+"""
+import fcntl
+import glob
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .slide_cache import DZI_DIR, DZI_FORMAT, dzi_paths, dzi_tiles_dir
+from .tile_codec import tile_codec
+
+PACK_MAGIC = b"TPK1"
+_HEADER = struct.Struct("<4sI")      # magic, cantidad de niveles
+_LEVEL = struct.Struct("<II")        # columnas, filas
+_RECORD = struct.Struct("<QI")       # offset, largo (0 = tile ausente)
+
+MAX_OPEN_PACKS = 32
+
+
+def pack_paths(stored_name: str) -> Tuple[str, str]:
+    """Rutas del archivo de datos y del índice de una lámina para el perfil actual"""
+    stem = os.path.splitext(stored_name)[0]
+    return (
+        os.path.join(DZI_DIR, f"{stem}.{tile_codec.version}.tpk"),
+        os.path.join(DZI_DIR, f"{stem}.{tile_codec.version}.tpi"),
+    )
+
+
+def _level_offsets(level_tiles: Sequence[Tuple[int, int]]) -> List[int]:
+    offsets = []
+    total = 0
+    for cols, rows in level_tiles:
+        offsets.append(total)
+        total += cols * rows
+    offsets.append(total)
+    return offsets
+
+
+def _records_start(level_count: int) -> int:
+    return _HEADER.size + level_count * _LEVEL.size
+
+
+def _create_index(index_path: str, level_tiles: Sequence[Tuple[int, int]]) -> None:
+    total = sum(cols * rows for cols, rows in level_tiles)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(PACK_MAGIC, len(level_tiles)))
+        for cols, rows in level_tiles:
+            f.write(_LEVEL.pack(cols, rows))
+        # +1: registro del tile de fondo compartido
+        f.truncate(_records_start(len(level_tiles)) + (total + 1) * _RECORD.size)
+    os.replace(tmp_path, index_path)
+
+
+def _read_geometry(index_file) -> List[Tuple[int, int]]:
+    magic, level_count = _HEADER.unpack(index_file.read(_HEADER.size))
+    if magic != PACK_MAGIC:
+        raise ValueError("Índice de tiles inválido")
+    return [_LEVEL.unpack(index_file.read(_LEVEL.size)) for _ in range(level_count)]
+
+
+def append_tiles(
+    stored_name: str,
+    level_tiles: Sequence[Tuple[int, int]],
+    tiles: Iterable[Tuple[int, int, int, Optional[bytes]]],
+    blank_tile: Optional[bytes] = None,
+) -> None:
+    """
+    Agrega tiles (nivel, col, fila, datos) al pack de una lámina, creándolo
+    si no existe. Los tiles con datos None apuntan al tile de fondo
+    compartido, que se escribe una sola vez por pack. Seguro entre hilos y
+    procesos.
+    """
+    data_path, index_path = pack_paths(stored_name)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+
+    data_fd = os.open(data_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(data_fd, fcntl.LOCK_EX)
+
+        if not os.path.exists(index_path):
+            _create_index(index_path, level_tiles)
+
+        with open(index_path, "r+b") as index_file:
+            geometry = _read_geometry(index_file)
+            offsets = _level_offsets(geometry)
+            records_start = _records_start(len(geometry))
+
+            end = os.fstat(data_fd).st_size
+            blank_record = None
+            for level, col, row, data in tiles:
+                if level >= len(geometry):
+                    continue
+                cols, rows = geometry[level]
+                if col >= cols or row >= rows:
+                    continue
+
+                if data is None:
+                    if blank_record is None:
+                        blank_record, end = _shared_blank(
+                            index_file, records_start, offsets[-1], data_fd, end, blank_tile
+                        )
+                    record = blank_record
+                else:
+                    os.pwrite(data_fd, data, end)
+                    record = (end, len(data))
+                    end += len(data)
+
+                index = offsets[level] + row * cols + col
+                index_file.seek(records_start + index * _RECORD.size)
+                index_file.write(_RECORD.pack(*record))
+    finally:
+        fcntl.flock(data_fd, fcntl.LOCK_UN)
+        os.close(data_fd)
+
+
+def _shared_blank(index_file, records_start: int, total: int, data_fd: int, end: int, blank_tile: bytes):
+    """
+    Registro del tile de fondo compartido; lo escribe si aún no existe.
+    Retorna ((offset, largo), nuevo_fin_de_datos).
+    """
+    slot = records_start + total * _RECORD.size
+    index_file.seek(slot)
+    raw = index_file.read(_RECORD.size)
+    # Los packs creados antes de existir el registro no lo tienen
+    has_slot = len(raw) == _RECORD.size
+    if has_slot:
+        offset, length = _RECORD.unpack(raw)
+        if length:
+            return (offset, length), end
+
+    os.pwrite(data_fd, blank_tile, end)
+    record = (end, len(blank_tile))
+    if has_slot:
+        index_file.seek(slot)
+        index_file.write(_RECORD.pack(*record))
+    return record, end + len(blank_tile)
+
+
+class TilePackReader:
+    """
+    Lector de un pack mapeado en memoria. El índice se mapea compartido,
+    por lo que ve los tiles que otros procesos van agregando; el archivo de
+    datos se vuelve a mapear cuando crece.
+    """
+
+    def __init__(self, data_path: str, index_path: str):
+        self.data_path = data_path
+        self._lock = threading.Lock()
+        # Hilos usándolo; uno expulsado de la caché se cierra al liberarlo el último
+        self.users = 0
+        self.evicted = False
+
+        self._index_file = open(index_path, "rb")
+        self.level_tiles = _read_geometry(self._index_file)
+        self._offsets = _level_offsets(self.level_tiles)
+        self._records_start = _records_start(len(self.level_tiles))
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._data_file = open(data_path, "rb")
+        self._data = None
+        self._remap()
+
+    def _remap(self) -> None:
+        size = os.fstat(self._data_file.fileno()).st_size
+        if self._data is not None:
+            self._data.close()
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def get(self, level: int, col: int, row: int) -> Optional[bytes]:
+        if level < 0 or level >= len(self.level_tiles):
+            return None
+        cols, rows = self.level_tiles[level]
+        if col < 0 or row < 0 or col >= cols or row >= rows:
+            return None
+
+        index = self._offsets[level] + row * cols + col
+        offset, length = _RECORD.unpack_from(self._index, self._records_start + index * _RECORD.size)
+        if length == 0:
+            return None
+
+        with self._lock:
+            if self._data is None or offset + length > len(self._data):
+                self._remap()
+            return self._data[offset:offset + length]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._data is not None:
+                self._data.close()
+            self._index.close()
+            self._data_file.close()
+            self._index_file.close()
+
+
+_readers: "OrderedDict[str, TilePackReader]" = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def _checkout(stored_name: str) -> Optional[TilePackReader]:
+    data_path, index_path = pack_paths(stored_name)
+
+    with _readers_lock:
+        reader = _readers.get(data_path)
+        if reader is not None:
+            _readers.move_to_end(data_path)
+            reader.users += 1
+            return reader
+
+    if not (os.path.exists(data_path) and os.path.exists(index_path)):
+        return None
+
+    reader = TilePackReader(data_path, index_path)
+    with _readers_lock:
+        existing = _readers.get(data_path)
+        if existing is not None:
+            # Otro hilo abrió el mismo pack mientras tanto
+            reader.close()
+            existing.users += 1
+            _readers.move_to_end(data_path)
+            return existing
+        reader.users += 1
+        _readers[data_path] = reader
+        while len(_readers) > MAX_OPEN_PACKS:
+            _, evicted = _readers.popitem(last=False)
+            _retire(evicted)
+    return reader
+
+
+def _retire(reader: TilePackReader) -> None:
+    # Debe llamarse con _readers_lock tomado
+    reader.evicted = True
+    if reader.users == 0:
+        reader.close()
+
+
+def _release(reader: TilePackReader) -> None:
+    with _readers_lock:
+        reader.users -= 1
+        if reader.evicted and reader.users == 0:
+            reader.close()
+
+
+@contextmanager
+def acquire_pack(stored_name: str) -> Iterator[Optional[TilePackReader]]:
+    """
+    Lector (cacheado) del pack de una lámina, o None si no existe. Un lector
+    expulsado de la caché o de un pack eliminado mientras está en uso se
+    cierra recién cuando el último usuario lo libera.
+    """
+    reader = _checkout(stored_name)
+    try:
+        yield reader
+    finally:
+        if reader is not None:
+            _release(reader)
+
+
+def delete_pack(stored_name: str) -> None:
+    """Elimina los packs de una lámina de todos los perfiles de codificación"""
+    stem = glob.escape(os.path.splitext(stored_name)[0])
+    for data_path in glob.glob(os.path.join(DZI_DIR, f"{stem}.*.tpk")):
+        with _readers_lock:
+            reader = _readers.pop(data_path, None)
+            if reader is not None:
+                _retire(reader)
+        index_path = data_path[: -len(".tpk")] + ".tpi"
+        for path in (data_path, index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+_TILE_NAME = re.compile(r"^(\d+)_(\d+)\." + DZI_FORMAT + "$")
+
+
+def dzi_level_tiles(width: int, height: int, tile_size: int) -> List[Tuple[int, int]]:
+    """Columnas y filas de cada nivel Deep Zoom (del 1x1 al tamaño completo), como DeepZoomGenerator"""
+    dimensions = [(width, height)]
+    while dimensions[-1] != (1, 1):
+        last_width, last_height = dimensions[-1]
+        dimensions.append((max(1, math.ceil(last_width / 2)), max(1, math.ceil(last_height / 2))))
+    return [
+        (math.ceil(level_width / tile_size), math.ceil(level_height / tile_size))
+        for level_width, level_height in reversed(dimensions)
+    ]
+
+
+def _descriptor_level_tiles(dzi_path: str) -> List[Tuple[int, int]]:
+    """Geometría de la pirámide según el descriptor .dzi"""
+    root = ET.parse(dzi_path).getroot()
+    size = next(element for element in root if element.tag.endswith("Size"))
+    return dzi_level_tiles(int(size.get("Width")), int(size.get("Height")), int(root.get("TileSize")))
+
+
+def convert_dzi_folder(tiles_dir: str, delete_folder: bool = False) -> int:
+    """
+    Convierte una carpeta <stem>_files/<versión>/<nivel>/<col>_<fila>.jpeg
+    del perfil actual en un pack.
+    La geometría se toma del descriptor <stem>.dzi, no de los tiles
+    presentes: una carpeta parcial o sin los tiles de fondo daría una
+    pirámide más chica y append_tiles descartaría después los tiles que
+    quedan fuera. Retorna los tiles copiados; lanza FileNotFoundError si no
+    hay descriptor.
+    """
+    stored_name = os.path.basename(os.path.dirname(tiles_dir.rstrip(os.sep)))[: -len("_files")]
+    dzi_path, _ = dzi_paths(stored_name)
+    if not os.path.exists(dzi_path):
+        raise FileNotFoundError(f"No existe el descriptor {dzi_path}")
+    level_tiles = _descriptor_level_tiles(dzi_path)
+
+    levels = {}
+    for entry in os.listdir(tiles_dir):
+        if entry.isdigit():
+            level_dir = os.path.join(tiles_dir, entry)
+            names = [m for m in (_TILE_NAME.match(n) for n in os.listdir(level_dir)) if m]
+            levels[int(entry)] = [(int(m.group(1)), int(m.group(2)), m.group(0)) for m in names]
+
+    if not levels:
+        return 0
+
+    count = 0
+    for level, tiles in sorted(levels.items()):
+        level_dir = os.path.join(tiles_dir, str(level))
+        batch = []
+        for col, row, name in sorted(tiles, key=lambda t: (t[1], t[0])):
+            with open(os.path.join(level_dir, name), "rb") as f:
+                batch.append((level, col, row, f.read()))
+        append_tiles(stored_name, level_tiles, batch)
+        count += len(batch)
+
+    if delete_folder:
+        shutil.rmtree(tiles_dir)
+
+    return count
+
+
+def _convert_all(delete_folder: bool) -> None:
+    for entry in sorted(os.listdir(DZI_DIR)):
+        if not (entry.endswith("_files") and os.path.isdir(os.path.join(DZI_DIR, entry))):
+            continue
+        # Solo se convierten los tiles del perfil de codificación actual
+        stored_name = entry[: -len("_files")]
+        tiles_dir = dzi_tiles_dir(stored_name)
+        if not os.path.isdir(tiles_dir):
+            print(f"[tile_pack] {entry}: sin tiles del perfil actual, se omite")
+            continue
+        data_path, _ = pack_paths(stored_name)
+        if os.path.exists(data_path):
+            print(f"[tile_pack] {entry}: ya tiene pack, se omite")
+            continue
+        try:
+            count = convert_dzi_folder(tiles_dir, delete_folder)
+        except FileNotFoundError as e:
+            print(f"[tile_pack] {entry}: {e}, se omite")
+            continue
+        print(f"[tile_pack] {entry}: {count} tiles convertidos")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "convert":
+        print("Uso: python -m app.tile_pack convert [--delete]")
+        sys.exit(1)
+    _convert_all(delete_folder="--delete" in sys.argv[2:])
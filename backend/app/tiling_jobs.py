@@ -0,0 +1,301 @@
+"""
+Trabajos de tiling DZI en segundo plano.
+
+La subida de una lámina solo encola un TilingJob; un hilo coordinador reparte
+las filas de cada nivel entre un pool de procesos (ver tiling_worker) y va
+registrando en la BD qué filas quedaron terminadas. Si el servidor se reinicia
+a mitad de un trabajo, al arrancar se retoma saltando las filas ya completas.
+
+Antes de repartir las filas se calcula la máscara de tejido de la lámina (ver
+tissue_mask); los tiles de fondo no se codifican.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from .db import SessionLocal
+from .models import MedicalImage, TilingJob
+from .tiling_worker import tile_row
+from .tissue_mask import TISSUE_MASK, compute_tissue_mask, save_mask, tissue_tiles
+
+TILING_WORKERS = int(os.getenv("TILING_WORKERS", str(os.cpu_count() or 1)))
+TILING_ON_UPLOAD = os.getenv("TILING_ON_UPLOAD", "true").lower() in ("1", "true", "yes")
+
+# Cada cuántos segundos se guarda el progreso en la BD
+PROGRESS_FLUSH_SECONDS = 2.0
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# Trabajos con hilo coordinador activo en este proceso y los cancelados
+_running_jobs = set()
+_cancelled_jobs = set()
+_jobs_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn evita heredar el estado (hilos, conexiones) del servidor
+            _executor = ProcessPoolExecutor(
+                max_workers=TILING_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def shutdown_tiling_pool() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def enqueue_tiling_job(image_id: int) -> int:
+    """
+    Crea un trabajo de tiling para la imagen (o reutiliza uno sin terminar)
+    y lo lanza en segundo plano. Retorna el id del trabajo.
+    """
+    job_id = create_tiling_job(image_id)
+    start_job(job_id)
+    return job_id
+
+
+def create_tiling_job(image_id: int) -> int:
+    """
+    Crea un trabajo pendiente para la imagen, o reutiliza uno sin terminar
+    conservando sus filas completas, sin lanzarlo. Retorna el id del trabajo.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(TilingJob).filter(
+            TilingJob.image_id == image_id,
+            TilingJob.status.in_(["pending", "running", "failed"])
+        ).order_by(TilingJob.id.desc()).first()
+
+        if job is None:
+            job = TilingJob(image_id=image_id, status="pending", completed_rows=[])
+            db.add(job)
+        else:
+            # Reanudar un trabajo previo conservando las filas ya terminadas
+            job.status = "pending"
+            job.error = None
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def start_job(job_id: int) -> None:
+    with _jobs_lock:
+        if job_id in _running_jobs:
+            return
+        _running_jobs.add(job_id)
+        _cancelled_jobs.discard(job_id)
+
+    thread = threading.Thread(target=_run_job, args=(job_id,), daemon=True, name=f"tiling-{job_id}")
+    thread.start()
+
+
+def run_job(job_id: int) -> None:
+    """
+    Ejecuta un trabajo en el hilo actual y retorna al terminar
+    (lo usa la importación masiva para limitar los trabajos simultáneos).
+    """
+    with _jobs_lock:
+        if job_id in _running_jobs:
+            return
+        _running_jobs.add(job_id)
+        _cancelled_jobs.discard(job_id)
+
+    _run_job(job_id)
+
+
+def cancel_jobs_for_image(image_id: int, db) -> None:
+    """Marca como cancelados los trabajos en curso de una imagen"""
+    jobs = db.query(TilingJob.id).filter(
+        TilingJob.image_id == image_id,
+        TilingJob.status.in_(["pending", "running"])
+    ).all()
+    with _jobs_lock:
+        for (job_id,) in jobs:
+            _cancelled_jobs.add(job_id)
+
+
+def resume_pending_jobs() -> None:
+    """
+    Retoma los trabajos que quedaron pendientes o a medias
+    (por ejemplo, tras un reinicio del servidor).
+    """
+    db = SessionLocal()
+    try:
+        job_ids = [
+            job_id for (job_id,) in db.query(TilingJob.id).filter(
+                TilingJob.status.in_(["pending", "running"])
+            ).all()
+        ]
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        print(f"[tiling] Reanudando trabajo {job_id}")
+        start_job(job_id)
+
+
+def _is_cancelled(job_id: int) -> bool:
+    with _jobs_lock:
+        return job_id in _cancelled_jobs
+
+
+def _tissue_columns(image: MedicalImage, db, slide_size, level_tiles):
+    """
+    Calcula y guarda la máscara de tejido de la lámina y retorna
+    (columnas_con_tejido[nivel][fila], color_de_fondo). Si la máscara está
+    desactivada o falla, retorna (None, blanco) y se generan todos los tiles.
+    """
+    if not TISSUE_MASK:
+        return None, (255, 255, 255)
+
+    from .slide_cache import DZI_TILE_SIZE, DZI_OVERLAP
+
+    try:
+        mask, background = compute_tissue_mask(image.file_path)
+        save_mask(image.stored_name, mask)
+    except Exception as e:
+        print(f"[tiling] No se pudo calcular la máscara de tejido de la imagen {image.id}: {e}")
+        return None, (255, 255, 255)
+
+    # Los registros deduplicados comparten archivo y máscara
+    db.query(MedicalImage).filter(MedicalImage.file_path == image.file_path).update(
+        {MedicalImage.tissue_fraction: round(float(mask.mean()), 4)}, synchronize_session=False
+    )
+    db.commit()
+
+    columns = []
+    for level, tiles in enumerate(level_tiles):
+        grid = tissue_tiles(mask, slide_size, level, len(level_tiles), tiles, DZI_TILE_SIZE, DZI_OVERLAP)
+        columns.append([np.flatnonzero(row).tolist() for row in grid])
+    return columns, background
+
+
+def _run_job(job_id: int) -> None:
+    db = SessionLocal()
+    try:
+        job = db.query(TilingJob).filter(TilingJob.id == job_id).first()
+        if job is None:
+            return
+        image = db.query(MedicalImage).filter(MedicalImage.id == job.image_id).first()
+        if image is None or not os.path.exists(image.file_path):
+            job.status = "failed"
+            job.error = "Imagen no encontrada"
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            return
+
+        import openslide
+        from openslide import deepzoom
+        from .slide_cache import DZI_TILE_SIZE, DZI_OVERLAP
+
+        # Solo se necesita la geometría de la pirámide; los tiles los generan los workers
+        slide = openslide.open_slide(image.file_path)
+        try:
+            slide_size = slide.dimensions
+            generator = deepzoom.DeepZoomGenerator(slide, tile_size=DZI_TILE_SIZE, overlap=DZI_OVERLAP)
+            level_tiles = list(generator.level_tiles)
+        finally:
+            slide.close()
+
+        # Columnas con tejido de cada fila; None = generar la fila completa
+        tissue_cols, background = _tissue_columns(image, db, slide_size, level_tiles)
+
+        completed = set(job.completed_rows or [])
+
+        # Niveles de menor resolución primero: son baratos y dan una vista general rápida
+        pending_rows = [
+            (level, row)
+            for level, (_, rows) in enumerate(level_tiles)
+            for row in range(rows)
+            if f"{level}:{row}" not in completed
+        ]
+
+        def skipped_in_row(level: int, row: int) -> int:
+            if tissue_cols is None:
+                return 0
+            return level_tiles[level][0] - len(tissue_cols[level][row])
+
+        job.status = "running"
+        job.total_tiles = sum(cols * rows for cols, rows in level_tiles)
+        job.done_tiles = sum(
+            level_tiles[int(key.split(":")[0])][0] for key in completed
+        )
+        job.skipped_tiles = sum(
+            skipped_in_row(*(int(part) for part in key.split(":"))) for key in completed
+        )
+        job.started_at = job.started_at or datetime.utcnow()
+        db.commit()
+
+        print(f"[tiling] Trabajo {job_id}: {len(pending_rows)} filas pendientes "
+              f"({len(completed)} ya terminadas) con {TILING_WORKERS} procesos")
+
+        executor = _get_executor()
+        futures = [
+            executor.submit(
+                tile_row, image.file_path, image.stored_name, level, row,
+                tissue_cols[level][row] if tissue_cols is not None else None,
+                background
+            )
+            for level, row in pending_rows
+        ]
+
+        last_flush = time.monotonic()
+        for future in as_completed(futures):
+            if _is_cancelled(job_id):
+                for pending in futures:
+                    pending.cancel()
+                job.status = "cancelled"
+                job.finished_at = datetime.utcnow()
+                db.commit()
+                return
+
+            level, row, count = future.result()
+            completed.add(f"{level}:{row}")
+            job.done_tiles += count
+            job.skipped_tiles += skipped_in_row(level, row)
+
+            if time.monotonic() - last_flush >= PROGRESS_FLUSH_SECONDS:
+                job.completed_rows = sorted(completed)
+                db.commit()
+                last_flush = time.monotonic()
+
+        job.completed_rows = sorted(completed)
+        job.status = "done"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        print(f"[tiling] Trabajo {job_id} terminado: {job.done_tiles} tiles "
+              f"({job.skipped_tiles} de fondo)")
+
+    except Exception as e:
+        db.rollback()
+        if _is_cancelled(job_id):
+            # La imagen se eliminó mientras se procesaba
+            return
+        print(f"[tiling] Error en trabajo {job_id}: {e}")
+        job = db.query(TilingJob).filter(TilingJob.id == job_id).first()
+        if job is not None:
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.commit()
+    finally:
+        db.close()
+        with _jobs_lock:
+            _running_jobs.discard(job_id)
+            _cancelled_jobs.discard(job_id)
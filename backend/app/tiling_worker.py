@@ -0,0 +1,166 @@
+"""
+Funciones que se ejecutan dentro de los procesos del pool de tiling.
+
+Este módulo se importa en cada proceso worker, por lo que solo depende de
+OpenSlide/Pillow y de los parámetros de tiles (nada de BD ni de FastAPI).
+Cada worker mantiene sus propios handles OpenSlide abiertos.
+"""
+import os
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, Tuple
+
+from .slide_cache import DZI_TILE_SIZE, DZI_OVERLAP, DZI_FORMAT, TILE_STORAGE, dzi_paths, dzi_tiles_dir
+from .tile_codec import tile_codec, TILE_ENCODE_THREADS
+from .tile_pack import append_tiles, delete_pack
+
+# Handles abiertos en este proceso: file_path -> (slide, generator)
+_WORKER_SLIDES = OrderedDict()
+_WORKER_MAX_SLIDES = 2
+
+# Pillow y OpenSlide liberan el GIL al leer y codificar, así que cada proceso
+# usa unos pocos hilos para solapar la lectura y codificación de una fila
+_encoder: ThreadPoolExecutor = None
+
+# Tile de fondo ya codificado, por color
+_blank_tiles = {}
+
+
+def _get_generator(file_path: str):
+    entry = _WORKER_SLIDES.get(file_path)
+    if entry is not None:
+        _WORKER_SLIDES.move_to_end(file_path)
+        return entry[1]
+
+    import openslide
+    from openslide import deepzoom
+
+    slide = openslide.open_slide(file_path)
+    generator = deepzoom.DeepZoomGenerator(slide, tile_size=DZI_TILE_SIZE, overlap=DZI_OVERLAP)
+    _WORKER_SLIDES[file_path] = (slide, generator)
+
+    while len(_WORKER_SLIDES) > _WORKER_MAX_SLIDES:
+        _, (old_slide, _) = _WORKER_SLIDES.popitem(last=False)
+        old_slide.close()
+
+    return generator
+
+
+def _get_encoder() -> ThreadPoolExecutor:
+    global _encoder
+    if _encoder is None:
+        _encoder = ThreadPoolExecutor(max_workers=TILE_ENCODE_THREADS)
+    return _encoder
+
+
+def _render_tile(generator, level: int, col: int, row: int) -> bytes:
+    tile = generator.get_tile(level, (col, row))
+    return tile_codec.encode(tile, level, generator.level_count)
+
+
+def _blank_tile(background: Tuple[int, int, int]) -> bytes:
+    """Tile de fondo compartido, codificado con el perfil activo"""
+    data = _blank_tiles.get(background)
+    if data is None:
+        from PIL import Image as PILImage
+
+        side = DZI_TILE_SIZE + 2 * DZI_OVERLAP
+        tile = PILImage.new("RGB", (side, side), background)
+        # Calidad del nivel de resolución completa
+        data = _blank_tiles[background] = tile_codec.encode(tile, 0, 1)
+    return data
+
+
+def _write_file(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _link_blank(tiles_dir: str, tile_path: str, background: Tuple[int, int, int]) -> None:
+    """Enlaza (hard link) el tile de fondo compartido de la lámina"""
+    blank_path = os.path.join(tiles_dir, f"blank.{DZI_FORMAT}")
+    if not os.path.exists(blank_path):
+        _write_file(blank_path, _blank_tile(background))
+
+    tmp_path = f"{tile_path}.{os.getpid()}.tmp"
+    try:
+        os.link(blank_path, tmp_path)
+    except OSError:
+        # Sistemas de archivos sin hard links: se copia
+        _write_file(tile_path, _blank_tile(background))
+        return
+    os.replace(tmp_path, tile_path)
+
+
+def _discard_if_deleted(file_path: str, stored_name: str) -> bool:
+    """
+    Al eliminar una lámina se borra el archivo antes que los tiles; si ya no
+    está, se quitan los tiles que esta fila pudo recrear después del borrado
+    (la cancelación solo detiene las filas que no empezaron)
+    """
+    if os.path.exists(file_path):
+        return False
+    _, tiles_root = dzi_paths(stored_name)
+    shutil.rmtree(tiles_root, ignore_errors=True)
+    delete_pack(stored_name)
+    return True
+
+
+def tile_row(
+    file_path: str,
+    stored_name: str,
+    level: int,
+    row: int,
+    tissue_cols: Optional[Sequence[int]] = None,
+    background: Tuple[int, int, int] = (255, 255, 255),
+):
+    """
+    Genera los tiles de una fila de un nivel.
+    Si se indica tissue_cols, solo se codifican esas columnas y el resto
+    apunta al tile de fondo compartido.
+    Con almacenamiento "files" cada tile se escribe de forma atómica; con
+    "pack" la fila completa se agrega al pack en una sola escritura. En ambos
+    casos una fila interrumpida puede repetirse sin problemas.
+    Si la lámina se eliminó mientras tanto no queda nada escrito.
+    Retorna (level, row, cantidad_de_tiles).
+    """
+    if not os.path.exists(file_path):
+        return level, row, 0
+    generator = _get_generator(file_path)
+    cols, _ = generator.level_tiles[level]
+    render_cols = range(cols) if tissue_cols is None else sorted(tissue_cols)
+
+    encoded = dict(zip(render_cols, _get_encoder().map(
+        lambda col: _render_tile(generator, level, col, row), render_cols
+    )))
+
+    if TILE_STORAGE == "pack":
+        batch = [(level, col, row, encoded.get(col)) for col in range(cols)]
+        append_tiles(stored_name, generator.level_tiles, batch, _blank_tile(background))
+        if _discard_if_deleted(file_path, stored_name):
+            return level, row, 0
+        return level, row, cols
+
+    tiles_dir = dzi_tiles_dir(stored_name)
+    level_dir = os.path.join(tiles_dir, str(level))
+    try:
+        os.makedirs(level_dir, exist_ok=True)
+        for col in range(cols):
+            tile_path = os.path.join(level_dir, f"{col}_{row}.{DZI_FORMAT}")
+            data = encoded.get(col)
+            if data is None:
+                _link_blank(tiles_dir, tile_path, background)
+            else:
+                _write_file(tile_path, data)
+    except OSError:
+        # El borrado de la lámina pudo quitar la carpeta a mitad de la fila
+        if _discard_if_deleted(file_path, stored_name):
+            return level, row, 0
+        raise
+
+    if _discard_if_deleted(file_path, stored_name):
+        return level, row, 0
+    return level, row, cols
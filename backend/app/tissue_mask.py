@@ -0,0 +1,172 @@
+"""
+Detección de tejido para el tiling DZI.
+
+La mayor parte de una lámina es vidrio vacío. Antes de generar los tiles se
+calcula una máscara de tejido sobre una miniatura de la lámina (saturación
+HSV con umbral de Otsu, todo vectorizado con NumPy); los tiles que caen
+completamente en el fondo no se codifican y apuntan a un único tile en
+blanco compartido.
+
+La máscara se guarda como PNG en uploads/tissue_masks (blanco = tejido) para
+que otros consumidores la reutilicen; su escala respecto de la resolución
+completa es ancho_lámina / ancho_máscara.
+
+Variables de entorno:
+  TISSUE_MASK             usar la máscara al generar tiles (default: true)
+  TISSUE_MASK_SIZE        lado máximo de la miniatura analizada (default: 2048)
+  TISSUE_MIN_SATURATION   saturación mínima considerada tejido (default: 0.05)
+"""
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+TISSUE_MASK = os.getenv("TISSUE_MASK", "true").lower() in ("1", "true", "yes")
+TISSUE_MASK_SIZE = int(os.getenv("TISSUE_MASK_SIZE", "2048"))
+TISSUE_MIN_SATURATION = float(os.getenv("TISSUE_MIN_SATURATION", "0.05"))
+
+MASK_DIR = "uploads/tissue_masks"
+
+# Pixeles casi blancos o casi negros (vidrio, bordes del escaneo) nunca son tejido
+_MAX_BRIGHTNESS = 0.94
+_MIN_BRIGHTNESS = 0.08
+
+os.makedirs(MASK_DIR, exist_ok=True)
+
+
+def mask_path(stored_name: str) -> str:
+    stem = os.path.splitext(stored_name)[0]
+    return os.path.join(MASK_DIR, f"{stem}_tissue.png")
+
+
+def otsu_threshold(values: np.ndarray, bins: int = 256) -> float:
+    """Umbral de Otsu de valores en [0, 1]"""
+    hist, edges = np.histogram(values, bins=bins, range=(0.0, 1.0))
+    hist = hist.astype(np.float64)
+    centers = (edges[:-1] + edges[1:]) / 2
+
+    weight_low = np.cumsum(hist)
+    weight_high = weight_low[-1] - weight_low
+    sum_low = np.cumsum(hist * centers)
+    mean_low = sum_low / np.maximum(weight_low, 1)
+    mean_high = (sum_low[-1] - sum_low) / np.maximum(weight_high, 1)
+
+    between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return float(edges[int(np.argmax(between)) + 1])
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    """Dilatación 3x3, para no recortar los bordes del tejido"""
+    padded = np.pad(mask, 1)
+    height, width = mask.shape
+    result = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            result |= padded[dy:dy + height, dx:dx + width]
+    return result
+
+
+def detect_tissue(rgb: np.ndarray) -> Tuple[np.ndarray, Tuple[int, int, int]]:
+    """
+    Máscara booleana de tejido de una imagen RGB (alto x ancho x 3) y el
+    color mediano del fondo, que se usa para el tile en blanco compartido.
+    """
+    pixels = rgb.astype(np.float32) / 255.0
+    brightness = pixels.max(axis=2)
+    saturation = (brightness - pixels.min(axis=2)) / np.maximum(brightness, 1e-6)
+
+    candidates = (brightness < _MAX_BRIGHTNESS) & (brightness > _MIN_BRIGHTNESS)
+    threshold = TISSUE_MIN_SATURATION
+    if candidates.any():
+        threshold = max(otsu_threshold(saturation[candidates]), TISSUE_MIN_SATURATION)
+
+    mask = _dilate(candidates & (saturation >= threshold))
+
+    background = rgb[~mask]
+    if len(background):
+        color = tuple(int(c) for c in np.median(background, axis=0))
+    else:
+        color = (255, 255, 255)
+    return mask, color
+
+
+def compute_tissue_mask(file_path: str) -> Tuple[np.ndarray, Tuple[int, int, int]]:
+    """Calcula la máscara a partir de una miniatura del nivel más cercano"""
+    import openslide
+
+    slide = openslide.open_slide(file_path)
+    try:
+        thumbnail = slide.get_thumbnail((TISSUE_MASK_SIZE, TISSUE_MASK_SIZE))
+    finally:
+        slide.close()
+    return detect_tissue(np.asarray(thumbnail.convert("RGB")))
+
+
+def save_mask(stored_name: str, mask: np.ndarray) -> str:
+    from PIL import Image as PILImage
+
+    path = mask_path(stored_name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    PILImage.fromarray(mask.astype(np.uint8) * 255).save(tmp_path, "PNG")
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_mask(stored_name: str) -> Optional[np.ndarray]:
+    path = mask_path(stored_name)
+    if not os.path.exists(path):
+        return None
+    from PIL import Image as PILImage
+
+    with PILImage.open(path) as image:
+        return np.asarray(image.convert("L")) > 127
+
+
+def delete_mask(stored_name: str) -> None:
+    path = mask_path(stored_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def tissue_tiles(
+    mask: np.ndarray,
+    slide_size: Tuple[int, int],
+    level: int,
+    level_count: int,
+    level_tiles: Tuple[int, int],
+    tile_size: int,
+    overlap: int,
+) -> np.ndarray:
+    """
+    Matriz booleana (filas x columnas) con los tiles de un nivel DZI que
+    contienen tejido. Usa una tabla de sumas acumuladas de la máscara, así
+    cada tile se resuelve con cuatro lecturas.
+    """
+    cols, rows = level_tiles
+    mask_height, mask_width = mask.shape
+    # Escala de la máscara respecto del nivel DZI
+    level_scale = 2 ** (level_count - 1 - level)
+    scale_x = level_scale * mask_width / slide_size[0]
+    scale_y = level_scale * mask_height / slide_size[1]
+
+    def bounds(count: int, scale: float, limit: int):
+        index = np.arange(count)
+        start = np.maximum(index * tile_size - overlap, 0) * scale
+        end = ((index + 1) * tile_size + overlap) * scale
+        start = np.clip(np.floor(start).astype(np.int64), 0, limit - 1)
+        end = np.clip(np.ceil(end).astype(np.int64), start + 1, limit)
+        return start, end
+
+    x0, x1 = bounds(cols, scale_x, mask_width)
+    y0, y1 = bounds(rows, scale_y, mask_height)
+
+    summed = np.zeros((mask_height + 1, mask_width + 1), dtype=np.int64)
+    summed[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+
+    counts = (
+        summed[y1[:, None], x1[None, :]]
+        - summed[y0[:, None], x1[None, :]]
+        - summed[y1[:, None], x0[None, :]]
+        + summed[y0[:, None], x0[None, :]]
+    )
+    return counts > 0
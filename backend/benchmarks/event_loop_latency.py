@@ -0,0 +1,157 @@
+"""
+Benchmark de latencia del event loop bajo carga de imágenes médicas.
+
+Mide p50/p95/p99 de /health y /api/cases primero en reposo y luego mientras
+otros clientes piden previews y regiones de láminas y suben archivos. Si el
+trabajo pesado sale del event loop, las latencias de ambas fases deben ser
+similares.
+
+Uso (con el backend corriendo):
+    python benchmarks/event_loop_latency.py --url http://localhost:8001 --image-id 1
+
+Sin --image-id solo se genera carga de subidas. La carga corre en otro
+proceso para no afectar las mediciones, y las imágenes subidas por el
+benchmark se eliminan al terminar.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from typing import Dict, List
+
+import httpx
+
+PROBE_PATHS = ("/health", "/api/cases")
+IMAGES_PREFIX = "/api/medical-images"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def probe(client: httpx.AsyncClient, path: str, duration: float, interval: float) -> List[float]:
+    """Pide la ruta a intervalos fijos y retorna las latencias en ms"""
+    latencies = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        response = await client.get(path)
+        latencies.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def preview_load(client: httpx.AsyncClient, image_id: int, stop, counter: Dict[str, int]):
+    """Previews de todos los tamaños y regiones aleatorias (sin caché)"""
+    info = (await client.get(f"{IMAGES_PREFIX}/info/{image_id}")).json()
+    width, height = info.get("width") or 4096, info.get("height") or 4096
+    while not stop.is_set():
+        size = random.choice((256, 1024, 4096))
+        await client.get(f"{IMAGES_PREFIX}/view/{image_id}", params={"size": size})
+        side = 1024
+        await client.get(f"{IMAGES_PREFIX}/{image_id}/region", params={
+            "x": random.randint(0, max(width - side, 0)),
+            "y": random.randint(0, max(height - side, 0)),
+            "w": side, "h": side, "level": 0, "format": "png",
+        })
+        counter["previews"] += 1
+
+
+async def upload_load(
+    client: httpx.AsyncClient,
+    size_mb: int,
+    stop,
+    counter: Dict[str, int],
+    uploaded: List[int],
+):
+    """Sube archivos aleatorios (contenido distinto cada vez, sin deduplicar)"""
+    body = os.urandom(size_mb * 1024 * 1024)
+    while not stop.is_set():
+        payload = os.urandom(16) + body
+        response = await client.post(
+            f"{IMAGES_PREFIX}/upload",
+            files={"file": ("benchmark.jpg", payload, "image/jpeg")},
+            data={"title": "benchmark"},
+        )
+        if response.status_code == 200:
+            uploaded.append(response.json()["id"])
+        counter["uploads"] += 1
+
+
+async def generate_load(args, stop) -> None:
+    counter = {"previews": 0, "uploads": 0}
+    uploaded: List[int] = []
+    limits = httpx.Limits(max_connections=args.preview_clients + args.upload_clients)
+    async with httpx.AsyncClient(base_url=args.url, timeout=httpx.Timeout(300.0), limits=limits) as client:
+        load = []
+        if args.image_id is not None:
+            load += [preview_load(client, args.image_id, stop, counter) for _ in range(args.preview_clients)]
+        load += [
+            upload_load(client, args.upload_mb, stop, counter, uploaded)
+            for _ in range(args.upload_clients)
+        ]
+        await asyncio.gather(*load, return_exceptions=True)
+        for image_id in uploaded:
+            await client.delete(f"{IMAGES_PREFIX}/{image_id}")
+    print(f"  carga completada: {counter['previews']} previews/regiones, {counter['uploads']} subidas")
+
+
+def _load_process(args, stop) -> None:
+    asyncio.run(generate_load(args, stop))
+
+
+async def run_phase(client: httpx.AsyncClient, args, with_load: bool) -> Dict[str, List[float]]:
+    process = None
+    if with_load:
+        stop = multiprocessing.Event()
+        process = multiprocessing.Process(target=_load_process, args=(args, stop))
+        process.start()
+        # Dar tiempo a que la carga empiece antes de medir
+        await asyncio.sleep(2.0)
+
+    results = await asyncio.gather(*[
+        probe(client, path, args.duration, args.interval) for path in PROBE_PATHS
+    ])
+
+    if process is not None:
+        stop.set()
+        await asyncio.to_thread(process.join)
+    return dict(zip(PROBE_PATHS, results))
+
+
+def report(title: str, results: Dict[str, List[float]]) -> None:
+    print(title)
+    for path, latencies in results.items():
+        print(
+            f"  {path:<12} n={len(latencies):<5} "
+            f"p50={statistics.median(latencies):7.1f}ms "
+            f"p95={percentile(latencies, 0.95):7.1f}ms "
+            f"p99={percentile(latencies, 0.99):7.1f}ms "
+            f"max={max(latencies):7.1f}ms"
+        )
+
+
+async def main(args) -> None:
+    async with httpx.AsyncClient(base_url=args.url, timeout=httpx.Timeout(60.0)) as client:
+        baseline = await run_phase(client, args, with_load=False)
+        report("En reposo:", baseline)
+        loaded = await run_phase(client, args, with_load=True)
+        report("Con previews y subidas en curso:", loaded)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--image-id", type=int, help="lámina usada para previews y regiones")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos de medición por fase")
+    parser.add_argument("--interval", type=float, default=0.05, help="pausa entre sondas")
+    parser.add_argument("--preview-clients", type=int, default=8)
+    parser.add_argument("--upload-clients", type=int, default=2)
+    parser.add_argument("--upload-mb", type=int, default=64)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,210 @@
+"""
+Servidores simulados de Ollama y Rasa para pruebas de carga sin GPU ni red.
+
+Un solo proceso atiende:
+  POST /api/chat                  Ollama, con y sin streaming (NDJSON)
+  GET  /api/tags                  Ollama, modelos "descargados"
+  POST /webhooks/rest/webhook     Rasa REST
+
+Cuando la petición pide "format": "json" (generación SCT) responde un JSON
+de ítems SCT con la cantidad pedida en el prompt ("Genera ahora N ítems");
+si no, una respuesta de chat fija. Las respuestas incluyen los tiempos que
+informa Ollama (prompt_eval_count, eval_duration, etc.).
+
+La latencia, la velocidad de generación y los errores son configurables y,
+con la misma --seed y el mismo orden de peticiones, reproducibles.
+
+Uso:
+    python benchmarks/fake_services.py --port 11434 --latency lognormal:300:0.5 \\
+        --tokens-per-second 40 --error-rate 0.02 --malformed-rate 0.1
+
+    OLLAMA_URL=http://localhost:11434
+    RASA_URL=http://localhost:11434/webhooks/rest/webhook
+
+Distribuciones de latencia (ms): "200" (fija), "uniform:100:400",
+"exp:200" (media) o "lognormal:200:0.5" (mediana y sigma).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import re
+import time
+from typing import Callable, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MODEL = "llama3:8b"
+CHAT_ANSWER = (
+    "La tuberculosis es una enfermedad infecciosa causada por Mycobacterium "
+    "tuberculosis que afecta principalmente a los pulmones. Se transmite por "
+    "vía aérea y se trata con un esquema de varios fármacos durante al menos "
+    "seis meses."
+)
+# Combinaciones para que los ítems simulados no se descarten como duplicados
+AGES = (24, 31, 38, 45, 52, 59, 66, 73)
+SYMPTOMS = (
+    "tos productiva de tres semanas", "fiebre vespertina y sudoración nocturna",
+    "baja de peso de cinco kilos", "hemoptisis escasa", "disnea progresiva",
+    "dolor pleurítico derecho", "adenopatías cervicales", "astenia y anorexia",
+)
+CONTEXTS = (
+    "contacto intradomiciliario con TB", "infección por VIH sin tratamiento",
+    "diabetes mal controlada", "privado de libertad", "migrante reciente",
+    "trabajador de salud", "uso de corticoides", "alcoholismo crónico",
+)
+FINDINGS = (
+    "baciloscopía positiva", "radiografía con cavitación apical",
+    "PCR GeneXpert negativa", "derrame pleural linfocitario",
+    "IGRA positivo", "TAC con árbol en brote",
+)
+
+
+def latency_sampler(spec: str, rng: random.Random) -> Callable[[], float]:
+    """Convierte "lognormal:200:0.5" y similares en una función que retorna segundos"""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":") if value]
+    if not values:
+        fixed = float(kind) / 1000
+        return lambda: fixed
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1]) / 1000
+    if kind == "exp":
+        return lambda: rng.expovariate(1 / values[0]) / 1000
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: rng.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"Distribución de latencia desconocida: {spec}")
+
+
+def sct_items(count: int, counter: Callable[[], int]) -> List[dict]:
+    items = []
+    for _ in range(count):
+        n = counter()
+        items.append({
+            "vignette": (
+                f"Paciente de {AGES[n % len(AGES)]} años con {SYMPTOMS[n % len(SYMPTOMS)]}, "
+                f"{CONTEXTS[(n // len(SYMPTOMS)) % len(CONTEXTS)]}. Caso simulado número {n}."
+            ),
+            "hypothesis": "Tuberculosis pulmonar activa",
+            "new_info": f"Se informa {FINDINGS[n % len(FINDINGS)]} (control {n}).",
+            "correct_answer": (n % 5) - 2,
+            "explanation": "Ítem generado por el servidor simulado para pruebas de carga.",
+        })
+    return items
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI(title="Ollama/Rasa simulados")
+    rng = random.Random(args.seed)
+    latency = latency_sampler(args.latency, rng)
+    rasa_latency = latency_sampler(args.rasa_latency, rng)
+    counter = itertools.count().__next__
+
+    def inject_error():
+        if rng.random() < args.error_rate:
+            return JSONResponse({"error": "error simulado"}, status_code=args.error_status)
+        return None
+
+    def answer_for(body: dict) -> str:
+        if body.get("format") != "json":
+            return CHAT_ANSWER
+        prompt = (body.get("messages") or [{}])[-1].get("content", "")
+        match = re.search(r"Genera ahora (\d+)", prompt)
+        content = json.dumps(
+            {"items": sct_items(int(match.group(1)) if match else 0, counter)},
+            ensure_ascii=False,
+        )
+        if rng.random() < args.malformed_rate:
+            # Respuesta truncada a la mitad, como cuando se agota num_predict
+            content = content[: len(content) // 2]
+        return content
+
+    def timings(prompt_tokens: int, tokens: int, first_token: float, generation: float) -> dict:
+        return {
+            "total_duration": int((first_token + generation) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(first_token * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(generation * 1e9),
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": MODEL}]}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        error = inject_error()
+        if error is not None:
+            return error
+        content = answer_for(body)
+        # Aproximación de Ollama: ~4 caracteres por token
+        chunks = [content[i:i + 4] for i in range(0, len(content), 4)]
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        first_token = latency()
+        per_token = 1 / args.tokens_per_second if args.tokens_per_second > 0 else 0.0
+        model = body.get("model", MODEL)
+
+        if body.get("stream", True) is False:
+            await asyncio.sleep(first_token + per_token * len(chunks))
+            return {
+                "model": model,
+                "message": {"role": "assistant", "content": content},
+                "done": True,
+                "done_reason": "stop",
+                **timings(prompt_tokens, len(chunks), first_token, per_token * len(chunks)),
+            }
+
+        async def stream():
+            started = time.monotonic()
+            await asyncio.sleep(first_token)
+            for chunk in chunks:
+                yield json.dumps({
+                    "model": model, "message": {"role": "assistant", "content": chunk}, "done": False
+                }) + "\n"
+                await asyncio.sleep(per_token)
+            yield json.dumps({
+                "model": model,
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "done_reason": "stop",
+                **timings(prompt_tokens, len(chunks), first_token, time.monotonic() - started - first_token),
+            }) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.post("/webhooks/rest/webhook")
+    async def rasa_webhook(body: dict):
+        error = inject_error()
+        if error is not None:
+            return error
+        await asyncio.sleep(rasa_latency())
+        return [{"recipient_id": body.get("sender", "default"), "text": CHAT_ANSWER}]
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", default="lognormal:300:0.5", help="tiempo hasta el primer token (ms)")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="0 = sin demora por token")
+    parser.add_argument("--rasa-latency", default="lognormal:80:0.3", help="latencia de Rasa (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de respuestas con error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fracción de JSON SCT truncado")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = build_parser().parse_args()
+    uvicorn.run(create_app(arguments), host=arguments.host, port=arguments.port, log_level="warning")
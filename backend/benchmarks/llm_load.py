@@ -0,0 +1,233 @@
+"""
+Prueba de carga de los endpoints que dependen del LLM y de Rasa.
+
+Envía una cantidad fija de peticiones a cada endpoint con concurrencia
+constante y reporta throughput y latencias p50/p95/p99 por endpoint (para
+el streaming SCT, también el tiempo hasta el primer ítem).
+
+Sin --url levanta todo localmente, sin GPU ni red: los servicios simulados
+de benchmarks/fake_services.py en lugar de Ollama y Rasa, y el backend real
+con uvicorn sobre una base SQLite temporal. Las variables de entorno del
+backend (LLM_MAX_IN_FLIGHT, SCT_PARALLEL, etc.) se pasan tal cual.
+
+Uso:
+    python benchmarks/llm_load.py --concurrency 8 --requests 100
+    python benchmarks/llm_load.py --endpoints sct,sct_stream --num-items 5 \\
+        --latency lognormal:500:0.6 --tokens-per-second 30 --malformed-rate 0.1
+    python benchmarks/llm_load.py --url http://localhost:8001 --endpoints chat
+
+Con --output se guardan los resultados en JSON para comparar ejecuciones.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import httpx
+
+from event_loop_latency import percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+FAKE_SERVICES = Path(__file__).resolve().parent / "fake_services.py"
+ENDPOINTS = ("chat", "llm", "sct", "sct_stream")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {timeout:.0f}s")
+
+
+@contextmanager
+def local_stack(args) -> Iterator[str]:
+    """Servicios simulados + backend; retorna la URL del backend"""
+    fake_port, backend_port = _free_port(), _free_port()
+    processes: List[subprocess.Popen] = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            processes.append(subprocess.Popen([
+                sys.executable, str(FAKE_SERVICES), "--port", str(fake_port),
+                "--latency", args.latency, "--tokens-per-second", str(args.tokens_per_second),
+                "--rasa-latency", args.rasa_latency, "--error-rate", str(args.error_rate),
+                "--malformed-rate", str(args.malformed_rate), "--seed", str(args.seed),
+            ]))
+            _wait_ready(f"http://127.0.0.1:{fake_port}/api/tags")
+
+            fake_url = f"http://127.0.0.1:{fake_port}"
+            env = {
+                "DATABASE_URL": f"sqlite:///{workdir}/benchmark.db",
+                "SCT_BANK_REFILL_INTERVAL": "0",
+                **os.environ,
+                "OLLAMA_URL": fake_url,
+                "RASA_URL": f"{fake_url}/webhooks/rest/webhook",
+            }
+            processes.append(subprocess.Popen(
+                [
+                    sys.executable, "-m", "uvicorn", "app.main:app",
+                    "--port", str(backend_port), "--log-level", "warning",
+                ],
+                cwd=BACKEND_DIR,
+                env=env,
+                stdout=None if args.verbose else subprocess.DEVNULL,
+                stderr=None if args.verbose else subprocess.DEVNULL,
+            ))
+            backend_url = f"http://127.0.0.1:{backend_port}"
+            _wait_ready(f"{backend_url}/health")
+            yield backend_url
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+async def call(client: httpx.AsyncClient, endpoint: str, args) -> Optional[float]:
+    """Una petición; retorna el tiempo hasta el primer ítem (solo streaming) o None"""
+    sct_body = {"num_items": args.num_items, "difficulty": "internado", "focus": "tuberculosis pulmonar"}
+    if endpoint == "chat":
+        response = await client.post("/api/chat", json={"text": "¿Qué es la tuberculosis?"})
+    elif endpoint == "llm":
+        response = await client.post("/api/llm/chat", json={
+            "model": "llama3:8b", "messages": [{"role": "user", "content": "¿Qué es la tuberculosis?"}],
+        })
+    elif endpoint == "sct":
+        response = await client.post("/api/sct/generate", json=sct_body)
+    else:
+        started = time.perf_counter()
+        first_item = None
+        async with client.stream("POST", "/api/sct/generate/stream", json=sct_body) as response:
+            async for line in response.aiter_lines():
+                if first_item is None and line.startswith('{"type": "item"'):
+                    first_item = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise httpx.HTTPStatusError(str(response.status_code), request=response.request, response=response)
+        return first_item
+    response.raise_for_status()
+    return None
+
+
+async def run_endpoint(client: httpx.AsyncClient, endpoint: str, args) -> dict:
+    latencies: List[float] = []
+    first_items: List[float] = []
+    statuses: Counter = Counter()
+    pending = iter(range(args.requests))
+
+    async def worker() -> None:
+        for _ in pending:
+            started = time.perf_counter()
+            try:
+                first_item = await call(client, endpoint, args)
+                statuses[200] += 1
+            except httpx.HTTPStatusError as e:
+                statuses[e.response.status_code] += 1
+                continue
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            if first_item is not None:
+                first_items.append(first_item)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "endpoint": endpoint,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "ok": len(latencies),
+        "errors": {str(status): count for status, count in statuses.items() if status != 200},
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+    }
+    for name, values in (("latency_ms", latencies), ("first_item_ms", first_items)):
+        if values:
+            result[name] = {
+                "p50": round(percentile(values, 0.5), 1),
+                "p95": round(percentile(values, 0.95), 1),
+                "p99": round(percentile(values, 0.99), 1),
+                "max": round(max(values), 1),
+            }
+    return result
+
+
+def report(result: dict) -> None:
+    latency = result.get("latency_ms", {})
+    errors = ", ".join(f"{status}: {count}" for status, count in result["errors"].items()) or "-"
+    print(
+        f"  {result['endpoint']:<11} ok={result['ok']:<5} {result['throughput_rps']:7.2f} req/s  "
+        f"p50={latency.get('p50', 0):8.1f}ms p95={latency.get('p95', 0):8.1f}ms "
+        f"p99={latency.get('p99', 0):8.1f}ms  errores: {errors}"
+    )
+    if "first_item_ms" in result:
+        first = result["first_item_ms"]
+        print(f"  {'':<11} primer ítem p50={first['p50']:.1f}ms p95={first['p95']:.1f}ms p99={first['p99']:.1f}ms")
+
+
+async def run(url: str, args) -> List[dict]:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    results = []
+    async with httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(600.0), limits=limits) as client:
+        print(f"{args.requests} peticiones por endpoint, concurrencia {args.concurrency} ({url}):")
+        for endpoint in args.endpoints:
+            result = await run_endpoint(client, endpoint, args)
+            report(result)
+            results.append(result)
+    return results
+
+
+def main(args) -> None:
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Endpoints desconocidos: {', '.join(sorted(unknown))}")
+    if args.url:
+        results = asyncio.run(run(args.url, args))
+    else:
+        with local_stack(args) as url:
+            results = asyncio.run(run(url, args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="backend ya corriendo; sin esto se levanta todo localmente")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        type=lambda value: [name.strip() for name in value.split(",") if name.strip()],
+                        help=f"separados por comas: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--requests", type=int, default=50, help="peticiones por endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--num-items", type=int, default=3, help="ítems por generación SCT")
+    parser.add_argument("--output", help="archivo JSON con los resultados")
+    parser.add_argument("--verbose", action="store_true", help="mostrar la salida del backend")
+    fake = parser.add_argument_group("servicios simulados (sin --url)")
+    fake.add_argument("--latency", default="lognormal:300:0.5", help="tiempo hasta el primer token (ms)")
+    fake.add_argument("--tokens-per-second", type=float, default=40.0)
+    fake.add_argument("--rasa-latency", default="lognormal:80:0.3")
+    fake.add_argument("--error-rate", type=float, default=0.0)
+    fake.add_argument("--malformed-rate", type=float, default=0.0)
+    fake.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -14,11 +14,32 @@ export async function sendChatMessage(text) {
   return res.json(); // { messages: [...] } desde FastAPI → Rasa
 }
 
-export async function generateSCT(numItems = 5, difficulty = "pregrado", focus = "tuberculosis pulmonar") {
+export async function generateSCT(numItems = 5, difficulty = "pregrado", focus = "tuberculosis pulmonar", parallel = null) {
   const res = await fetch(`${API_BASE}/api/sct/generate`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({ 
+      num_items: numItems,
+      difficulty: difficulty,
+      focus: focus,
+      parallel: parallel
+    }),
+  });
+
+  if (!res.ok) {
+    throw new Error(`Error API SCT: ${res.status}`);
+  }
+
+  return res.json();
+}
+
+// Igual que generateSCT, pero llama a onItem(item) con cada ítem apenas el
+// modelo lo termina de escribir. Retorna el evento final { total, ... }.
+export async function generateSCTStream(numItems = 5, difficulty = "pregrado", focus = "tuberculosis pulmonar", onItem = () => {}) {
+  const res = await fetch(`${API_BASE}/api/sct/generate/stream`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
       num_items: numItems,
       difficulty: difficulty,
       focus: focus
@@ -29,6 +50,49 @@ export async function generateSCT(numItems = 5, difficulty = "pregrado", focus =
     throw new Error(`Error API SCT: ${res.status}`);
   }
 
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let summary = null;
+
+  const handle = (line) => {
+    if (!line.trim()) return;
+    const event = JSON.parse(line);
+    if (event.type === "item") onItem(event.item);
+    else if (event.type === "error") throw new Error(event.detail);
+    else if (event.type === "done") summary = event;
+  };
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.forEach(handle);
+  }
+  handle(buffer);
+
+  return summary;
+}
+
+export async function assembleSCT(numItems = 5, difficulty = "pregrado", focus = "tuberculosis pulmonar", excludeIds = [], allowGenerate = true) {
+  const res = await fetch(`${API_BASE}/api/sct/assemble`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      num_items: numItems,
+      difficulty: difficulty,
+      focus: focus,
+      exclude_ids: excludeIds,
+      allow_generate: allowGenerate
+    }),
+  });
+
+  if (!res.ok) {
+    throw new Error(`Error API SCT: ${res.status}`);
+  }
+
   return res.json();
 }
 
@@ -62,14 +126,27 @@ export async function saveSCTTest(name, difficulty, focus, numItems, items) {
   return res.json();
 }
 
-export async function listSCTTests() {
-  const res = await fetch(`${API_BASE}/api/sct/list`);
-  
-  if (!res.ok) {
-    throw new Error(`Error API SCT List: ${res.status}`);
-  }
+// Recorre un listado paginado siguiendo el header X-Next-Cursor
+export async function fetchAllPages(url, errorLabel = "Error API") {
+  const items = [];
+  let cursor = null;
+  do {
+    const pageUrl = new URL(url);
+    if (cursor) pageUrl.searchParams.set("cursor", cursor);
+    const res = await fetch(pageUrl);
+
+    if (!res.ok) {
+      throw new Error(`${errorLabel}: ${res.status}`);
+    }
+
+    items.push(...(await res.json()));
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return items;
+}
 
-  return res.json();
+export async function listSCTTests() {
+  return fetchAllPages(`${API_BASE}/api/sct/list`, "Error API SCT List");
 }
 
 export async function getSCTTest(testId) {
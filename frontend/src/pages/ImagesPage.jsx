@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from "react";
 import { Link, useNavigate } from "react-router-dom";
 import { MedicalImageViewer } from "../components/MedicalImageViewer";
+import { fetchAllPages } from "../api";
 
 export function ImagesPage() {
   const navigate = useNavigate();
@@ -24,11 +25,8 @@ export function ImagesPage() {
   const loadImageLibrary = async () => {
     try {
       setLoading(true);
-      const response = await fetch("http://localhost:8001/api/medical-images/list");
-      if (response.ok) {
-        const data = await response.json();
-        setImageLibrary(data);
-      }
+      const data = await fetchAllPages("http://localhost:8001/api/medical-images/list");
+      setImageLibrary(data);
     } catch (error) {
       console.error("Error cargando biblioteca:", error);
     } finally {